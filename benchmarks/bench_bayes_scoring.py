@@ -0,0 +1,32 @@
+"""
+Сравнение скорости подсчета вероятности спама по словам сообщения: словари и Counter.most_common против numpy
+с argpartition и суммой логарифмов. Запуск: python -m benchmarks.bench_bayes_scoring
+"""
+import numpy as np
+
+from benchmarks.utils import measure, report, setup_django
+
+
+def main():
+    setup_django()
+
+    from spam_filter.learning_models import BayesModel
+    from spam_filter.tests import legacy
+
+    rng = np.random.RandomState(0)
+    sum_spam, sum_ham = 10 ** 6, 10 ** 6
+
+    for num_words in (50, 500, 5000, 50000):
+        spam_counts = rng.randint(0, 1000, num_words)
+        ham_counts = rng.randint(1, 1000, num_words)
+        word_dict = {'word%d' % i: (int(spam_counts[i]), int(ham_counts[i])) for i in range(num_words)}
+
+        report('Words in message: %d' % num_words, [
+            ('dict + Counter', measure(legacy.bayes_spam_probability, word_dict, sum_spam, sum_ham, repeat=20)),
+            ('numpy log-space', measure(BayesModel._get_spam_probability, spam_counts, ham_counts, sum_spam, sum_ham,
+                                        repeat=20)),
+        ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Пропускная способность подсчета слов при обучении байеса в зависимости от количества процессов.
+Запуск: python -m benchmarks.bench_bayes_train
+"""
+import time
+
+from benchmarks.utils import read_template, setup_django
+
+
+def main():
+    setup_django()
+
+    from django.conf import settings
+    from spam_filter.learning_models import BayesModel
+
+    spam = read_template('template_1.html')
+    ham = read_template('template_2.html')
+    # Разные письма, чтобы кэш слов не делал разбор бесплатным. Числа заменяются на number_spec, поэтому
+    # письма различаются словами
+    learning_content = [(spam + ' campaign' + 'x' * (i % 50), True) if i % 2 else (ham, False) for i in range(2000)]
+    processes = sorted({1, 2, 4, settings.NUM_CPU_CORES})
+
+    print('Messages: %d' % len(learning_content))
+
+    for processes_count in processes:
+        start_time = time.perf_counter()
+        BayesModel._count_words(learning_content, processes_count=processes_count)
+        seconds = time.perf_counter() - start_time
+        print('  %2d processes %10.4f s %10.1f messages/s' % (processes_count, seconds, len(learning_content) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Сравнение скорости поиска emoji: проверка каждого символа по словарю emoji.UNICODE_EMOJI против MultiStringMatcher,
+который ищет кандидатов по первым символам и распознает последовательности из нескольких символов.
+Запуск: python -m benchmarks.bench_emoji
+"""
+from benchmarks.utils import measure, report
+from spam_filter.content_parser import ContentParser
+from spam_filter.tests import legacy
+
+
+def main():
+    paragraphs = (
+        ('with emoji', 'Скидки до 70% только сегодня! 🔥 Успейте купить 🎁 подарки для всей семьи 👨‍👩‍👧. '
+                       'Sale ends tonight, do not miss it 😀 '),
+        ('plain text', 'Добрый день! Направляю вам счет на оплату за октябрь, акт сверки пришлю позже. '
+                       'Please find the invoice attached. '),
+    )
+
+    for name, paragraph in paragraphs:
+        for size in (10 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+            body = paragraph * (size // len(paragraph))
+
+            report('Body %s, size: %d KB' % (name, len(body) // 1024), [
+                ('per-character loop', measure(legacy.get_emojies, body, repeat=3)),
+                ('MultiStringMatcher', measure(ContentParser.get_emojies, body, repeat=3)),
+            ], size=len(body.encode()))
+
+
+if __name__ == '__main__':
+    main()
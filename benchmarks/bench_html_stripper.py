@@ -0,0 +1,44 @@
+"""
+Сравнение скорости извлечения текста из html: прежний HTMLParser с регулярными выражениями на каждом текстовом узле
+против HTMLStripper. Запуск: python -m benchmarks.bench_html_stripper
+"""
+from benchmarks.utils import measure, read_template, report
+from spam_filter.content_parser import HTMLStripper
+from spam_filter.tests import legacy
+
+
+def css_heavy_body(size: int) -> str:
+    """
+    Письмо с большим блоком стилей до первого тега и длинными текстовыми узлами с двоеточиями
+    """
+    css = ''.join('.c%d { color: #%06x; margin: 0 auto; }\n' % (i, i) for i in range(size // 80))
+    text = 'Note: price; delivery: tomorrow, call us: now ' * (size // 100)
+
+    return css + '<html><body><p>' + text + '</p></body></html>'
+
+
+def run(title: str, body: str):
+    stripper = HTMLStripper()
+    assert legacy.get_stripped_html(body) == stripper.get_clear_data(body)
+
+    def _legacy():
+        legacy.get_stripped_html(body)
+        legacy.get_num_html_colors(body)
+
+    report(title, [
+        ('HTMLParser + colors regex', measure(_legacy, repeat=3)),
+        ('HTMLStripper', measure(lambda: HTMLStripper().get_clear_data(body), repeat=3)),
+    ], size=len(body.encode()))
+
+
+def main():
+    for size in (256 * 1024, 1024 * 1024, 4 * 1024 * 1024):
+        run('Marketing template, %d KB' % (size // 1024), read_template('template_1.html', min_size=size))
+
+    # Прежняя реализация на таком содержимом работает за квадрат, поэтому размеры меньше
+    for size in (4 * 1024, 8 * 1024, 16 * 1024):
+        run('CSS-heavy body, %d KB' % (size // 1024), css_heavy_body(size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Время импорта модулей spam_filter. Каждый модуль импортируется в отдельном интерпретаторе после django.setup(),
+поэтому время включает все зависимости модуля, которые еще не были загружены. Запуск: python -m benchmarks.bench_import
+"""
+import subprocess
+import sys
+
+MODULES = ('spam_filter', 'spam_filter.utils', 'spam_filter.tokenizer', 'spam_filter.nlp_resources',
+           'spam_filter.content_parser', 'spam_filter.learning_models', 'spam_filter.views', 'spam_filter.tasks')
+
+SCRIPT = """
+import time
+from benchmarks.utils import setup_django
+setup_django()
+start_time = time.perf_counter()
+import {module}
+print(time.perf_counter() - start_time)
+"""
+
+
+def import_time(module: str) -> float:
+    """
+    Импортирует модуль в новом интерпретаторе
+    :param module: имя модуля
+    :return: время импорта в секундах
+    """
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(module=module)])
+
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    print('Import time')
+
+    for module in MODULES:
+        print('  %-30s %10.4f s' % (module, min(import_time(module) for _ in range(3))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Задержка проверки сообщения нейросетью: создание и компиляция модели с загрузкой весов на каждую проверку против
+модели процесса из NN.get_model, и проверка 100 сообщений по одному против одного вызова check_messages_for_spam.
+Сообщения разобраны заранее, поэтому замеряется только нейросеть.
+Запуск: python -m benchmarks.bench_nn_check
+"""
+import contextlib
+import io
+
+from benchmarks.utils import measure_percentiles, read_template, setup_django
+
+
+def main():
+    setup_django()
+
+    from spam_filter.content_parser import ContentParser
+    from spam_filter.learning_models import NN
+
+    parsed = ContentParser.parse_message(read_template('template_1.html'))
+    NN.check_message_for_spam(parsed)
+
+    def check_with_new_model():
+        # model.summary() печатает структуру при каждом создании модели
+        with contextlib.redirect_stdout(io.StringIO()):
+            NN.check_message_for_spam(parsed, nn=NN._get_model())
+
+    def check_one_by_one():
+        for message in batch:
+            NN.check_message_for_spam(message)
+
+    batch = [parsed] * 100
+    results = [
+        ('model per check', measure_percentiles(check_with_new_model, repeat=30)),
+        ('model per process', measure_percentiles(NN.check_message_for_spam, parsed, repeat=300)),
+        ('100 one by one', measure_percentiles(check_one_by_one, repeat=30)),
+        ('100 in one batch', measure_percentiles(NN.check_messages_for_spam, batch, repeat=30)),
+    ]
+
+    print('NN check latency')
+
+    for name, (p50, p99) in results:
+        print('  %-20s p50 %8.2f ms  p99 %8.2f ms' % (name, p50 * 1000, p99 * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Проверка сообщения нейросетью на keras и на numpy (NN_INFERENCE_BACKEND): задержка предсказания для одного
+сообщения и для пачки, и максимальная память процесса, который загрузил модель. Память замеряется в отдельном
+интерпретаторе для каждого варианта. Веса случайные, БД не нужна. Запуск: python -m benchmarks.bench_nn_inference
+"""
+import subprocess
+import sys
+
+import numpy as np
+
+from benchmarks.utils import measure_percentiles, setup_django
+
+SCRIPT = """
+import resource
+import numpy as np
+from benchmarks.utils import setup_django
+setup_django()
+from spam_filter.learning_models import NN
+from spam_filter.numpy_mlp import NumpyMLP
+weights = [np.zeros(shape) for shape in [(7, 128), (128,), (128, 64), (64,), (64, 1), (1,)]]
+if '{backend}' == 'numpy':
+    model = NumpyMLP(NN.architecture, weights)
+else:
+    model = NN._build_model()
+    model.set_weights(weights)
+model.predict(np.zeros((1, NN.num_metrics)))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def max_rss(backend: str) -> int:
+    """
+    Загружает модель в новом интерпретаторе
+    :param backend: 'keras' или 'numpy'
+    :return: максимальная память процесса в КБ
+    """
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(backend=backend)], stderr=subprocess.DEVNULL)
+
+    return int(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    setup_django()
+
+    from spam_filter.learning_models import NN
+    from spam_filter.numpy_mlp import NumpyMLP
+
+    keras_model = NN._build_model()
+    numpy_model = NumpyMLP(NN.architecture, keras_model.get_weights())
+    single = np.random.RandomState(0).uniform(0, 1, size=(1, NN.num_metrics))
+    batch = np.random.RandomState(1).uniform(0, 1, size=(100, NN.num_metrics))
+
+    print('NN predict latency')
+
+    for name, model in (('keras', keras_model), ('numpy', numpy_model)):
+        for size, x in (('1', single), ('100', batch)):
+            p50, p99 = measure_percentiles(model.predict, x, repeat=300)
+            print('  %-6s batch %-4s p50 %8.3f ms  p99 %8.3f ms' % (name, size, p50 * 1000, p99 * 1000))
+
+    print('Max RSS after model load')
+
+    for backend in ('keras', 'numpy'):
+        print('  %-6s %10.1f MB' % (backend, max_rss(backend) / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Сравнение скорости разбора обучающей выборки: ContentParser.parse_message для каждого сообщения против
+ContentParser.parse_batch пачками по PARSE_BATCH_SIZE сообщений. Запуск: python -m benchmarks.bench_parse_batch
+"""
+from benchmarks.utils import measure, read_template, report, setup_django
+
+
+def main():
+    setup_django()
+
+    from django.conf import settings
+    from spam_filter.content_parser import ContentParser
+    from spam_filter.nlp_resources import NLPResources
+
+    resources = NLPResources.get()
+    size = settings.PARSE_BATCH_SIZE
+    samples = [
+        read_template('template_1.html'),
+        read_template('template_2.html'),
+        'Hello! Your order is shipped, tracking number 1234567890. Best regards, shop team',
+        'Добрый день! Направляю счет на оплату, please confirm receiving the invoice',
+    ]
+
+    def parse_each(bodies):
+        resources.word_cache.clear()
+        return [ContentParser.parse_message(body) for body in bodies]
+
+    def parse_batches(bodies):
+        resources.word_cache.clear()
+        return [parsed for i in range(0, len(bodies), size) for parsed in ContentParser.parse_batch(bodies[i:i + size])]
+
+    for num_messages in (100, 1000, 5000):
+        bodies = [samples[i % len(samples)] for i in range(num_messages)]
+
+        report('Messages: %d' % num_messages, [
+            ('parse_message', measure(parse_each, bodies, repeat=3)),
+            ('parse_batch', measure(parse_batches, bodies, repeat=3)),
+        ], size=sum(len(body.encode()) for body in bodies))
+
+
+if __name__ == '__main__':
+    main()
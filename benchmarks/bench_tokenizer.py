@@ -0,0 +1,24 @@
+"""
+Сравнение скорости нормализации содержимого: 16 последовательных re.sub против SpecialCharTokenizer.
+Запуск: python -m benchmarks.bench_tokenizer
+"""
+from benchmarks.utils import measure, read_template, report
+from spam_filter.tests import legacy
+from spam_filter.tokenizer import SpecialCharTokenizer
+
+
+def main():
+    tokenizer = SpecialCharTokenizer()
+
+    for size in (50 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+        body = read_template('template_1.html', min_size=size)
+        assert legacy.replace_special_char(body) == tokenizer.tokenize(body)
+
+        report('Body size: %d KB' % (len(body) // 1024), [
+            ('re.sub x16', measure(legacy.replace_special_char, body, repeat=3)),
+            ('SpecialCharTokenizer', measure(tokenizer.tokenize, body, repeat=3)),
+        ], size=len(body.encode()))
+
+
+if __name__ == '__main__':
+    main()
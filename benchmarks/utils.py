@@ -0,0 +1,82 @@
+import os
+import time
+from typing import Callable, List, Tuple
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'spam_filter', 'tests', 'html_templates')
+
+
+def setup_django():
+    """
+    Настраивает django для бенчмарков, которым нужны модели и БД
+    """
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_ml_spam_filter.settings')
+    django.setup()
+
+
+def read_template(name: str, min_size: int = 0) -> str:
+    """
+    Читает шаблон письма из тестов, при необходимости размножая его до нужного размера
+    :param name: имя файла шаблона
+    :param min_size: минимальный размер содержимого в символах
+    :return: содержимое
+    """
+    with open(os.path.join(TEMPLATES_DIR, name), 'r') as f:
+        body = f.read()
+
+    return body * max(1, -(-min_size // len(body)))
+
+
+def measure(func: Callable, *args, repeat: int = 5, **kwargs) -> float:
+    """
+    Измеряет время выполнения функции
+    :param func: функция
+    :param repeat: количество повторений. Берется лучший результат
+    :return: время одного вызова в секундах
+    """
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def measure_percentiles(func: Callable, *args, repeat: int = 100, percentiles: Tuple[int, ...] = (50, 99),
+                        **kwargs) -> List[float]:
+    """
+    Измеряет задержку отдельных вызовов функции
+    :param func: функция
+    :param repeat: количество вызовов
+    :param percentiles: перцентили
+    :return: время вызова в секундах для каждого перцентиля
+    """
+    import numpy as np
+
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+
+    return [float(value) for value in np.percentile(timings, percentiles)]
+
+
+def report(title: str, results: List[Tuple[str, float]], size: int = 0):
+    """
+    Печатает результаты замеров. Ускорение считается относительно первого результата
+    :param title: заголовок
+    :param results: список (название, время в секундах)
+    :param size: размер обработанных данных в байтах для расчета пропускной способности
+    """
+    print(title)
+    base = results[0][1]
+
+    for name, seconds in results:
+        throughput = ' %8.2f MB/s' % (size / seconds / 2 ** 20) if size else ''
+        print('  %-30s %10.4f s%s  x%.2f' % (name, seconds, throughput, base / seconds))
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_init
 
 from django.conf import settings
 
@@ -7,3 +8,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_ml_spam_filter.settings'
 celery_app = Celery()
 celery_app.config_from_object(settings)
 celery_app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+@worker_init.connect
+def preload_resources(**_):
+    """
+    Загружает тяжелые ресурсы до форка процессов пула, чтобы задачи не платили за их загрузку
+    """
+    from spam_filter.nlp_resources import NLPResources
+
+    NLPResources.preload()
+
@@ -0,0 +1,22 @@
+"""
+Настройки gunicorn: gunicorn --config python:django_ml_spam_filter.gunicorn_config
+"""
+import logging
+
+logger = logging.getLogger('default')
+
+
+def post_fork(server, worker):
+    """
+    Загружает модель нейросети в каждом воркере сразу после форка, чтобы первый запрос не платил за создание
+    модели. tensorflow нельзя инициализировать в мастер-процессе до форка, поэтому с --preload это делается здесь.
+    Исключение в post_fork останавливает весь gunicorn, поэтому ошибка только логируется: модель загрузится при
+    первой проверке
+    """
+    try:
+        from spam_filter.learning_models import NN
+
+        NN.get_model()
+    except Exception as ex:
+        logger.exception('NN model preload in worker %s failed, it will be loaded on first use: %s'
+                         % (worker.pid, ex))
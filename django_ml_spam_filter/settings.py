@@ -130,6 +130,14 @@ CELERYBEAT_SCHEDULE = {
     'process_auto_learning': {
         'task': 'spam_filter.tasks.process_auto_learning',
         'schedule': datetime.timedelta(minutes=30),
+    },
+    'compact_bayes_dictionary': {
+        'task': 'spam_filter.tasks.compact_bayes_dictionary',
+        'schedule': datetime.timedelta(days=1),
+    },
+    'compact_bayes_deltas': {
+        'task': 'spam_filter.tasks.compact_bayes_deltas',
+        'schedule': datetime.timedelta(minutes=1),
     }
 }
 
@@ -160,11 +168,73 @@ DATABASES = getattr(config, 'DATABASES', {})
 CACHEOPS_ENABLED = getattr(config, 'CACHEOPS_ENABLED', True)
 CACHEOPS_REDIS = getattr(config, 'CACHEOPS_REDIS', {})
 
-CACHEOPS = {
-    'spam_filter.BayesDictionary': {'ops': 'all', 'timeout': 60 * 60 * 24}
-}
+# Запросы к BayesDictionary не кэшируются cacheops: после обучения пришлось бы сбрасывать кэш каждого измененного
+# слова. Появления слов кэшируются по версии словаря в BayesCountsCache
+CACHEOPS = {}
 
 # Прочее
 AUTO_LEARNING_ENABLED = getattr(config, 'AUTO_LEARNING_ENABLED', False)
 
 NUM_CPU_CORES = getattr(config, 'NUM_CPU_CORES', 4)
+
+# Максимальное количество слов в кэше результатов лемматизации и стемминга каждого процесса
+NLP_WORD_CACHE_SIZE = getattr(config, 'NLP_WORD_CACHE_SIZE', 50000)
+
+# Количество сообщений, которые процесс обучения разбирает за один вызов ContentParser.parse_batch
+PARSE_BATCH_SIZE = getattr(config, 'PARSE_BATCH_SIZE', 100)
+
+# Кэш результатов разбора сообщений по хэшу содержимого. Размер кэша в памяти каждого процесса
+PARSE_CACHE_SIZE = getattr(config, 'PARSE_CACHE_SIZE', 10000)
+# Второй уровень кэша в redis из CACHEOPS_REDIS, общий для всех процессов
+PARSE_CACHE_REDIS_ENABLED = getattr(config, 'PARSE_CACHE_REDIS_ENABLED', False)
+PARSE_CACHE_TIMEOUT = getattr(config, 'PARSE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Ограничения на разбор сообщения при проверке. От содержимого длиннее PARSE_MAX_BODY_SIZE байт в utf-8 или
+# PARSE_MAX_TOKENS слов разбирается только начало. Слова, до которых разбор дошел после PARSE_DEADLINE секунд,
+# разбираются упрощенно. 0 или None - без ограничения
+PARSE_MAX_BODY_SIZE = getattr(config, 'PARSE_MAX_BODY_SIZE', 1024 * 1024)
+PARSE_MAX_TOKENS = getattr(config, 'PARSE_MAX_TOKENS', 20000)
+PARSE_DEADLINE = getattr(config, 'PARSE_DEADLINE', None)
+
+# Снимок словаря BayesDictionary в памяти каждого процесса. Версия словаря сверяется с БД не чаще, чем раз в
+# BAYES_SNAPSHOT_CHECK_INTERVAL секунд. Словарь больше BAYES_SNAPSHOT_MAX_WORDS слов читается из БД
+BAYES_SNAPSHOT_ENABLED = getattr(config, 'BAYES_SNAPSHOT_ENABLED', True)
+BAYES_SNAPSHOT_CHECK_INTERVAL = getattr(config, 'BAYES_SNAPSHOT_CHECK_INTERVAL', 5)
+BAYES_SNAPSHOT_MAX_WORDS = getattr(config, 'BAYES_SNAPSHOT_MAX_WORDS', 2000000)
+
+# Сжатие словаря байеса: удаляются слова, которые встречались меньше BAYES_COMPACT_MIN_COUNT раз, слова
+# с |p - 0.5| меньше BAYES_COMPACT_MIN_DEVIATION и все слова сверх BAYES_COMPACT_MAX_WORDS самых значимых.
+# Периодическая задача выполняется, только если включен BAYES_COMPACTION_ENABLED
+BAYES_COMPACTION_ENABLED = getattr(config, 'BAYES_COMPACTION_ENABLED', False)
+BAYES_COMPACT_MIN_COUNT = getattr(config, 'BAYES_COMPACT_MIN_COUNT', 2)
+BAYES_COMPACT_MIN_DEVIATION = getattr(config, 'BAYES_COMPACT_MIN_DEVIATION', 0)
+BAYES_COMPACT_MAX_WORDS = getattr(config, 'BAYES_COMPACT_MAX_WORDS', None)
+
+# Файл словаря байеса из bayes_export. Если задан, процессы проверяют сообщения по отображенному в память файлу
+# вместо БД и снимка. Подмена файла замечается не позже, чем через BAYES_SNAPSHOT_CHECK_INTERVAL секунд.
+# Обучение файл не меняет: пока версия файла отстает от словаря, проверка идет по снимку или БД
+BAYES_MMAP_PATH = getattr(config, 'BAYES_MMAP_PATH', None)
+
+# Хранение словаря байеса: 'words' - таблица BayesDictionary по словам, 'hashed' - появления слов по
+# 2 ** BAYES_HASH_BITS корзинам хэшей. Размер 'hashed' не зависит от количества слов: 8 * 2 ** BAYES_HASH_BITS байт
+BAYES_STORAGE = getattr(config, 'BAYES_STORAGE', 'words')
+BAYES_HASH_BITS = getattr(config, 'BAYES_HASH_BITS', 20)
+
+# Запись обучения байеса: 'direct' - сразу в BayesDictionary с блокировкой обновляемых слов, 'log' - в журнал
+# BayesDelta без блокировок. Журнал переносится в словарь задачей compact_bayes_deltas порциями
+# по BAYES_DELTA_COMPACT_BATCH_SIZE строк. Обучение с init всегда пишет в словарь напрямую
+BAYES_WRITE_MODE = getattr(config, 'BAYES_WRITE_MODE', 'direct')
+BAYES_DELTA_COMPACT_BATCH_SIZE = getattr(config, 'BAYES_DELTA_COMPACT_BATCH_SIZE', 10000)
+
+# Кэш появлений слов байеса в redis для проверки без снимка словаря. Ключи содержат версию словаря, поэтому после
+# обучения кэш не сбрасывается, а старые значения истекают через BAYES_CACHE_TIMEOUT секунд
+BAYES_CACHE_ENABLED = getattr(config, 'BAYES_CACHE_ENABLED', CACHEOPS_ENABLED)
+BAYES_CACHE_TIMEOUT = getattr(config, 'BAYES_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Модель нейросети создается один раз на процесс. Версия весов сверяется с БД не чаще, чем раз в
+# NN_MODEL_CHECK_INTERVAL секунд
+NN_MODEL_CHECK_INTERVAL = getattr(config, 'NN_MODEL_CHECK_INTERVAL', 5)
+
+# Вычисление нейросети при проверке сообщений: 'keras' - модель keras, 'numpy' - прямой проход на numpy (NumpyMLP)
+# по тем же весам. С 'numpy' процессы проверки не импортируют tensorflow, он нужен только для обучения
+NN_INFERENCE_BACKEND = getattr(config, 'NN_INFERENCE_BACKEND', 'keras')
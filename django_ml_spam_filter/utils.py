@@ -1,4 +1,5 @@
-from typing import Callable, Optional, List, Any, Iterable, Tuple
+from queue import Empty
+from typing import Callable, Optional, List, Any, Iterable, Iterator, Tuple
 
 from django.conf import settings
 from django.db import connections
@@ -53,16 +54,38 @@ def exec_in_parallel(func: Callable, func_args: Iterable[Tuple[tuple, dict]] = N
     :param need_db_refresh: Если внутри func делаются запросы к БД, то необходимо обновить соединения внутри процессов
     :return: Список результатов. Порядок не гарантируется. Тип элементов зависит от func
     """
+    return list(iter_in_parallel(func, func_args, processes_count=processes_count, need_db_refresh=need_db_refresh))
+
+
+def iter_in_parallel(func: Callable, func_args: Iterable[Tuple[tuple, dict]] = None,
+                     processes_count: Optional[int] = settings.NUM_CPU_CORES, need_db_refresh: Optional[bool] = False) \
+        -> Iterator[Any]:
+    """
+    То же, что exec_in_parallel, но отдает результаты по мере готовности, не дожидаясь завершения всех процессов.
+    Вызывающий может обработать и отпустить каждый результат, поэтому в памяти не копятся все результаты сразу
+    :param func: Функция для выполнения
+    :param func_args: Iterable[((args), {kwargs})]
+    :param processes_count: Количество потоков, которые могут быть запущены параллельно
+    :param need_db_refresh: Если внутри func делаются запросы к БД, то необходимо обновить соединения внутри процессов
+    :return: Iterator результатов. Порядок не гарантируется. Тип элементов зависит от func
+    """
     manager = Manager()
     args_queue = manager.Queue()
     results_queue = manager.Queue()
+    num_tasks = 0
 
     for args, kwargs in func_args:
         args_queue.put((args, kwargs))
+        num_tasks += 1
 
     def _worker(arg_q, res_q, worker_func):
-        while not args_queue.empty():
-            args, kwargs = arg_q.get()
+        while True:
+            # Между проверкой empty() и get() последнее задание может забрать другой процесс, и get() зависнет
+            try:
+                args, kwargs = arg_q.get_nowait()
+            except Empty:
+                break
+
             local_res = worker_func(*args, **kwargs)
             res_q.put(local_res)
             arg_q.task_done()
@@ -70,16 +93,22 @@ def exec_in_parallel(func: Callable, func_args: Iterable[Tuple[tuple, dict]] = N
     processes = [DBProcess(target=_worker, args=(args_queue, results_queue, func), need_db_refresh=need_db_refresh)
                  for _ in range(processes_count)]
 
-    # Ждем окончания процесса
     for proc in processes:
         proc.start()
 
-    for proc in processes:
-        proc.join()
-
-    results = []
-
-    while not results_queue.empty():
-        results.append(results_queue.get())
-
-    return results
+    try:
+        for _ in range(num_tasks):
+            while True:
+                try:
+                    yield results_queue.get(timeout=1)
+                    break
+                except Empty:
+                    # Процесс, упавший с исключением, не вернет результат. Не ждем его вечно
+                    if not any(proc.is_alive() for proc in processes) and results_queue.empty():
+                        raise RuntimeError('Parallel workers exited before returning all results')
+    finally:
+        # Ждем окончания процесса
+        for proc in processes:
+            proc.join()
+
+        manager.shutdown()
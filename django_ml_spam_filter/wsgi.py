@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_ml_spam_filter.settings')
 
 application = get_wsgi_application()
+
+# gunicorn запускается с --preload: анализаторы загружаются в мастер-процессе один раз и разделяются воркерами
+from spam_filter.nlp_resources import NLPResources  # noqa: E402
+
+NLPResources.preload()
@@ -0,0 +1,85 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from redis import RedisError
+from statsd.defaults.django import statsd
+
+logger = logging.getLogger('default')
+
+
+class BayesCountsCache:
+    """
+    Кэш появлений слов словаря байеса в redis из CACHEOPS_REDIS для проверки без снимка словаря.
+    В ключ входит версия словаря из BayesMetadata, которую увеличивает каждое обучение. Поэтому после обучения ничего
+    не сбрасывается: новые запросы идут по новым ключам, а старые значения истекают через BAYES_CACHE_TIMEOUT.
+    Слова, которых нет в словаре, тоже кэшируются. Все слова сообщения читаются одним MGET, промахи записываются
+    одним pipeline. Попадания и промахи отправляются в statsd: bayes_cache.hit, bayes_cache.miss
+    """
+    prefix = 'bayes_counts'
+
+    @classmethod
+    def get_key(cls, version: int, word: str) -> str:
+        """
+        Ключ кэша для слова
+        :param version: версия словаря
+        :param word: слово
+        :return: ключ
+        """
+        return '%s:%d:%s' % (cls.prefix, version, word)
+
+    @classmethod
+    def get_many(cls, version: int, words: List[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        """
+        Получает появления слов из кэша
+        :param version: версия словаря
+        :param words: слова
+        :return: словарь слово -> (появлений в спаме, появлений в хаме) или None, если слова нет в словаре.
+        Слов, которых нет в кэше, нет и в результате
+        """
+        if not settings.BAYES_CACHE_ENABLED or not words:
+            return {}
+
+        from cacheops.redis import redis_client
+
+        try:
+            values = redis_client.mget([cls.get_key(version, word) for word in words])
+        except RedisError as ex:
+            # Недоступный redis не должен ломать проверку сообщений. Слова будут прочитаны из БД
+            logger.warning('Bayes cache redis get failed: %s' % ex)
+            return {}
+
+        result = {}
+
+        for word, value in zip(words, values):
+            if value is not None:
+                result[word] = tuple(map(int, value.split(b':'))) if value else None
+
+        statsd.incr('bayes_cache.hit', len(result))
+        statsd.incr('bayes_cache.miss', len(words) - len(result))
+
+        return result
+
+    @classmethod
+    def set_many(cls, version: int, counts: Iterable[Tuple[str, Optional[Tuple[int, int]]]]) -> None:
+        """
+        Сохраняет появления слов в кэш
+        :param version: версия словаря
+        :param counts: Iterable[(слово, (появлений в спаме, появлений в хаме) или None, если слова нет в словаре)]
+        :return: None
+        """
+        if not settings.BAYES_CACHE_ENABLED:
+            return
+
+        from cacheops.redis import redis_client
+
+        try:
+            pipeline = redis_client.pipeline(transaction=False)
+
+            for word, word_counts in counts:
+                pipeline.set(cls.get_key(version, word), '%d:%d' % word_counts if word_counts else '',
+                             ex=settings.BAYES_CACHE_TIMEOUT)
+
+            pipeline.execute()
+        except RedisError as ex:
+            logger.warning('Bayes cache redis set failed: %s' % ex)
@@ -0,0 +1,246 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from spam_filter.models import BayesMetadata
+
+logger = logging.getLogger('default')
+
+
+class BayesFile:
+    """
+    Словарь байеса в бинарном файле, который можно отобразить в память (mmap).
+
+    Формат (little-endian):
+    - заголовок, header_size байт: magic, версия словаря, количество слов, всего слов в спаме, всего слов в хаме,
+      размер блока слов;
+    - смещения слов в блоке слов, uint64[количество слов + 1];
+    - ключи слов: первые 8 байт слова, дополненные нулями, как big-endian число, uint64[количество слов];
+    - появления слов в спаме, uint32[количество слов];
+    - появления слов в хаме, uint32[количество слов];
+    - блок слов: слова в utf-8 подряд, отсортированные по байтам.
+
+    Файл не разбирается при открытии: массивы numpy и смещения ссылаются прямо на отображенные страницы, поэтому
+    процессы на одной машине делят одну копию словаря в page cache. Ключи упорядочены так же, как слова, поэтому
+    np.searchsorted по ключам сразу для всех слов сообщения сужает поиск до слов с одинаковым началом, которые
+    сравниваются уже побайтно.
+    """
+    magic = b'BAYESMM1'
+    header = struct.Struct('<8sQQQQQ')
+    header_size = 64
+
+    _instance = None
+    _file_id = None
+    _checked_at = None
+    _stale = False
+    _lock = threading.Lock()
+
+    def __init__(self, path: str):
+        """
+        :param path: путь к файлу
+        """
+        start_time = time.perf_counter()
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, num_words, self.spam_total, self.ham_total, blob_size = \
+            self.header.unpack_from(self._mmap)
+
+        if magic != self.magic:
+            raise ValueError('%s is not a bayes dictionary file' % path)
+
+        self.num_words = num_words
+        offsets_start = self.header_size
+        keys_start = offsets_start + 8 * (num_words + 1)
+        spam_start = keys_start + 8 * num_words
+        ham_start = spam_start + 4 * num_words
+        self.blob_start = ham_start + 4 * num_words
+
+        if len(self._mmap) != self.blob_start + blob_size:
+            raise ValueError('%s is truncated or corrupted' % path)
+
+        # memoryview отдает смещения как int без создания скаляров numpy на каждом шаге поиска
+        self.offsets = memoryview(self._mmap)[offsets_start:keys_start].cast('Q')
+        self.keys = np.frombuffer(self._mmap, dtype='<u8', count=num_words, offset=keys_start)
+        self.spam_counts = np.frombuffer(self._mmap, dtype='<u4', count=num_words, offset=spam_start)
+        self.ham_counts = np.frombuffer(self._mmap, dtype='<u4', count=num_words, offset=ham_start)
+        self.load_time = time.perf_counter() - start_time
+
+    def __len__(self) -> int:
+        return self.num_words
+
+    @classmethod
+    def write(cls, path: str, version: int, spam_total: int, ham_total: int,
+              words: Iterable[Tuple[str, int, int]]) -> int:
+        """
+        Записывает словарь в файл. Файл пишется во временный и подменяется атомарно, поэтому процессы, которые
+        уже отобразили старый файл, продолжают работать со старой копией
+        :param path: путь к файлу
+        :param version: версия словаря
+        :param spam_total: всего появлений слов в спаме
+        :param ham_total: всего появлений слов в хаме
+        :param words: Iterable[(слово, появлений в спаме, появлений в хаме)]
+        :return: количество записанных слов
+        """
+        rows = sorted((word.encode('utf-8'), spam_count, ham_count) for word, spam_count, ham_count in words)
+        counts = np.array([row[1:] for row in rows], dtype=np.int64).reshape(-1, 2)
+
+        if len(counts) and (counts.min() < 0 or counts.max() > np.iinfo(np.uint32).max):
+            raise ValueError('Word counts do not fit into uint32')
+
+        blob = b''.join(row[0] for row in rows)
+        offsets = np.zeros(len(rows) + 1, dtype='<u8')
+        np.cumsum([len(row[0]) for row in rows], out=offsets[1:])
+
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.header.pack(cls.magic, version, len(rows), spam_total, ham_total, len(blob))
+                    .ljust(cls.header_size, b'\0'))
+            f.write(offsets.tobytes())
+            f.write(cls._get_keys([row[0] for row in rows]).astype('<u8').tobytes())
+            f.write(counts[:, 0].astype('<u4').tobytes())
+            f.write(counts[:, 1].astype('<u4').tobytes())
+            f.write(blob)
+
+        os.replace(tmp_path, path)
+
+        return len(rows)
+
+    @staticmethod
+    def _get_keys(words: List[bytes]) -> np.ndarray:
+        """
+        Ключи слов: первые 8 байт как big-endian число. Слова в utf-8 не содержат нулевых байт, поэтому порядок
+        ключей совпадает с порядком слов
+        :param words: слова в utf-8
+        :return: массив uint64
+        """
+        prefixes = b''.join(word[:8].ljust(8, b'\0') for word in words)
+
+        return np.frombuffer(prefixes, dtype='>u8').astype(np.uint64)
+
+    def _get_word(self, position: int) -> bytes:
+        """
+        :param position: номер слова
+        :return: слово в utf-8
+        """
+        return self._mmap[self.blob_start + self.offsets[position]:self.blob_start + self.offsets[position + 1]]
+
+    def iter_words(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        Все слова файла в порядке сортировки
+        :return: Iterator[(слово, появлений в спаме, появлений в хаме)]
+        """
+        for position in range(self.num_words):
+            yield self._get_word(position).decode('utf-8'), int(self.spam_counts[position]), \
+                int(self.ham_counts[position])
+
+    def find(self, words: Iterable[str]) -> Tuple[List[str], List[int]]:
+        """
+        Ищет слова в файле
+        :param words: слова
+        :return: слова, которые есть в файле, и их номера
+        """
+        words = list(words)
+        encoded = [word.encode('utf-8') for word in words]
+        keys = self._get_keys(encoded)
+        starts = self.keys.searchsorted(keys, side='left').tolist()
+        ends = self.keys.searchsorted(keys, side='right').tolist()
+        found_words = []
+        positions = []
+
+        for word, encoded_word, lo, hi in zip(words, encoded, starts, ends):
+            # Бинарный поиск только среди слов с тем же ключом. Обычно такое слово одно или ни одного
+            while lo < hi:
+                mid = (lo + hi) // 2
+
+                if self._get_word(mid) < encoded_word:
+                    lo = mid + 1
+                else:
+                    hi = mid
+
+            if lo < self.num_words and self._get_word(lo) == encoded_word:
+                found_words.append(word)
+                positions.append(lo)
+
+        return found_words, positions
+
+    def get_counts(self, words: Iterable[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Количество появлений слов в спаме и хаме
+        :param words: слова
+        :return: слова, которые есть в словаре, и массивы их появлений в спаме и в хаме
+        """
+        found_words, positions = self.find(words)
+
+        return found_words, self.spam_counts[positions], self.ham_counts[positions]
+
+    @classmethod
+    def get(cls) -> Optional['BayesFile']:
+        """
+        Возвращает файл словаря процесса из BAYES_MMAP_PATH. Раз в BAYES_SNAPSHOT_CHECK_INTERVAL секунд проверяет,
+        не подменили ли файл, и открывает новый. Файл не обновляется при обучении: если его версия отстает от
+        версии словаря в BayesMetadata, он не используется, пока bayes_export не выгрузит словарь заново
+        :return: BayesFile или None, если BAYES_MMAP_PATH не задан, файл не открывается или устарел
+        """
+        path = settings.BAYES_MMAP_PATH
+
+        if not path:
+            return None
+
+        now = time.monotonic()
+
+        if cls._checked_at is None or now - cls._checked_at >= settings.BAYES_SNAPSHOT_CHECK_INTERVAL:
+            with cls._lock:
+                if cls._checked_at is None or now - cls._checked_at >= settings.BAYES_SNAPSHOT_CHECK_INTERVAL:
+                    try:
+                        stat = os.stat(path)
+                        file_id = (path, stat.st_ino, stat.st_mtime_ns)
+
+                        if file_id != cls._file_id:
+                            cls._instance = cls(path)
+                            cls._file_id = file_id
+                            logger.info('Bayes file %s version %d mapped in %.3f s: %d words'
+                                        % (path, cls._instance.version, cls._instance.load_time, len(cls._instance)))
+                    except (OSError, ValueError) as e:
+                        logger.error('Bayes file %s is unavailable, falling back: %s' % (path, e))
+                        cls._instance = None
+                        cls._file_id = None
+
+                    if cls._instance is not None:
+                        version = BayesMetadata.objects.get_version()
+                        stale = cls._instance.version != version
+
+                        if stale and not cls._stale:
+                            logger.warning('Bayes file %s version %d is older than dictionary version %d, '
+                                           'falling back until it is exported again'
+                                           % (path, cls._instance.version, version))
+
+                        cls._stale = stale
+
+                    cls._checked_at = now
+
+        return cls._instance if not cls._stale else None
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        Статистика файла словаря текущего процесса
+        :return: словарь с флагами загрузки и устаревания, путем, версией и количеством слов
+        """
+        instance = cls._instance
+
+        if instance is None:
+            return {'loaded': False, 'stale': False, 'path': None, 'version': None, 'words': 0}
+
+        return {'loaded': True, 'stale': cls._stale, 'path': instance.path, 'version': instance.version,
+                'words': len(instance)}
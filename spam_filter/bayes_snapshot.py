@@ -0,0 +1,294 @@
+import logging
+import sys
+import threading
+import time
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from spam_filter.models import BayesDelta, BayesDictionary, BayesHashedCounts, BayesMetadata
+
+logger = logging.getLogger('default')
+
+
+class BayesSnapshot:
+    """
+    Копия словаря BayesDictionary в памяти процесса: индекс слов и массивы numpy с количеством появлений слова
+    в спаме и хаме. Проверка сообщения по снимку не делает запросов ни в БД, ни в redis.
+
+    Актуальность снимка определяется по версии BayesMetadata, которую увеличивает каждое обучение. Версия
+    проверяется не чаще, чем раз в BAYES_SNAPSHOT_CHECK_INTERVAL секунд, поэтому после обучения в другом процессе
+    старый снимок может использоваться еще столько же времени. Если словарь больше BAYES_SNAPSHOT_MAX_WORDS слов
+    или снимки отключены, снимка нет и проверка идет через БД.
+    """
+    _instance = None
+    _checked_at = None
+    _lock = threading.Lock()
+
+    def __init__(self, version: int, words: Iterable[Tuple[str, int, int]]):
+        """
+        :param version: версия словаря, с которой сделан снимок
+        :param words: Iterable[(слово, появлений в спаме, появлений в хаме)]
+        """
+        start_time = time.perf_counter()
+        self.version = version
+        self.index = {}
+        spam_counts = []
+        ham_counts = []
+
+        for word, spam_count, ham_count in words:
+            self.index[word] = len(spam_counts)
+            spam_counts.append(spam_count)
+            ham_counts.append(ham_count)
+
+        self.spam_counts = np.array(spam_counts, dtype=np.uint32)
+        self.ham_counts = np.array(ham_counts, dtype=np.uint32)
+        self.spam_total = int(self.spam_counts.sum(dtype=np.uint64))
+        self.ham_total = int(self.ham_counts.sum(dtype=np.uint64))
+        self.load_time = time.perf_counter() - start_time
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @classmethod
+    def load(cls, version: int) -> Optional['BayesSnapshot']:
+        """
+        Загружает снимок словаря из БД. В режиме BAYES_WRITE_MODE = 'log' к словарю добавляются еще не перенесенные
+        приращения из журнала
+        :param version: текущая версия словаря. Версия читается до самого словаря, поэтому обучение, которое
+        завершилось между запросами, только вызовет лишнюю перезагрузку
+        :return: BayesSnapshot или None, если словарь слишком большой
+        """
+        queryset = BayesDictionary.objects.nocache()
+        num_words = queryset.count()
+
+        if num_words > settings.BAYES_SNAPSHOT_MAX_WORDS:
+            logger.warning('Bayes dictionary has %d words, snapshot limit is %d. Falling back to database'
+                           % (num_words, settings.BAYES_SNAPSHOT_MAX_WORDS))
+            return None
+
+        if settings.BAYES_WRITE_MODE == 'log':
+            words = BayesDelta.objects.get_merged_counts()
+        else:
+            words = queryset.values_list('word', 'spam_count', 'ham_count').iterator()
+
+        snapshot = cls(version, words)
+        logger.info('Bayes snapshot version %d loaded in %.3f s: %d words, memory: %d bytes'
+                    % (version, snapshot.load_time, len(snapshot), snapshot.memory_usage()))
+
+        return snapshot
+
+    @classmethod
+    def get(cls) -> Optional['BayesSnapshot']:
+        """
+        Возвращает актуальный снимок процесса. Раз в BAYES_SNAPSHOT_CHECK_INTERVAL секунд сверяет версию с БД и
+        перезагружает снимок, если словарь изменился
+        :return: BayesSnapshot или None, если снимки отключены или словарь слишком большой
+        """
+        if not cls.is_enabled():
+            return None
+
+        now = time.monotonic()
+
+        if cls._checked_at is None or now - cls._checked_at >= settings.BAYES_SNAPSHOT_CHECK_INTERVAL:
+            with cls._lock:
+                if cls._checked_at is None or now - cls._checked_at >= settings.BAYES_SNAPSHOT_CHECK_INTERVAL:
+                    version = BayesMetadata.objects.get_version()
+
+                    if cls._instance is None or cls._instance.version != version:
+                        # Устаревший снимок не используется, даже если новый загрузить нельзя
+                        cls._instance = None
+                        cls._instance = cls.load(version)
+
+                    cls._checked_at = now
+
+        return cls._instance
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        """
+        :return: используются ли снимки
+        """
+        return settings.BAYES_SNAPSHOT_ENABLED
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """
+        Сбрасывает снимок процесса. Вызывается после обучения, чтобы процесс, который обучал словарь, сразу
+        проверял сообщения по новым данным
+        :return: None
+        """
+        with cls._lock:
+            cls._instance = None
+            cls._checked_at = None
+
+    def get_counts(self, words: Iterable[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Количество появлений слов в спаме и хаме
+        :param words: слова
+        :return: слова, которые есть в словаре, и массивы их появлений в спаме и в хаме
+        """
+        index = self.index
+        found_words = [word for word in words if word in index]
+        positions = [index[word] for word in found_words]
+
+        return found_words, self.spam_counts[positions], self.ham_counts[positions]
+
+    def memory_usage(self) -> int:
+        """
+        Примерный размер снимка в памяти: индекс, строки слов и массивы
+        :return: размер в байтах
+        """
+        return sys.getsizeof(self.index) + sum(map(sys.getsizeof, self.index)) + self.spam_counts.nbytes + \
+            self.ham_counts.nbytes
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        Статистика снимка текущего процесса
+        :return: словарь с флагом загрузки, версией, количеством слов, временем загрузки и размером в памяти
+        """
+        instance = cls._instance
+
+        if instance is None:
+            return {'loaded': False, 'version': None, 'words': 0, 'load_time': None, 'memory_usage': 0}
+
+        return {'loaded': True, 'version': instance.version, 'words': len(instance), 'load_time': instance.load_time,
+                'memory_usage': instance.memory_usage()}
+
+
+class BayesHashedSnapshot(BayesSnapshot):
+    """
+    Снимок словаря в режиме BAYES_STORAGE = 'hashed'. Слово попадает в корзину по crc32 (hash() в python
+    отличается между процессами), появления в спаме и хаме хранятся массивами из 2 ** bits элементов. Размер снимка и
+    стоимость поиска не зависят от количества слов, а слова с одинаковой корзиной складываются.
+
+    В этом режиме массивы всегда держатся в памяти процесса, BAYES_SNAPSHOT_ENABLED не учитывается.
+    """
+    _instance = None
+    _checked_at = None
+    _lock = threading.Lock()
+
+    def __init__(self, version: int, bits: int, spam_counts: np.ndarray, ham_counts: np.ndarray):
+        """
+        :param version: версия словаря, с которой сделан снимок
+        :param bits: количество бит хэша. Корзин 2 ** bits
+        :param spam_counts: появлений в спаме по корзинам
+        :param ham_counts: появлений в хаме по корзинам
+        """
+        start_time = time.perf_counter()
+        self.version = version
+        self.bits = bits
+        self.spam_counts = spam_counts
+        self.ham_counts = ham_counts
+        self.spam_total = int(spam_counts.sum(dtype=np.uint64))
+        self.ham_total = int(ham_counts.sum(dtype=np.uint64))
+        self.num_used = int(np.count_nonzero(spam_counts | ham_counts))
+        self.load_time = time.perf_counter() - start_time
+
+    def __len__(self) -> int:
+        return self.num_used
+
+    @staticmethod
+    def get_buckets(words: List[str], bits: int) -> np.ndarray:
+        """
+        Корзины слов
+        :param words: слова
+        :param bits: количество бит хэша
+        :return: массив номеров корзин в порядке words
+        """
+        hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint32, count=len(words))
+
+        return hashes & np.uint32((1 << bits) - 1)
+
+    @classmethod
+    def count(cls, bits: int, words: Iterable[Tuple[str, int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Раскладывает появления слов по корзинам
+        :param bits: количество бит хэша
+        :param words: Iterable[(слово, появлений в спаме, появлений в хаме)]
+        :return: массивы появлений в спаме и в хаме по корзинам
+        """
+        words = list(words)
+        buckets = cls.get_buckets([word for word, _, _ in words], bits)
+        counts = np.array([item[1:] for item in words], dtype=np.float64).reshape(-1, 2)
+        # Веса bincount - float64, целые суммы до 2 ** 53 точные
+        spam_counts = np.bincount(buckets, weights=counts[:, 0], minlength=1 << bits)
+        ham_counts = np.bincount(buckets, weights=counts[:, 1], minlength=1 << bits)
+
+        return spam_counts.astype(np.uint64), ham_counts.astype(np.uint64)
+
+    @staticmethod
+    def as_uint32(counts: np.ndarray) -> np.ndarray:
+        """
+        Приводит массив появлений к формату хранения
+        :param counts: массив появлений
+        :return: массив uint32
+        """
+        if len(counts) and counts.max() > np.iinfo(np.uint32).max:
+            raise ValueError('Bucket counts do not fit into uint32, use more hash bits')
+
+        return counts.astype(np.uint32)
+
+    @classmethod
+    def from_words(cls, version: int, bits: int, words: Iterable[Tuple[str, int, int]]) -> 'BayesHashedSnapshot':
+        """
+        Строит снимок в памяти по словам словаря, не сохраняя его в БД
+        :param version: версия словаря
+        :param bits: количество бит хэша
+        :param words: Iterable[(слово, появлений в спаме, появлений в хаме)]
+        :return: BayesHashedSnapshot
+        """
+        spam_counts, ham_counts = cls.count(bits, words)
+
+        return cls(version, bits, cls.as_uint32(spam_counts), cls.as_uint32(ham_counts))
+
+    @classmethod
+    def load(cls, version: int) -> 'BayesHashedSnapshot':
+        """
+        Загружает массивы из БД. Пока модель не обучена, массивы пустые
+        :param version: текущая версия словаря
+        :return: BayesHashedSnapshot
+        """
+        counts = BayesHashedCounts.objects.first()
+
+        if counts is None:
+            bits = settings.BAYES_HASH_BITS
+            snapshot = cls(version, bits, np.zeros(1 << bits, dtype=np.uint32), np.zeros(1 << bits, dtype=np.uint32))
+        else:
+            snapshot = cls(version, counts.bits, np.frombuffer(counts.spam_counts, dtype='<u4'),
+                           np.frombuffer(counts.ham_counts, dtype='<u4'))
+
+        logger.info('Bayes hashed snapshot version %d loaded in %.3f s: %d of %d buckets used'
+                    % (version, snapshot.load_time, len(snapshot), 1 << snapshot.bits))
+
+        return snapshot
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        """
+        :return: используются ли снимки
+        """
+        return True
+
+    def get_counts(self, words: Iterable[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Количество появлений слов в спаме и хаме. Слово из пустой корзины считается неизвестным
+        :param words: слова
+        :return: слова из непустых корзин и массивы появлений в спаме и в хаме их корзин
+        """
+        words = list(words)
+        buckets = self.get_buckets(words, self.bits)
+        spam_counts, ham_counts = self.spam_counts[buckets], self.ham_counts[buckets]
+        found = (spam_counts | ham_counts) != 0
+
+        return [word for word, is_found in zip(words, found) if is_found], spam_counts[found], ham_counts[found]
+
+    def memory_usage(self) -> int:
+        """
+        Размер массивов снимка
+        :return: размер в байтах
+        """
+        return self.spam_counts.nbytes + self.ham_counts.nbytes
@@ -1,19 +1,31 @@
 import re
-from itertools import chain, product
-from typing import List, Tuple, Union
+import time
+from typing import List, Optional, Tuple, Union
 
 import emoji
+from django.conf import settings
 from html.parser import HTMLParser as BaseHTMLParser
-from nltk import pos_tag, word_tokenize
-from nltk.corpus import wordnet, words
-from nltk.stem import WordNetLemmatizer, SnowballStemmer
-from pymorphy2 import MorphAnalyzer
-
-# Поиск линейный по words.words() со всеми вытекающими. В памяти занимает 8 мб, решил не заморачиваться с БД
-english_words = set(words.words())
-
-
-class HTMLParser(BaseHTMLParser):
+from nltk import pos_tag_sents, word_tokenize
+from nltk.corpus import wordnet
+
+from spam_filter.nlp_resources import NLPResources
+from spam_filter.parse_cache import ParseCache
+from spam_filter.tokenizer import SpecialCharTokenizer
+from spam_filter.utils import MultiStringMatcher
+
+
+class HTMLStripper(BaseHTMLParser):
+    """
+    Извлекает текст из html за один проход. Текст пропускается, если последний открытый тег - служебный (style,
+    script, head, meta, img, title). Решение принимается один раз при открытии тега, а не для каждого текстового
+    узла. Ссылки и картинки заменяются на html_external_spec. Css цвета считаются одним проходом регулярного
+    выражения по исходному html, а не в обработчиках парсера: парсер заменяет ссылки на символы (color&#58;)
+    и не отдает текст CDATA, <?...?>, <!DOCTYPE ...> и атрибутов закрывающих тегов.
+    """
+    # Префиксы имен тегов. Совпадение по префиксу, т.е. <header> тоже считается служебным, как и раньше
+    skip_tags = ('style', 'head', 'script', 'meta', 'img', 'title')
+    skip_tag_re = re.compile(r'(<style)|(<head)|(<script)|(<meta)|(<img)|(<title)', re.I)
+    color_re = re.compile(r'color\s*:\s*(([A-Za-z]+)|(#[A-Fa-f0-9]+)|)')
 
     def error(self, message):
         pass
@@ -21,26 +33,215 @@ class HTMLParser(BaseHTMLParser):
     def __init__(self):
         super().__init__()
         self._parse_data = []
+        self._has_starttag = False
+        self._skip_data = False
+        self.num_colors = 0
+
+    @staticmethod
+    def _looks_like_css(data: str) -> bool:
+        """
+        Проверяет, похож ли текст на css: "свойство: значение; }". Аналог re.match(r'.*[A-z\-]+\s*:.*;.*}', data,
+        re.DOTALL) без отката регулярного выражения, который на больших блоках стилей работает за квадрат
+        :param data: текст
+        :return: True, если текст похож на css
+        """
+        close = data.rfind('}')
+        semicolon = data.rfind(';', 0, close) if close > 0 else -1
+        colon = data.rfind(':', 0, semicolon) if semicolon > 0 else -1
+
+        while colon > 0:
+            index = colon - 1
+
+            while index >= 0 and data[index].isspace():
+                index -= 1
+
+            if index >= 0 and ('A' <= data[index] <= 'z' or data[index] == '-'):
+                return True
+
+            colon = data.rfind(':', 0, colon)
+
+        return False
 
     def handle_starttag(self, tag: str, _):
+        tag_string = self.get_starttag_text()
+        self._has_starttag = True
+        # Служебный тег может встретиться и внутри значения атрибута
+        self._skip_data = tag.startswith(self.skip_tags) or \
+            ('<' in tag_string[1:] and bool(self.skip_tag_re.search(tag_string)))
+
         if tag in {'a', 'img'}:
             self._parse_data.append('html_external_spec')
 
     def handle_data(self, data: str) -> None:
-        tag_string = self.get_starttag_text() or ''
-
-        m = re.search(r'(<style)|(<head)|(<script)|(<meta)|(<img)|(<title)', tag_string, re.I)
-        m2 = re.match(r'.*[A-z\-]+\s*:.*;.*}', data, re.DOTALL)
-
-        if not m and (tag_string or (not tag_string and not m2)):
+        if self._has_starttag:
+            if not self._skip_data:
+                self._parse_data.append(data)
+        elif not self._looks_like_css(data):
             self._parse_data.append(data)
 
     def get_clear_data(self, content: str) -> str:
+        # Цвета считаются в том числе в комментариях, незакрытых тегах и блоках script/style
+        if 'color' in content:
+            self.num_colors += len(self.color_re.findall(content))
+
         self.feed(content)
+
         return ' '.join(self._parse_data)
 
 
+class ParsedMessage:
+    """
+    Результат разбора сообщения. Создается один раз и используется и байесовским классификатором, и нейросетью,
+    поэтому содержимое не нужно повторно разбирать или делить на слова
+    """
+    __slots__ = ('tokens', 'unique_tokens', 'num_uppercase', 'num_numbers', 'num_emojies', 'num_unknown',
+                 'num_colors', 'content_size', 'bayes_probability', 'degraded')
+
+    def __init__(self, tokens: List[str], num_uppercase: int = 0, num_numbers: int = 0, num_emojies: int = 0,
+                 num_unknown: int = 0, num_colors: int = 0):
+        """
+        :param tokens: значимые части слов в порядке появления в сообщении
+        :param num_uppercase: количество слов в верхнем регистре
+        :param num_numbers: количество чисел
+        :param num_emojies: количество emoji
+        :param num_unknown: количество неопознанных слов
+        :param num_colors: количество css цветов
+        """
+        self.tokens = tokens
+        self.unique_tokens = set(tokens)
+        self.num_uppercase = num_uppercase
+        self.num_numbers = num_numbers
+        self.num_emojies = num_emojies
+        self.num_unknown = num_unknown
+        self.num_colors = num_colors
+        # UTF-8 содержит в себе 2 байта. Размер в кб. Слова в теле сообщения разделены одним пробелом
+        self.content_size = (sum(map(len, tokens)) + max(len(tokens) - 1, 0)) * 2 / 1024
+        # Заполняется байесовским классификатором
+        self.bayes_probability = None
+        # Сообщение разобрано не полностью или упрощенно из-за ограничений ParseBudget
+        self.degraded = False
+
+    def scale(self, colors_factor: float, content_factor: float) -> None:
+        """
+        Пересчитывает абсолютные признаки, если разобрана только часть сообщения. Частоты считаются по разобранной
+        части и не меняются
+        :param colors_factor: во сколько раз исходный html больше разобранного
+        :param content_factor: во сколько раз исходный текст больше разобранного
+        :return: None
+        """
+        self.num_colors = round(self.num_colors * colors_factor)
+        self.num_emojies = round(self.num_emojies * content_factor)
+        self.content_size *= content_factor
+        self.degraded = True
+
+    @property
+    def body(self) -> str:
+        """
+        :return: распознанные слова сообщения, разделенные через пробел
+        """
+        return ' '.join(self.tokens)
+
+    @property
+    def message_features(self) -> Tuple[float, float, float, int, int, float]:
+        """
+        :return: частота слов верхнего регистра, частота чисел, размер полезного контента в кб, число css цветов,
+        число emoji, частота неопознанных слов
+        """
+        num_words = len(self.tokens) or 1
+
+        return (self.num_uppercase / num_words, self.num_numbers / num_words, self.content_size, self.num_colors,
+                self.num_emojies, self.num_unknown / num_words)
+
+    @property
+    def features(self) -> Tuple[float, float, float, int, int, float, float]:
+        """
+        :return: признаки сообщения для нейросети: message_features и вероятность спама по Байесу
+        """
+        return (*self.message_features, self.bayes_probability)
+
+
+class ParseBudget:
+    """
+    Ограничения на разбор одного сообщения при проверке, чтобы огромное или специально составленное письмо не
+    занимало воркер надолго. От длинного содержимого разбирается только начало, а абсолютные признаки
+    пересчитываются на полный размер. Время проверяется перед каждой порцией опознаваемых слов: слова после
+    истечения времени только обрезаются стеммером, без определения частей речи и лемматизации
+    """
+
+    def __init__(self, max_body_size: int = 0, max_tokens: int = 0, deadline: Optional[float] = None):
+        """
+        :param max_body_size: максимальный размер разбираемого содержимого в байтах utf-8. 0 - без ограничения
+        :param max_tokens: максимальное количество разбираемых слов после нормализации. 0 - без ограничения
+        :param deadline: время на разбор в секундах с момента создания. None - без ограничения
+        """
+        self.max_body_size = max_body_size
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.start_time = time.perf_counter()
+
+    @classmethod
+    def from_settings(cls) -> 'ParseBudget':
+        """
+        :return: ограничения из настроек PARSE_MAX_BODY_SIZE, PARSE_MAX_TOKENS, PARSE_DEADLINE
+        """
+        return cls(max_body_size=settings.PARSE_MAX_BODY_SIZE, max_tokens=settings.PARSE_MAX_TOKENS,
+                   deadline=settings.PARSE_DEADLINE)
+
+    def truncate_body(self, body: str) -> Tuple[str, float]:
+        """
+        Обрезает исходное содержимое до max_body_size байт в utf-8. Символ, который не поместился целиком,
+        отбрасывается
+        :param body: содержимое
+        :return: содержимое и во сколько раз исходное содержимое больше обрезанного по количеству символов
+        """
+        # Символ в utf-8 занимает от 1 до 4 байт. Короткое содержимое не кодируется
+        if not self.max_body_size or not body or len(body) * 4 <= self.max_body_size:
+            return body, 1.0
+
+        # Первые max_body_size символов занимают не меньше max_body_size байт, остальное кодировать не нужно
+        encoded = body[:self.max_body_size].encode('utf-8')
+
+        if len(encoded) <= self.max_body_size and len(body) <= self.max_body_size:
+            return body, 1.0
+
+        truncated = encoded[:self.max_body_size].decode('utf-8', errors='ignore')
+
+        return truncated, len(body) / max(len(truncated), 1)
+
+    def truncate_tokens(self, normalized: str) -> Tuple[str, float]:
+        """
+        Оставляет первые max_tokens слов нормализованного содержимого
+        :param normalized: содержимое после ContentParser.normalize, слова разделены одним пробелом
+        :return: содержимое и во сколько раз исходное количество слов больше оставленного
+        """
+        if not self.max_tokens:
+            return normalized, 1.0
+
+        words = normalized.split(' ', self.max_tokens)
+
+        if len(words) <= self.max_tokens:
+            return normalized, 1.0
+
+        return ' '.join(words[:self.max_tokens]), (normalized.count(' ') + 1) / self.max_tokens
+
+    def expired(self) -> bool:
+        """
+        :return: истекло ли время на разбор
+        """
+        return self.deadline is not None and time.perf_counter() - self.start_time > self.deadline
+
+
 class ContentParser:
+    # Увеличивается при любом изменении разбора, которое меняет результат. Входит в ключи ParseCache
+    version = 1
+    # Сколько слов опознается между проверками времени ParseBudget
+    budget_chunk_size = 500
+
+    tokenizer = SpecialCharTokenizer()
+    # Все emoji, в том числе последовательности из нескольких символов: флаги, семьи через ZWJ, оттенки кожи.
+    # Строится при первом использовании, см. get_emoji_matcher
+    _emoji_matcher = None
+
     special_words = {'html_external_spec', 'email_spec', 'url_spec', 'dollar_spec', 'ruble_spec', 'phone_spec',
                      'number_spec', 'percent_spec'}
 
@@ -54,6 +255,9 @@ class ContentParser:
         'month': {'January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
                   'November', 'December'}
     }
+    words_replaces_index = {word: key for key, values in words_replaces.items() for word in values}
+
+    parse_cache = ParseCache(version)
 
     @staticmethod
     def get_stripped_html(body: str) -> str:
@@ -62,50 +266,38 @@ class ContentParser:
         :param body: содержимое
         :return: содержимое, очищенное от html
         """
-        parser = HTMLParser()
+        parser = HTMLStripper()
         return parser.get_clear_data(body)
 
-    @staticmethod
-    def get_emojies(body: str) -> List[str]:
+    @classmethod
+    def get_emojies(cls, body: str) -> List[str]:
         """
-        Находит emoji в контенте
+        Находит emoji в контенте. Последовательность из нескольких символов считается одним emoji
         :param body: контент
         :return: Список с emoji
         """
-        return [char for char in body if char in emoji.UNICODE_EMOJI]
+        return cls.get_emoji_matcher().findall(body)
 
-    @staticmethod
-    def replace_special_char(body: str) -> str:
+    @classmethod
+    def get_emoji_matcher(cls) -> MultiStringMatcher:
+        """
+        Возвращает MultiStringMatcher по всем emoji, создавая его при первом обращении
+        :return: MultiStringMatcher
+        """
+        if cls._emoji_matcher is None:
+            cls._emoji_matcher = MultiStringMatcher(emoji.UNICODE_EMOJI)
+
+        return cls._emoji_matcher
+
+    @classmethod
+    def replace_special_char(cls, body: str) -> str:
         """
         Заменяет ссылки (в том числе в html тегах) на 'urladdr', емейл-адреса на 'emailaddr', отдельно стоящий знак
         $ на 'dollar'. Убираем табуляцию переносы строк и пробелы
         :param body: контент
         :return: очищенный по различным регулярным выражениям контент
         """
-        regexp_exchange = [
-            (r'_+', '_'),
-            (r"[A-z0-9.!#$%&'*+-/=?^_`{|}~@]+@[A-z0-9-\.:]+", ' email_spec '),
-            (r"((\d+|\s)\$)", ' dollar_spec '),
-            (r'(https?)?(:\/\/)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.'
-             r'[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)', ' url_spec '),
-            (r"((\d+|\s)₽)", ' ruble_spec '),
-            (r'\(|\)|\!|\.|\?|:|\\|/|\[|\]', ''),
-            (r'(((\+\d+)|(8))[\s-]?\d+[\s-]\d+[\s-]\d+[\s-]?\d+)|(((\+\d+)|(8))\d{10})', ' phone_spec '),
-            (r"\{(\{|%)\s?.+\s?(\}|%)\}", ' '),  # убираем jinja2 подстановки
-            (r'&[A-z0-9\#]{2,8};', ' '),  # убираем html - символы &nbsp; и прочие
-            (r'"|«|»|\,|\-|“|”|\*|\||\'|;|{|}', ' '),
-            (r'\d+', ' number_spec '),
-            (r'\t', ' '),
-            (r'(\r\n)|\n', ' '),
-            (r'[\s\-]{1,}', ' '),  # заменяем любые пробелы на один пробел. \s включает в себя в том числе \xa0
-            (r'([\d\-]+%)|%', 'percent_spec'),
-            (r'[^\s]{255,}', '')  # удаляем все длиннее 255 символов, потому что я не знаю таких длинных слов
-        ]
-
-        for regexp, exchange in regexp_exchange:
-            body = re.sub(regexp, exchange, body)
-
-        return body.strip()
+        return cls.tokenizer.tokenize(body)
 
     @classmethod
     def _get_en_word_type(cls, word_type_tag: str) -> wordnet:
@@ -127,53 +319,173 @@ class ContentParser:
             return wordnet.NOUN
 
     @classmethod
-    def analyze_words(cls, body: str) -> Tuple:
+    def analyze_words(cls, body: str, resources: Optional[NLPResources] = None) -> Tuple:
         """
         Опознает русские и английские слова и оставляет только их наиболее значимую часть
         :param body: контент
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
         :return: список неопознанных слов и содержимое после обработки слов
         """
-        rus_lemm_analyzer = MorphAnalyzer()
-        en_lemm_analyzer = WordNetLemmatizer()
-        rus_stemmer = SnowballStemmer('russian')
-        en_stemmer = SnowballStemmer('english')
+        unknown_words, words = cls._analyze_tokens(body, resources=resources)
 
-        unknown_words = []
-        rus_words = []
-        en_words = []
+        return unknown_words, ' '.join(words)
+
+    @classmethod
+    def analyze_words_batch(cls, bodies: List[str], resources: Optional[NLPResources] = None) -> List[Tuple]:
+        """
+        То же, что analyze_words, но для нескольких сообщений сразу
+        :param bodies: список контентов
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: список из (список неопознанных слов, содержимое после обработки слов) в порядке bodies
+        """
+        return [(unknown_words, ' '.join(words))
+                for unknown_words, words in cls._analyze_tokens_batch(bodies, resources=resources)]
 
-        for word in re.findall(r'[А-я]{2,}', body):
-            analysis = rus_lemm_analyzer.parse(word)[0]
+    @classmethod
+    def _analyze_tokens(cls, body: str, resources: Optional[NLPResources] = None) -> Tuple[List[str], List[str]]:
+        """
+        То же, что analyze_words, но возвращает список значимых частей слов, а не строку
+        :param body: контент
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: список неопознанных слов и список значимых частей слов
+        """
+        return cls._analyze_tokens_batch([body], resources=resources)[0]
 
-            if analysis.is_known:
-                rus_words.append(analysis.normal_form)
-            else:
-                unknown_words.append(analysis.normal_form)
-                rus_words.append(analysis.normal_form)
+    @classmethod
+    def _analyze_tokens_batch(cls, bodies: List[str], resources: Optional[NLPResources] = None) \
+            -> List[Tuple[List[str], List[str]]]:
+        """
+        Опознает слова сразу в нескольких сообщениях. Английские слова всех сообщений размечаются по частям речи
+        одним вызовом pos_tag_sents, а каждое уникальное слово пачки анализируется один раз
+        :param bodies: список контентов
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: список из (список неопознанных слов, список значимых частей слов) в порядке bodies
+        """
+        if not bodies:
+            return []
+
+        resources = resources or NLPResources.get()
+        # (язык, слово, часть речи) -> результат _analyze_word в пределах пачки
+        analyzed = {}
+
+        def _analyze(lang: str, word: str, word_type: Optional[str]) -> Tuple[str, bool, str]:
+            key = (lang, word, word_type)
+
+            if key not in analyzed:
+                analyzed[key] = cls._analyze_word(lang, word, word_type, resources)
+
+            return analyzed[key]
 
         # для английских слов немного сложнее
-        word_word_type = pos_tag(word_tokenize(' '.join(re.findall(r'[A-z]{2,}', body))))
+        tagged_bodies = pos_tag_sents([word_tokenize(' '.join(re.findall(r'[A-z]{2,}', body))) for body in bodies])
+        results = []
 
-        for sw in word_word_type:
-            word = en_lemm_analyzer.lemmatize(sw[0], cls._get_en_word_type(sw[1]))
+        for body, word_word_type in zip(bodies, tagged_bodies):
+            unknown_words = []
+            rus_words = []
+            en_words = []
 
-            if word not in cls.special_words and word not in english_words:
-                unknown_words.append(word)
-            en_words.append(word)
+            for word in re.findall(r'[А-я]{2,}', body):
+                normal_form, known, stem = _analyze('ru', word, None)
+
+                if not known:
+                    unknown_words.append(normal_form)
+                rus_words.append(stem)
+
+            for sw in word_word_type:
+                word, known, stem = _analyze('en', sw[0], cls._get_en_word_type(sw[1]))
+
+                if not known:
+                    unknown_words.append(word)
+                en_words.append(stem)
+
+            results.append((unknown_words, rus_words + en_words))
 
-        result = []
+        return results
 
-        for lang, item in chain(product(['ru'], rus_words), product(['en'], en_words)):
-            stemmer = rus_stemmer if lang == 'ru' else en_stemmer
+    @classmethod
+    def _analyze_tokens_within(cls, body: str, budget: ParseBudget, resources: Optional[NLPResources] = None) \
+            -> Tuple[List[str], List[str], bool]:
+        """
+        То же, что _analyze_tokens, но с ограничением времени. Слова опознаются порциями по budget_chunk_size,
+        перед каждой порцией проверяется время. Когда время истекло, оставшиеся слова разбираются упрощенно
+        :param body: контент, слова разделены одним пробелом
+        :param budget: ограничения разбора
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: список неопознанных слов, список значимых частей слов и был ли разбор упрощенным
+        """
+        if budget.deadline is None:
+            return (*cls._analyze_tokens(body, resources=resources), False)
+
+        words = body.split(' ')
+        unknown_words = []
+        tokens = []
 
-            for k, v in cls.words_replaces.items():
-                if item in v:
-                    result.append(stemmer.stem(k))
-                    break
+        for start in range(0, len(words), cls.budget_chunk_size):
+            if budget.expired():
+                chunk_unknown, chunk_tokens = cls._analyze_tokens_degraded(' '.join(words[start:]), resources=resources)
+                return unknown_words + chunk_unknown, tokens + chunk_tokens, True
+
+            chunk_unknown, chunk_tokens = cls._analyze_tokens(' '.join(words[start:start + cls.budget_chunk_size]),
+                                                              resources=resources)
+            unknown_words.extend(chunk_unknown)
+            tokens.extend(chunk_tokens)
+
+        return unknown_words, tokens, False
+
+    @classmethod
+    def _analyze_tokens_degraded(cls, body: str, resources: Optional[NLPResources] = None) \
+            -> Tuple[List[str], List[str]]:
+        """
+        Упрощенное опознавание слов, когда на полное не осталось времени. Части речи не определяются, слова не
+        приводятся к нормальной форме, а только обрезаются стеммером. Русские слова считаются известными
+        :param body: контент
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: список неопознанных слов и список значимых частей слов
+        """
+        resources = resources or NLPResources.get()
+        unknown_words = []
+        rus_words = [resources.rus_stemmer.stem(word) for word in re.findall(r'[А-я]{2,}', body)]
+        en_words = []
+
+        for word in re.findall(r'[A-z]{2,}', body):
+            if word not in cls.special_words and word.lower() not in resources.english_words \
+                    and word not in resources.english_words:
+                unknown_words.append(word)
+            en_words.append(resources.en_stemmer.stem(cls.words_replaces_index.get(word, word)))
+
+        return unknown_words, rus_words + en_words
+
+    @classmethod
+    def _analyze_word(cls, lang: str, word: str, word_type: Optional[str], resources: NLPResources) \
+            -> Tuple[str, bool, str]:
+        """
+        Приводит слово к нормальной форме и выделяет значимую часть. Результат запоминается в кэше процесса, т.к.
+        словарь писем повторяется от сообщения к сообщению
+        :param lang: язык слова 'ru' или 'en'
+        :param word: слово в том виде, в котором оно встретилось в тексте
+        :param word_type: часть речи wordnet для английских слов
+        :param resources: Загруженные анализаторы
+        :return: нормальная форма, опознано ли слово, значимая часть слова
+        """
+        key = (lang, word, word_type)
+        analysis = resources.word_cache.get(key)
+
+        if analysis is None:
+            if lang == 'ru':
+                parsed = resources.rus_lemm_analyzer.parse(word)[0]
+                normal_form, known = parsed.normal_form, parsed.is_known
+                stemmer = resources.rus_stemmer
             else:
-                result.append(stemmer.stem(item))
+                normal_form = resources.en_lemm_analyzer.lemmatize(word, word_type)
+                known = normal_form in cls.special_words or normal_form in resources.english_words
+                stemmer = resources.en_stemmer
+
+            stem = stemmer.stem(cls.words_replaces_index.get(normal_form, normal_form))
+            analysis = (normal_form, known, stem)
+            resources.word_cache.set(key, analysis)
 
-        return unknown_words, ' '.join(result)
+        return analysis
 
     @staticmethod
     def get_uppercase_words(body: str) -> List[str]:
@@ -194,43 +506,128 @@ class ContentParser:
         return len(re.findall(r'color\s*:\s*(([A-Za-z]+)|(#[A-Fa-f0-9]+)|)', body))
 
     @classmethod
-    def parse(cls, body: str, identify_words: bool = True) -> str:
+    def parse(cls, body: str, identify_words: bool = True, resources: Optional[NLPResources] = None) -> str:
         """
         Распознает значимые слова из сообщения
         :param body: тело сообщения
         :param identify_words: Распознавать русские слова и приводить их в нормальную форму и к нижнему регистру
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
         :return: строку с распознанными словами в сообщении разделенные через пробел
         """
         body = cls.get_stripped_html(body)
         body = cls.replace_special_char(body)
 
         if identify_words:
-            _, body = cls.analyze_words(body)
+            _, body = cls.analyze_words(body, resources=resources)
 
         return body
 
     @classmethod
-    def prepare_for_pnn(cls, body: str) -> Union[bool, Tuple[str, Tuple[float, float, float, int, int, float]]]:
+    def normalize(cls, body: str) -> Tuple[str, int]:
         """
-        Подготавливает информацию о содержимом для pnn
+        Извлекает текст из html и заменяет специальные символы. Слова пока не определяются, т.к. необходимо узнать
+        количество слов в верхнем регистре. Количество css цветов считается при извлечении текста из html
         :param body: содержимое
-        :return: распаршенное содержимое сообщения, частота слов верхнего регистра, частота чисел, число css цветов,
-        размер полезного контента в байтах, сли есть полезная информация иначе False
+        :return: нормализованное содержимое и количество css цветов
         """
-        # не определяю слова сразу, т.к. необходимо узнать количество слов в верхнем регистре.
-        parsed_body = cls.parse(body, identify_words=False)
+        if not body:
+            return '', 0
+
+        stripper = HTMLStripper()
+        normalized = cls.replace_special_char(stripper.get_clear_data(body))
+
+        return normalized, stripper.num_colors
+
+    @classmethod
+    def _build_message(cls, normalized: str, num_colors: int, unknown_words: List[str], tokens: List[str]) \
+            -> ParsedMessage:
+        """
+        Собирает ParsedMessage из нормализованного содержимого и результата опознавания слов
+        :param normalized: содержимое после normalize
+        :param num_colors: количество css цветов
+        :param unknown_words: неопознанные слова
+        :param tokens: значимые части слов
+        :return: ParsedMessage
+        """
+        return ParsedMessage(tokens, num_uppercase=len(cls.get_uppercase_words(normalized)),
+                             num_numbers=tokens.count('number_spec'), num_emojies=len(cls.get_emojies(normalized)),
+                             num_unknown=len(unknown_words), num_colors=num_colors)
+
+    @classmethod
+    def parse_message(cls, body: str, resources: Optional[NLPResources] = None, use_cache: bool = False,
+                      budget: Optional[ParseBudget] = None) -> Optional[ParsedMessage]:
+        """
+        Разбирает сообщение за один проход и считает все признаки, необходимые байесовскому классификатору и нейросети
+        :param body: содержимое
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :param use_cache: Брать результат опознавания слов из ParseCache. Рассылки спама состоят из тысяч одинаковых
+        после нормализации сообщений
+        :param budget: Ограничения на размер содержимого и время разбора. По умолчанию без ограничений
+        :return: ParsedMessage, если в сообщении есть полезная информация, иначе None
+        """
+        if not use_cache and budget is None:
+            return cls.parse_batch([body], resources=resources)[0]
+
+        budget = budget or ParseBudget()
+        body, body_factor = budget.truncate_body(body)
+        normalized, num_colors = cls.normalize(body)
+
+        if not normalized:
+            return None
 
-        if parsed_body:
-            unknown_words, parsed_words_body = cls.analyze_words(parsed_body)
-            num_words = len(parsed_words_body.split(' '))
+        normalized, tokens_factor = budget.truncate_tokens(normalized)
+        degraded = False
+        analysis = None
 
-            uppercase_freq = len(cls.get_uppercase_words(parsed_body)) / num_words
-            num_freq = len(re.findall('number_spec', parsed_words_body)) / num_words
-            content_size = len(parsed_words_body) * 2 / 1024  # UTF-8 содержит в себе 2 байта. Размер в кб
-            num_colors = cls.get_num_html_colors(body)
-            num_emojies = len(cls.get_emojies(parsed_body))
-            unknown_freq = len(unknown_words) / num_words
+        if use_cache:
+            key = cls.parse_cache.get_key(normalized)
+            analysis = cls.parse_cache.get(key)
 
-            return parsed_words_body, (uppercase_freq, num_freq, content_size, num_colors, num_emojies, unknown_freq)
+        if analysis is not None:
+            unknown_words, tokens = analysis
+            # Копия, чтобы изменение списка сообщения не испортило значение в кэше
+            tokens = list(tokens)
         else:
-            return False
+            unknown_words, tokens, degraded = cls._analyze_tokens_within(normalized, budget, resources=resources)
+
+            # Упрощенный разбор зависит от времени и в кэш не попадает
+            if use_cache and not degraded:
+                cls.parse_cache.set(key, (unknown_words, list(tokens)))
+
+        parsed = cls._build_message(normalized, num_colors, unknown_words, tokens)
+
+        if body_factor > 1 or tokens_factor > 1:
+            parsed.scale(body_factor, body_factor * tokens_factor)
+
+        parsed.degraded = parsed.degraded or degraded
+
+        return parsed
+
+    @classmethod
+    def parse_batch(cls, bodies: List[str], resources: Optional[NLPResources] = None) -> List[Optional[ParsedMessage]]:
+        """
+        То же, что parse_message, но для нескольких сообщений сразу. Используется при обучении моделей
+        :param bodies: список содержимого сообщений
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: список ParsedMessage или None для сообщений без полезной информации, в порядке bodies
+        """
+        normalized_bodies = [cls.normalize(body) for body in bodies]
+        useful = [normalized for normalized, _ in normalized_bodies if normalized]
+        analyzed = iter(cls._analyze_tokens_batch(useful, resources=resources))
+
+        return [cls._build_message(normalized, num_colors, *next(analyzed)) if normalized else None
+                for normalized, num_colors in normalized_bodies]
+
+    @classmethod
+    def prepare_for_pnn(cls, body: str, resources: Optional[NLPResources] = None) \
+            -> Union[bool, Tuple[str, Tuple[float, float, float, int, int, float]]]:
+        """
+        Подготавливает информацию о содержимом для pnn
+        :param body: содержимое
+        :param resources: Загруженные анализаторы. По умолчанию используются анализаторы текущего процесса
+        :return: распаршенное содержимое сообщения, частота слов верхнего регистра, частота чисел, число css цветов,
+        размер полезного контента в байтах, сли есть полезная информация иначе False
+        """
+        parsed = cls.parse_message(body, resources=resources)
+
+        return (parsed.body, parsed.message_features) if parsed else False
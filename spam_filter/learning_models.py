@@ -1,24 +1,32 @@
+import hashlib
+import heapq
+import io
 import logging
-import math
 import numpy as np
-import pickle
+import threading
+import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, Counter
+from collections import Counter
 from itertools import chain, islice
-from typing import List, Tuple, Union, Iterable as TIterable, Optional, Type
+from typing import List, Tuple, Union, Iterable as TIterable, Optional, Type, TYPE_CHECKING
 
-from cacheops import invalidate_model, invalidate_obj
-from django.db import transaction
-from django.db.models import Sum, Model
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Model
 from django.utils.decorators import classproperty
-from keras.metrics import binary_accuracy
-from keras.models import Sequential
-from keras.layers import Dense, Dropout
 
-from django_ml_spam_filter.utils import exec_in_parallel
-from spam_filter.content_parser import ContentParser
+from django_ml_spam_filter.utils import exec_in_parallel, iter_in_parallel
+from spam_filter.bayes_cache import BayesCountsCache
+from spam_filter.bayes_file import BayesFile
+from spam_filter.bayes_snapshot import BayesHashedSnapshot, BayesSnapshot
+from spam_filter.content_parser import ContentParser, ParsedMessage
 from spam_filter.mail_source import MailContentSource
-from spam_filter.models import BayesDictionary, NNStructure
+from spam_filter.models import BayesDelta, BayesDictionary, BayesHashedCounts, BayesMetadata, NNStructure
+from spam_filter.numpy_mlp import NumpyMLP
+
+if TYPE_CHECKING:
+    # keras вместе с tensorflow импортируется несколько секунд, поэтому импорт делается при первом создании модели
+    from keras.models import Sequential
 
 logger = logging.getLogger('default')
 
@@ -59,6 +67,20 @@ class LearningModel(ABC):
             if len(content) < batch_size:
                 break
 
+    @staticmethod
+    def _split_content(learning_content: TIterable[Tuple[str, bool]], num_chunks: Optional[int] = None) \
+            -> List[List[Tuple[str, bool]]]:
+        """
+        Делит обучающий контент на пачки, которые процессы разбирают через ContentParser.parse_batch
+        :param learning_content: список с Tuple(сообщение, флаг спама)
+        :param num_chunks: Количество пачек примерно одинакового размера. По умолчанию пачки по PARSE_BATCH_SIZE
+        :return: список пачек
+        """
+        learning_content = list(learning_content)
+        size = -(-len(learning_content) // num_chunks) if num_chunks else settings.PARSE_BATCH_SIZE
+
+        return [learning_content[i:i + size] for i in range(0, len(learning_content), max(size, 1))]
+
     @classmethod
     @abstractmethod
     def _train(cls, *args, **kwargs):
@@ -69,6 +91,17 @@ class LearningModel(ABC):
     def check_message_for_spam(cls, message: str, **kwargs) -> bool:
         pass
 
+    @classmethod
+    def check_messages_for_spam(cls, messages: List[Union[str, ParsedMessage]], **kwargs) -> List[bool]:
+        """
+        Проверяет несколько сообщений на спам. Модели переопределяют метод, если умеют проверять пачку быстрее,
+        чем по одному сообщению
+        :param messages: сообщения или результаты их разбора ContentParser.parse_message
+        :param kwargs: именованные параметры check_message_for_spam
+        :return: список флагов спама в порядке messages
+        """
+        return [cls.check_message_for_spam(message, **kwargs) for message in messages]
+
     @classproperty
     @abstractmethod
     def db_model(cls) -> Type[Model]:
@@ -88,10 +121,11 @@ class LearningModel(ABC):
         errors = []
 
         def _check_for_errors(content: TIterable[str], spam_flag: bool):
-            for index, msg in enumerate(content):
-                logger.info('Proccess record: %d in %s spam dictionary' % (index, spam_flag))
+            content = list(content)
+            logger.info('Proccess %d records in %s spam dictionary' % (len(content), spam_flag))
 
-                if spam_flag != cls.check_message_for_spam(msg, **kwargs):
+            for msg, predicted in zip(content, cls.check_messages_for_spam(content, **kwargs)):
+                if spam_flag != predicted:
                     errors.append((msg, spam_flag))
 
         _check_for_errors(spam.get_content(max_items=num_msg_to_check), True)
@@ -101,6 +135,13 @@ class LearningModel(ABC):
 
 
 class BayesModel(LearningModel):
+    # n - количество учитываемых максимальных отклонений вероятности спамовости от 0.5
+    num_significant_words = 13
+    # s - должно быть s повторений слова в словаре, чтобы повысить к нему доверие
+    smoothing_strength = 3
+    # Слово, в которое compact складывает появления удаленных слов. Токенизатор схлопывает подряд идущие
+    # подчеркивания, поэтому в сообщении такого слова быть не может
+    pruned_word = '__pruned__'
 
     @classmethod
     def train(cls, spam: Optional[MailContentSource] = None, ham: Optional[MailContentSource] = None,
@@ -121,19 +162,68 @@ class BayesModel(LearningModel):
                              min_num_word_appearance=min_num_word_appearance)
 
     @staticmethod
-    def _train_parse(index, msg, spam) -> dict:
-        dictionary = defaultdict(lambda: [0, 0, 0])
-        value_list_index = 1 if spam else 2
-        words = set(word for word in ContentParser.parse(msg).split(' ') if len(word) > 2) if msg else {}
+    def _train_parse(index: int, content: List[Tuple[str, bool]]) -> Tuple[Counter, Counter]:
+        """
+        Считает появления слов в части обучающего контента. Процесс складывает результаты всех своих сообщений,
+        поэтому в родительский процесс передается один результат на часть, а не словарь на каждое сообщение
+        :param index: номер части
+        :param content: список с Tuple(сообщение, флаг спама)
+        :return: Counter появлений слов в спаме и Counter появлений слов в хаме
+        """
+        spam_words = Counter()
+        ham_words = Counter()
+        size = settings.PARSE_BATCH_SIZE
+
+        for start in range(0, len(content), size):
+            batch = content[start:start + size]
+
+            for parsed, (_, spam) in zip(ContentParser.parse_batch([msg for msg, _ in batch]), batch):
+                if parsed:
+                    (spam_words if spam else ham_words).update(word for word in parsed.unique_tokens if len(word) > 2)
+
+        logger.info('Proccessed part N: %d, messages: %d' % (index, len(content)))
 
-        if words:
-            logger.info('Proccess message N: %d' % index)
-            for word in words:
-                dictionary[word][0] += 1
-                dictionary[word][value_list_index] += 1
+        return spam_words, ham_words
+
+    @staticmethod
+    def _reduce_counters(counters: List[Counter]) -> Counter:
+        """
+        Складывает Counter попарно, начиная с самых маленьких, и всегда добавляет меньший в больший. Так каждое слово
+        копируется меньшее количество раз, чем при последовательном сложении в один Counter
+        :param counters: список Counter
+        :return: сумма Counter
+        """
+        heap = [(len(counter), index, counter) for index, counter in enumerate(counters)]
+        heapq.heapify(heap)
 
-            # Pickle не может задампить defaultdict
-            return dict(dictionary)
+        if not heap:
+            return Counter()
+
+        while len(heap) > 1:
+            _, _, smaller = heapq.heappop(heap)
+            _, index, larger = heapq.heappop(heap)
+            larger.update(smaller)
+            heapq.heappush(heap, (len(larger), index, larger))
+
+        return heap[0][2]
+
+    @classmethod
+    def _count_words(cls, learning_content: TIterable[Tuple[str, bool]], processes_count: Optional[int] = None) \
+            -> Tuple[Counter, Counter]:
+        """
+        Считает появления слов в спаме и хаме параллельно: контент делится на части по числу процессов, каждый
+        процесс возвращает сумму по своей части, родительский процесс складывает суммы
+        :param learning_content: список с Tuple(сообщение, флаг спама)
+        :param processes_count: Количество процессов. По умолчанию NUM_CPU_CORES
+        :return: Counter появлений слов в спаме и Counter появлений слов в хаме
+        """
+        processes_count = processes_count or settings.NUM_CPU_CORES
+        # Частей вдвое больше, чем процессов, чтобы процессы, которым достались короткие письма, не простаивали
+        chunks = cls._split_content(learning_content, num_chunks=processes_count * 2)
+        func_args = [((index, chunk), {}) for index, chunk in enumerate(chunks)]
+        results = exec_in_parallel(cls._train_parse, func_args, processes_count=processes_count)
+
+        return cls._reduce_counters([spam for spam, _ in results]), cls._reduce_counters([ham for _, ham in results])
 
     @classmethod
     def _train(cls, learning_content: Union[TIterable[Tuple[str, bool]], Tuple[str, bool]],
@@ -149,87 +239,353 @@ class BayesModel(LearningModel):
         if isinstance(learning_content, tuple):
             learning_content = [learning_content]
 
-        # word - ключ, value[0] - всего, value[1] - появлений в spam, value[2] - появлений в ham
-        dictionary = defaultdict(lambda: [0, 0, 0])
-
-        func_args = [((index, msg, spam_flag), {}) for index, (msg, spam_flag) in enumerate(learning_content)]
-
-        results = ((k, v) for item in exec_in_parallel(cls._train_parse, func_args) if item
-                   for k, v in item.items())
-
-        for k, v in results:
-            dictionary[k] = list(map(lambda x, y: x + y, dictionary[k], v))
+        spam_words, ham_words = cls._count_words(learning_content)
 
         updates = [{
             'word': word,
-            'spam_count': values[1],
-            'ham_count': values[2]
-        } for word, values in dictionary.items() if values[0] >= min_num_word_appearance]
+            'spam_count': spam_words[word],
+            'ham_count': ham_words[word]
+        } for word in spam_words.keys() | ham_words.keys()
+            if spam_words[word] + ham_words[word] >= min_num_word_appearance]
 
-        def on_commit(items, init_flag):
-            if init_flag:
-                invalidate_model(BayesDictionary)
-            else:
-                # у запроса aggregate также сбросится кэш при сбрасывании кэша одной записи
-                for instance in items:
-                    invalidate_obj(instance)
+        if settings.BAYES_STORAGE == 'hashed':
+            if updates:
+                cls._train_hashed(updates, init=init)
+            return
+
+        if settings.BAYES_WRITE_MODE == 'log' and not init:
+            if updates:
+                cls._train_log(updates)
+            return
 
         if updates:
             with transaction.atomic():
                 if init:
                     BayesDictionary.objects.all().delete()
+                    BayesDelta.objects.all().delete()
+
+                BayesDictionary.objects.bulk_update_or_create(updates, key_fields='word',
+                                                              set_functions={'spam_count': '+', 'ham_count': '+'})
+                # Снимки словаря в других процессах перезагрузятся, когда увидят новую версию. Кэш слов в redis
+                # сбрасывать не нужно: его ключи содержат версию
+                BayesMetadata.objects.register_training(sum(item['spam_count'] for item in updates),
+                                                        sum(item['ham_count'] for item in updates), init=init)
+
+            # Процесс, который обучал словарь, сразу проверяет сообщения по новым данным
+            BayesSnapshot.invalidate()
+
+    @classmethod
+    def _get_word_counts(cls, words: TIterable[str], snapshot: Optional[BayesSnapshot] = None) \
+            -> Tuple[List[str], np.ndarray, np.ndarray, int, int]:
+        """
+        Получает количество появлений слов. В режиме BAYES_STORAGE = 'hashed' - из корзин хэшей, иначе из файла
+        словаря BAYES_MMAP_PATH, из снимка словаря процесса или из БД, если нет ни файла, ни снимка
+        :param words: слова сообщения
+        :param snapshot: снимок словаря, по которому нужно проверять вместо выбранного настройками
+        :return: слова, которые есть в словаре, массивы их появлений в спаме и в хаме, всего слов в спаме,
+        всего слов в хаме
+        """
+        if snapshot is None and settings.BAYES_STORAGE == 'hashed':
+            snapshot = BayesHashedSnapshot.get()
 
-                update_words = BayesDictionary.objects \
-                    .bulk_update_or_create(updates, key_fields='word', returning='*',
-                                           set_functions={'spam_count': '+', 'ham_count': '+'})
-                transaction.on_commit(lambda: on_commit(update_words, init))
+        if snapshot is None:
+            snapshot = BayesFile.get()
+
+        if snapshot is None:
+            snapshot = BayesSnapshot.get()
+
+        if snapshot is not None:
+            return (*snapshot.get_counts(words), snapshot.spam_total, snapshot.ham_total)
+
+        # Версия читается до слов, поэтому под ключом версии не может оказаться более старых данных
+        version, sum_spam, sum_ham = BayesMetadata.objects.get_state()
+        words = list(words)
+        word_counts = BayesCountsCache.get_many(version, words)
+        missing = [word for word in words if word not in word_counts]
+
+        if missing:
+            if settings.BAYES_WRITE_MODE == 'log':
+                qs = BayesDelta.objects.get_merged_counts(missing)
+            else:
+                qs = BayesDictionary.objects.nocache().filter(word__in=missing) \
+                    .values_list('word', 'spam_count', 'ham_count')
+
+            fetched = {word: (spam_count, ham_count) for word, spam_count, ham_count in qs}
+            BayesCountsCache.set_many(version, ((word, fetched.get(word)) for word in missing))
+            word_counts.update(fetched)
+
+        found_words = [word for word, counts in word_counts.items() if counts is not None]
+        counts = np.array([word_counts[word] for word in found_words], dtype=np.float64).reshape(-1, 2)
+
+        return found_words, counts[:, 0], counts[:, 1], sum_spam, sum_ham
+
+    @classmethod
+    def _get_spam_probability(cls, spam_counts: np.ndarray, ham_counts: np.ndarray, sum_spam: int, sum_ham: int) \
+            -> float:
+        """
+        Вероятность, что сообщение - спам, по словам сообщения, которые есть в словаре.
+        p = p1p2p3...pn/(p1p2...pn + (1-p1)(1-p2)..(1-pn)), где pi - вероятность, что слово(i)-спам. Учитываются n
+        слов с максимальным отклонением вероятности спамовости от 0.5. Произведения считаются через сумму логарифмов,
+        т.к. произведение 13 вероятностей близких к 0 теряет точность
+        :param spam_counts: появлений слов в спаме
+        :param ham_counts: появлений слов в хаме
+        :param sum_spam: всего появлений слов в спаме
+        :param sum_ham: всего появлений слов в хаме
+        :return: вероятность спама
+        """
+        if not len(spam_counts):
+            return 0.5
+
+        spam_counts = np.asarray(spam_counts, dtype=np.float64)
+        ham_counts = np.asarray(ham_counts, dtype=np.float64)
+
+        # Если в словаре нет спама или хама, частота слов в нем нулевая
+        spam_freq = spam_counts / (sum_spam or 1)
+        ham_freq = ham_counts / (sum_ham or 1)
+        prob_word_spam = spam_freq / (spam_freq + ham_freq)
+
+        n = cls.num_significant_words
+
+        if len(prob_word_spam) > n:
+            deviation = np.abs(0.5 - prob_word_spam)
+            # argpartition находит n-е по величине отклонение. Слов с отклонением не меньше него обычно около n, но
+            # слов, которые встречались только в спаме или только в хаме, с одинаковым отклонением 0.5 бывает много.
+            # Из них, как и в Counter.most_common, берутся первые по порядку
+            threshold = deviation[np.argpartition(deviation, -n)[-n]]
+            candidates = np.flatnonzero(deviation >= threshold)
+            top = candidates[np.argsort(-deviation[candidates], kind='stable')[:n]]
+            prob_word_spam, spam_counts, ham_counts = prob_word_spam[top], spam_counts[top], ham_counts[top]
+
+        # Сглаживающая формула Pr(S|W) = (s*Pr(s) + n*Pr(S|W))/s+n
+        s = cls.smoothing_strength
+        word_occur = spam_counts + ham_counts
+        spam_prob = (s * 0.5 + word_occur * prob_word_spam) / (s + word_occur)
+
+        # p = 1 / (1 + (1-p1)..(1-pn) / p1..pn)
+        log_ratio = np.log1p(-spam_prob).sum() - np.log(spam_prob).sum()
+
+        return float(np.exp(-np.logaddexp(0, log_ratio)))
 
     @classmethod
-    def check_message_for_spam(cls, message: str, return_probability: bool = False, clear_body: bool = False) \
-            -> Union[int, bool]:
+    def check_message_for_spam(cls, message: Union[str, ParsedMessage], return_probability: bool = False,
+                               clear_body: bool = False, snapshot: Optional[BayesSnapshot] = None) \
+            -> Union[float, bool]:
         """
         Проверяет сообщение на спам
-        :param message: Сообщение, которое проверяется на спам
+        :param message: Сообщение, которое проверяется на спам, или результат его разбора ContentParser.parse_message
         :param return_probability: вернуть вероятность, вместо флага True/False
         :param clear_body: Было ли содержимое предварительно обработано
+        :param snapshot: снимок словаря, по которому нужно проверять вместо выбранного настройками
         :return: boolean. Спам или нет
         """
-        parse_content = message if clear_body else ContentParser.parse(message)
-        words = {item for item in parse_content.split(' ')}
+        return cls.check_messages_for_spam([message], return_probability=return_probability, clear_body=clear_body,
+                                           snapshot=snapshot)[0]
 
-        # все запросы к BayesDictionary кэшируются на сутки или до нового обучения словаря.
-        aggr_sum = BayesDictionary.objects.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
-        qs = BayesDictionary.objects.filter(word__in=words).values_list('word', 'spam_count', 'ham_count')
-        word_dict = {item[0]: (item[1], item[2]) for item in qs}
+    @classmethod
+    def check_messages_for_spam(cls, messages: List[Union[str, ParsedMessage]], return_probability: bool = False,
+                                clear_body: bool = False, snapshot: Optional[BayesSnapshot] = None) \
+            -> Union[np.ndarray, List[bool]]:
+        """
+        Проверяет пачку сообщений на спам. Слова всех сообщений ищутся в словаре одним запросом или одним
+        обращением к снимку словаря
+        :param messages: Сообщения или результаты их разбора ContentParser.parse_message
+        :param return_probability: вернуть массив вероятностей, вместо флагов True/False
+        :param clear_body: Было ли содержимое предварительно обработано
+        :param snapshot: снимок словаря, по которому нужно проверять вместо выбранного настройками
+        :return: массив вероятностей спама или список флагов в порядке messages
+        """
+        to_parse = [message for message in messages if not isinstance(message, ParsedMessage) and not clear_body]
+        parsed_messages = iter(ContentParser.parse_batch(to_parse))
+        messages_words = []
+
+        for message in messages:
+            if isinstance(message, ParsedMessage):
+                messages_words.append(message.unique_tokens)
+            elif clear_body:
+                messages_words.append(set(message.split(' ')))
+            else:
+                parsed = next(parsed_messages)
+                messages_words.append(parsed.unique_tokens if parsed else set())
+
+        found_words, spam_counts, ham_counts, sum_spam, sum_ham = cls._get_word_counts(set().union(*messages_words),
+                                                                                      snapshot=snapshot)
+        index = {word: position for position, word in enumerate(found_words)}
+        probabilities = np.empty(len(messages), dtype=np.float64)
+
+        for i, words in enumerate(messages_words):
+            positions = [index[word] for word in words if word in index]
+            probabilities[i] = cls._get_spam_probability(spam_counts[positions], ham_counts[positions], sum_spam,
+                                                         sum_ham)
+
+        return probabilities if return_probability else [bool(probability > 0.9) for probability in probabilities]
+
+    @classmethod
+    def _train_log(cls, updates: List[dict]) -> None:
+        """
+        Обучение в режиме BAYES_WRITE_MODE = 'log': приращения добавляются в журнал BayesDelta без блокировки строк
+        словаря. В словарь их переносит периодическая задача compact_bayes_deltas
+        :param updates: список словарей с word, spam_count и ham_count
+        :return: None
+        """
+        with transaction.atomic():
+            BayesDelta.objects.bulk_create([BayesDelta(**item) for item in updates], batch_size=5000)
+            # Строка BayesMetadata обновляется последней, чтобы параллельные обучения ждали друг друга только
+            # на коротком промежутке до фиксации транзакции
+            BayesMetadata.objects.register_training(sum(item['spam_count'] for item in updates),
+                                                    sum(item['ham_count'] for item in updates))
+
+        BayesSnapshot.invalidate()
+
+    @classmethod
+    def compact_deltas(cls) -> int:
+        """
+        Переносит журнал приращений BayesDelta в словарь. Версия словаря не меняется: проверка видит те же
+        количества до и после переноса
+        :return: количество перенесенных строк журнала
+        """
+        return BayesDelta.objects.compact(batch_size=settings.BAYES_DELTA_COMPACT_BATCH_SIZE)
 
-        prob_word_spam = {word: (spam_freq / aggr_sum['sum_spam']) /
-                                ((spam_freq / aggr_sum['sum_spam']) + (ham_freq / aggr_sum['sum_ham']))
-                          for word, (spam_freq, ham_freq) in word_dict.items()}
+    @classmethod
+    def _train_hashed(cls, updates: List[dict], init: bool = False) -> None:
+        """
+        Обучение в режиме BAYES_STORAGE = 'hashed': появления слов добавляются в корзины их хэшей
+        :param updates: список словарей с word, spam_count и ham_count
+        :param init: Удалить предыдущие массивы и создать новые из BAYES_HASH_BITS корзин
+        :return: None
+        """
+        with transaction.atomic():
+            # Строка создается заранее, как в register_training: select_for_update без строки ничего не блокирует,
+            # и два первых обучения создали бы по строке. get_or_create сам обрабатывает такую гонку
+            empty = np.zeros(1 << settings.BAYES_HASH_BITS, dtype='<u4').tobytes()
+            BayesHashedCounts.objects.get_or_create(defaults={'bits': settings.BAYES_HASH_BITS, 'spam_counts': empty,
+                                                              'ham_counts': empty})
+            # Блокировка строки не дает параллельному обучению потерять приращения
+            counts = BayesHashedCounts.objects.select_for_update().get()
+
+            if init:
+                counts.bits = settings.BAYES_HASH_BITS
+                spam_counts = ham_counts = np.zeros(1 << counts.bits, dtype=np.uint64)
+            else:
+                spam_counts = np.frombuffer(counts.spam_counts, dtype='<u4').astype(np.uint64)
+                ham_counts = np.frombuffer(counts.ham_counts, dtype='<u4').astype(np.uint64)
 
-        # n - количество учитываемых максимальных отклонений вероятности спамовости от 0.5
-        n = 13
-        max_prob_words = Counter()
+            words = ((item['word'], item['spam_count'], item['ham_count']) for item in updates)
+            spam_added, ham_added = BayesHashedSnapshot.count(counts.bits, words)
+            counts.spam_counts = BayesHashedSnapshot.as_uint32(spam_counts + spam_added).astype('<u4').tobytes()
+            counts.ham_counts = BayesHashedSnapshot.as_uint32(ham_counts + ham_added).astype('<u4').tobytes()
+            counts.save()
+            # Словарь BayesDictionary не меняется, поэтому общее количество слов в нем тоже. Новая версия нужна,
+            # чтобы снимки процессов перезагрузились
+            BayesMetadata.objects.register_training(0, 0)
 
-        for word, probability in prob_word_spam.items():
-            max_prob_words[word] = math.fabs((0.5 - probability))
+        BayesHashedSnapshot.invalidate()
 
-        # p = p1p2p3...pn/(p1p2...pn + (1-p1)(1-p2)..(1-pn)), где pi - вероятность, что слово(i)-спам,
-        # p - вероятность, что сообщение - спам
-        multiple_spam_prob = 1
-        multiple_ham_prob = 1
+    @classmethod
+    def compact(cls, min_count: int = 1, min_deviation: float = 0, max_words: Optional[int] = None) -> dict:
+        """
+        Удаляет из словаря слова, которые почти не влияют на проверку: редкие, неинформативные и не попавшие в top-K.
+        min_num_word_appearance работает только внутри одной порции обучения, поэтому при дообучении в словарь
+        попадают случайные строки и обрывки ссылок, встреченные один раз.
+        Появления удаленных слов складываются в pruned_word, чтобы общее количество слов в спаме и хаме и частоты
+        оставшихся слов не изменились
+        :param min_count: Слово остается, если всего встречалось хотя бы min_count раз
+        :param min_deviation: Слово остается, если |p - 0.5| его вероятности спама не меньше min_deviation
+        :param max_words: Оставить не больше max_words слов с максимальным |p - 0.5| * количество появлений
+        :return: отчет: строк, размер таблицы в байтах и время проверки пачки сообщений в секундах до и после
+        """
+        cls.compact_deltas()
+        queryset = BayesDictionary.objects.nocache().exclude(word=cls.pruned_word)
+        rows = np.array(list(queryset.values_list('id', 'spam_count', 'ham_count')), dtype=np.int64).reshape(-1, 3)
+        sample_words = list(queryset.values_list('word', flat=True)[:300])
+        report = {
+            'rows_before': len(rows),
+            'table_size_before': cls._get_table_size(),
+            'scoring_latency_before': cls._measure_scoring_latency(sample_words),
+        }
+
+        spam_counts, ham_counts = rows[:, 1], rows[:, 2]
+        sum_spam, sum_ham = BayesMetadata.objects.get_totals()
+        word_occur = spam_counts + ham_counts
+        spam_freq = spam_counts / (sum_spam or 1)
+        ham_freq = ham_counts / (sum_ham or 1)
+        deviation = np.abs(0.5 - spam_freq / np.maximum(spam_freq + ham_freq, np.finfo(np.float64).tiny))
+
+        keep = (word_occur >= min_count) & (deviation >= min_deviation)
+
+        if max_words is not None and np.count_nonzero(keep) > max_words:
+            # Остаются max_words слов с самым большим вкладом среди уже прошедших пороги
+            weight = np.where(keep, deviation * word_occur, -1)
+            top = np.argpartition(weight, -max_words)[-max_words:] if max_words else []
+            keep = np.zeros(len(rows), dtype=bool)
+            keep[top] = True
+
+        drop_ids = rows[~keep, 0].tolist()
+        num_deleted = 0
+
+        if drop_ids:
+            with transaction.atomic():
+                # Слова выбраны по прочитанным выше количествам, но в pruned_word добавляется ровно то, что было
+                # в удаленных строках. Обучение между чтением и удалением не теряет приращений
+                pruned_spam = pruned_ham = 0
+
+                for start in range(0, len(drop_ids), 10000):
+                    deleted, deleted_spam, deleted_ham = BayesDictionary.objects.prune(drop_ids[start:start + 10000])
+                    num_deleted += deleted
+                    pruned_spam += deleted_spam
+                    pruned_ham += deleted_ham
+
+                if num_deleted:
+                    BayesDictionary.objects.bulk_update_or_create([{
+                        'word': cls.pruned_word,
+                        'spam_count': pruned_spam,
+                        'ham_count': pruned_ham
+                    }], key_fields='word', set_functions={'spam_count': '+', 'ham_count': '+'})
+                    # Общее количество слов не меняется, но снимки словаря должны перезагрузиться
+                    BayesMetadata.objects.register_training(0, 0)
+
+            if num_deleted:
+                BayesSnapshot.invalidate()
+
+        if num_deleted < len(drop_ids):
+            logger.info('Bayes compaction kept %d words with pending deltas' % (len(drop_ids) - num_deleted))
+
+        report.update({
+            'rows_after': len(rows) - num_deleted,
+            'table_size_after': cls._get_table_size(),
+            'scoring_latency_after': cls._measure_scoring_latency(sample_words),
+        })
+
+        return report
 
-        for word, _ in max_prob_words.most_common(n):
-            # Сглаживающая формула Pr(S|W) = (s*Pr(s) + n*Pr(S|W))/s+n
-            s = 3  # должно быть s повторений слова в словаре, чтобы повысить к нему доверие
-            word_occur = word_dict[word][0] + word_dict[word][1]
-            spam_prob = (s * 0.5 + word_occur * prob_word_spam[word]) / (s + word_occur)
+    @staticmethod
+    def _get_table_size() -> int:
+        """
+        Размер таблицы словаря вместе с индексами. Место удаленных строк освобождается только после VACUUM
+        :return: размер в байтах
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_total_relation_size(%s)', [BayesDictionary._meta.db_table])
+            return cursor.fetchone()[0]
 
-            multiple_spam_prob *= spam_prob
-            multiple_ham_prob *= 1 - spam_prob
+    @classmethod
+    def _measure_scoring_latency(cls, words: List[str], repeat: int = 5) -> float:
+        """
+        Время проверки пачки сообщений из слов словаря тем способом хранения, который выбран настройками.
+        Первая проверка не учитывается: она загружает снимок словаря
+        :param words: слова. Делятся на сообщения по 30 слов
+        :param repeat: количество повторений. Берется медиана
+        :return: время в секундах
+        """
+        messages = [' '.join(words[i:i + 30]) for i in range(0, len(words), 30)] or ['']
+        cls.check_messages_for_spam(messages, clear_body=True)
+        timings = []
 
-        spam_probability = multiple_spam_prob / (multiple_spam_prob + multiple_ham_prob)
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            cls.check_messages_for_spam(messages, clear_body=True)
+            timings.append(time.perf_counter() - start_time)
 
-        return spam_probability if return_probability else spam_probability > 0.9
+        return float(np.median(timings))
 
     @classproperty
     def db_model(cls) -> Type[Model]:
@@ -242,49 +598,181 @@ class BayesModel(LearningModel):
 
 class NN(LearningModel):
     num_metrics = 7
+    # Описание слоев из _build_model. Меняется вместе с _build_model, веса другой архитектуры не загружаются
+    architecture = 'input:7,dense:128:relu,dropout:0.5,dense:64:relu,dropout:0.5,dense:1:sigmoid'
+
+    # Модель для проверки сообщений, одна на процесс. См. get_model
+    _model = None
+    _model_version = None
+    _model_checksum = None
+    _model_backend = None
+    _model_checked_at = None
+    _model_lock = threading.Lock()
+
+    @staticmethod
+    def dump_weights(weights: List[np.ndarray]) -> bytes:
+        """
+        Сериализует веса в npz с массивами float32, без pickle
+        :param weights: массивы весов в порядке слоев
+        :return: содержимое npz
+        """
+        buffer = io.BytesIO()
+        np.savez(buffer, *[np.asarray(array, dtype=np.float32) for array in weights])
+
+        return buffer.getvalue()
+
+    @classmethod
+    def load_weights(cls) -> Optional[Tuple[int, List[np.ndarray]]]:
+        """
+        Читает сохраненные веса и проверяет их архитектуру и контрольную сумму
+        :return: версия весов и массивы весов в порядке слоев или None, если нейросеть еще не обучена
+        """
+        stored = NNStructure.objects.get_weights()
+
+        if stored is None:
+            return None
+
+        version, weights, checksum, architecture = stored
+        weights = bytes(weights)
+
+        if architecture != cls.architecture:
+            raise ValueError('NN weights version %d are saved for architecture "%s", expected "%s"'
+                             % (version, architecture, cls.architecture))
+
+        if hashlib.sha256(weights).hexdigest() != checksum:
+            raise ValueError('NN weights version %d are corrupted: checksum mismatch' % version)
+
+        with np.load(io.BytesIO(weights), allow_pickle=False) as arrays:
+            return version, [arrays['arr_%d' % i] for i in range(len(arrays.files))]
 
     @classmethod
-    def _update_model(cls, model: Sequential):
-        weights = pickle.dumps(model.get_weights())
-        NNStructure.objects.update_or_create(defaults={'weights': weights})
+    def _update_model(cls, model: 'Sequential'):
+        NNStructure.objects.save_weights(cls.dump_weights(model.get_weights()), cls.architecture)
+        # Процесс, который обучал нейросеть, сразу проверяет сообщения новыми весами
+        cls._model_checked_at = None
 
     @classmethod
-    def _get_model(cls, init: bool = False) -> Sequential:
+    def _build_model(cls) -> 'Sequential':
         """
-        Пытается получить модель из БД или инициализирует новую
-        :param init: Если False - попытаться получить модель из БД
+        Создает и компилирует модель без весов
         :return: Объект Sequential нейросети
         """
+        from keras.layers import Dense, Dropout
+        from keras.metrics import binary_accuracy
+        from keras.models import Sequential
+
         model = Sequential()
         model.add(Dense(128, activation='relu', input_shape=(cls.num_metrics,)))
         model.add(Dropout(0.5))
         model.add(Dense(64, activation='relu'))
         model.add(Dropout(0.5))
         model.add(Dense(1, activation='sigmoid'))
-        model.summary()
         model.compile(loss='binary_crossentropy',
                       optimizer='adam',
                       metrics=['acc', binary_accuracy])
 
+        return model
+
+    @classmethod
+    def get_model(cls) -> Union['Sequential', NumpyMLP]:
+        """
+        Возвращает модель процесса для проверки сообщений. Модель создается и компилируется один раз, после загрузки
+        весов прогревается одним предсказанием. Раз в NN_MODEL_CHECK_INTERVAL секунд версия и контрольная сумма
+        весов сверяются с БД, веса перезагружаются только если они изменились. Контрольная сумма нужна, потому что
+        версия начинается с 0 заново, если строку NNStructure удалили и создали.
+        При NN_INFERENCE_BACKEND = 'numpy' вместо модели keras используется NumpyMLP, и tensorflow не импортируется
+        :return: Объект Sequential нейросети или NumpyMLP
+        """
+        now = time.monotonic()
+        backend = settings.NN_INFERENCE_BACKEND
+
+        if cls._model_backend != backend or cls._model_checked_at is None or \
+                now - cls._model_checked_at >= settings.NN_MODEL_CHECK_INTERVAL:
+            with cls._model_lock:
+                if cls._model_backend != backend or cls._model_checked_at is None or \
+                        now - cls._model_checked_at >= settings.NN_MODEL_CHECK_INTERVAL:
+                    version, checksum = NNStructure.objects.get_state() or (None, None)
+
+                    if cls._model is None or cls._model_backend != backend or \
+                            (version, checksum) != (cls._model_version, cls._model_checksum):
+                        start_time = time.perf_counter()
+                        # Веса читаются из БД только при смене версии. Если их обновят между get_state и
+                        # load_weights, модель перезагрузится при следующей проверке
+                        stored = cls.load_weights() if version is not None else None
+
+                        if backend == 'numpy':
+                            # Без сохраненных весов нулевая сеть предсказывает 0.5, т.е. не спам
+                            model = NumpyMLP(cls.architecture, stored[1] if stored is not None else None)
+                        elif stored is not None:
+                            model = cls._model if cls._model_backend == 'keras' else cls._build_model()
+                            model.set_weights(stored[1])
+                        else:
+                            # Веса удалены. Старую модель не используем, иначе она проверяла бы старыми весами
+                            model = cls._build_model()
+
+                        # Первое предсказание строит функцию predict в keras. Делаем его до первого запроса
+                        model.predict(np.zeros((1, cls.num_metrics)))
+                        cls._model, cls._model_backend = model, backend
+                        cls._model_version, cls._model_checksum = version, checksum
+                        logger.info('NN model version %s loaded in %.3f s'
+                                    % (version, time.perf_counter() - start_time))
+
+                    cls._model_checked_at = now
+
+        return cls._model
+
+    @classmethod
+    def reset_model(cls) -> None:
+        """
+        Сбрасывает модель процесса. Следующий get_model создаст ее заново и загрузит веса из БД
+        :return: None
+        """
+        with cls._model_lock:
+            cls._model = None
+            cls._model_version = None
+            cls._model_checksum = None
+            cls._model_backend = None
+            cls._model_checked_at = None
+
+    @classmethod
+    def _get_model(cls, init: bool = False) -> 'Sequential':
+        """
+        Создает отдельную модель для обучения. Для проверки сообщений используется get_model
+        :param init: Если False - попытаться получить модель из БД
+        :return: Объект Sequential нейросети
+        """
+        model = cls._build_model()
+        model.summary()
+
         if not init:
-            weights = pickle.dumps(model.get_weights())
-            nn_struct, created = NNStructure.objects.get_or_create(weights=weights)
+            stored = cls.load_weights()
 
-            if not created:
-                model.set_weights(pickle.loads(nn_struct.weights))
+            if stored is not None:
+                model.set_weights(stored[1])
 
         return model
 
     @staticmethod
-    def _train_parse(index, msg, spam_flag) -> Optional[Tuple]:
-        prepared_data = ContentParser.prepare_for_pnn(msg)
+    def _train_parse(index: int, content: List[Tuple[str, bool]]) -> List[Tuple]:
+        """
+        Считает признаки пачки сообщений для нейросети
+        :param index: номер пачки
+        :param content: список с Tuple(сообщение, флаг спама)
+        :return: список Tuple(признаки сообщения, флаг спама) для сообщений с полезной информацией
+        """
+        results = []
+        parsed_messages = ContentParser.parse_batch([msg for msg, _ in content])
+
+        useful = [(parsed, spam_flag) for parsed, (_, spam_flag) in zip(parsed_messages, content) if parsed]
+        probabilities = BayesModel.check_messages_for_spam([parsed for parsed, _ in useful], return_probability=True)
 
-        if prepared_data:
-            parsed_body, msg_info = prepared_data
-            bayes_prob = BayesModel.check_message_for_spam(parsed_body, return_probability=True, clear_body=True)
-            logger.info('Proccessed message N: %d' % index)
+        for (parsed, spam_flag), probability in zip(useful, probabilities):
+            parsed.bayes_probability = probability
+            results.append((parsed.features, spam_flag))
 
-            return (*msg_info, bayes_prob), spam_flag
+        logger.info('Proccessed batch N: %d' % index)
+
+        return results
 
     @classmethod
     def _train(cls, learning_content: Union[TIterable[Tuple[str, bool]], Tuple[str, bool]], init: bool = False):
@@ -298,21 +786,29 @@ class NN(LearningModel):
         if isinstance(learning_content, tuple):
             learning_content = [learning_content]
 
-        func_args = [((index, msg, spam_flag), {}) for index, (msg, spam_flag) in enumerate(learning_content)]
+        chunks = cls._split_content(learning_content)
+        func_args = [((index, chunk), {}) for index, chunk in enumerate(chunks)]
 
-        results = (item for item in exec_in_parallel(cls._train_parse, func_args, need_db_refresh=True) if item)
+        # Процессы унаследуют загруженный снимок словаря байеса и не будут загружать его каждый сам. Пустой запрос
+        # загружает тот снимок, который выбран настройками
+        BayesModel._get_word_counts([])
 
-        # X - вход. Пустой np.array, который динамически заполнится далее
-        x = np.empty((0, cls.num_metrics), dtype=np.float64)
-        y = np.empty((0, 1), dtype=np.float64)
+        # Признаков не больше, чем сообщений. Массивы выделяются один раз, пачки записываются в них по мере
+        # готовности и сразу освобождаются
+        max_msgs = sum(len(chunk) for chunk in chunks)
+        x = np.empty((max_msgs, cls.num_metrics), dtype=np.float32)
+        y = np.empty((max_msgs, 1), dtype=np.float32)
         num_msgs = 0
 
-        for x_inp, y_inp in results:
-            x = np.append(x, np.array([x_inp]), axis=0)
-            y = np.append(y, np.array([y_inp], dtype=np.float64))
-            num_msgs += 1
+        for chunk in iter_in_parallel(cls._train_parse, func_args, need_db_refresh=True):
+            if not chunk:
+                continue
+
+            x[num_msgs:num_msgs + len(chunk)] = [features for features, _ in chunk]
+            y[num_msgs:num_msgs + len(chunk), 0] = [spam_flag for _, spam_flag in chunk]
+            num_msgs += len(chunk)
 
-        y = y.reshape(-1, 1)
+        x, y = x[:num_msgs], y[:num_msgs]
 
         epochs = num_msgs * 3
         model = cls._get_model(init=init)
@@ -322,29 +818,90 @@ class NN(LearningModel):
     @classmethod
     def check_for_valid(cls, spam: MailContentSource, ham: MailContentSource, num_msg_to_check: int = 100,
                         **kwargs) -> List[Tuple[str, bool]]:
-        nn = cls._get_model()
-        return super().check_for_valid(spam, ham, num_msg_to_check=num_msg_to_check, nn=nn)
+        nn = cls.get_model()
+        return super().check_for_valid(spam, ham, num_msg_to_check=num_msg_to_check, nn=nn, parallel=True)
 
     @classmethod
-    def check_message_for_spam(cls, message: str, nn: Sequential = None) -> bool:
+    def check_message_for_spam(cls, message: Union[str, ParsedMessage], return_probability: bool = False,
+                               nn: Union['Sequential', NumpyMLP] = None) -> Union[float, bool]:
         """
         Проверяет сообщение на спам
-        :param message: Сообщение
-        :param nn: Опционально, экземпляр модели нейросети, чтобы не получать ее каждый раз из БД
+        :param message: Сообщение или результат его разбора ContentParser.parse_message
+        :param return_probability: вернуть вероятность, вместо флага True/False
+        :param nn: Опционально, экземпляр модели нейросети. По умолчанию модель процесса из get_model
         :return: boolean. Сообщение спам или нет
         """
-        prepared_data = ContentParser.prepare_for_pnn(message)
+        if not isinstance(message, ParsedMessage):
+            # На проверку приходят тысячи одинаковых писем рассылок. Результат разбора берется из кэша
+            message = ContentParser.parse_message(message, use_cache=True)
+
+        if not message:
+            return 0.0 if return_probability else False
 
-        if prepared_data:
-            nn = nn or cls._get_model()
-            parsed_body, msg_info = prepared_data
-            bayes_prob = BayesModel.check_message_for_spam(parsed_body, return_probability=True, clear_body=True)
-            result = nn.predict(np.array([(*msg_info, bayes_prob)]))
+        return cls.check_messages_for_spam([message], return_probability=return_probability, nn=nn)[0]
 
-            # При сравнении возвращается nparray([[boolean]]). Приведем к bool
-            return bool(result > 0.6)
+    @staticmethod
+    def _check_parse(index: int, messages: List[str]) -> Tuple[int, List[Optional[ParsedMessage]]]:
+        """
+        Разбирает пачку сообщений для проверки и считает для них вероятности байеса одним обращением к словарю
+        :param index: номер пачки
+        :param messages: сообщения
+        :return: номер пачки и список ParsedMessage или None для сообщений без полезной информации
+        """
+        parsed_messages = ContentParser.parse_batch(messages)
+        useful = [parsed for parsed in parsed_messages if parsed]
+
+        for parsed, probability in zip(useful, BayesModel.check_messages_for_spam(useful, return_probability=True)):
+            parsed.bayes_probability = probability
+
+        return index, parsed_messages
+
+    @classmethod
+    def check_messages_for_spam(cls, messages: List[Union[str, ParsedMessage]], return_probability: bool = False,
+                                nn: Union['Sequential', NumpyMLP] = None, parallel: bool = False) \
+            -> Union[np.ndarray, List[bool]]:
+        """
+        Проверяет несколько сообщений на спам. Сообщения разбираются пачками по PARSE_BATCH_SIZE, вероятности
+        байеса считаются для пачки одним обращением к словарю, нейросеть вызывается один раз для всех сообщений
+        :param messages: Сообщения или результаты их разбора ContentParser.parse_message
+        :param return_probability: вернуть массив вероятностей, вместо флагов True/False
+        :param nn: Опционально, экземпляр модели нейросети. По умолчанию модель процесса из get_model
+        :param parallel: разбирать пачки в NUM_CPU_CORES процессах. Только для проверок из командной строки:
+        воркер, который обслуживает запросы, не должен форкаться вместе с загруженной моделью
+        :return: массив вероятностей спама или список флагов в порядке messages. У сообщений без полезной
+        информации вероятность 0
+        """
+        chunks = cls._split_content([msg for msg in messages if not isinstance(msg, ParsedMessage)])
+
+        if parallel and len(chunks) > 1:
+            # Процессы унаследуют загруженный снимок словаря байеса
+            BayesModel._get_word_counts([])
+            func_args = [((index, chunk), {}) for index, chunk in enumerate(chunks)]
+            # exec_in_parallel не сохраняет порядок пачек. Восстанавливаем его по номеру пачки
+            results = sorted(exec_in_parallel(cls._check_parse, func_args, need_db_refresh=True), key=lambda r: r[0])
         else:
-            return False
+            results = [cls._check_parse(index, chunk) for index, chunk in enumerate(chunks)]
+
+        parsed_batch = (parsed for _, chunk in results for parsed in chunk)
+        parsed_messages = [msg if isinstance(msg, ParsedMessage) else next(parsed_batch) for msg in messages]
+        useful = [parsed for parsed in parsed_messages if parsed]
+        missing = [parsed for parsed in useful if parsed.bayes_probability is None]
+
+        for parsed, probability in zip(missing, BayesModel.check_messages_for_spam(missing, return_probability=True)):
+            parsed.bayes_probability = probability
+
+        probabilities = np.zeros(len(messages), dtype=np.float64)
+
+        if useful:
+            x = np.empty((len(useful), cls.num_metrics), dtype=np.float32)
+
+            for i, parsed in enumerate(useful):
+                x[i] = parsed.features
+
+            nn = nn or cls.get_model()
+            probabilities[[i for i, parsed in enumerate(parsed_messages) if parsed]] = nn.predict(x).reshape(-1)
+
+        return probabilities if return_probability else [bool(probability > 0.6) for probability in probabilities]
 
     @classproperty
     def db_model(cls) -> Type[Model]:
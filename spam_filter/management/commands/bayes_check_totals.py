@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from spam_filter.models import BayesDelta, BayesDictionary, BayesMetadata
+
+
+class Command(BaseCommand):
+    help = 'Сверяет общее количество слов в спаме и хаме в BayesMetadata с суммой по BayesDictionary и BayesDelta'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Записать в BayesMetadata суммы по словарю')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Блокировка строки не дает обучению изменить словарь между чтением сумм и исправлением
+            BayesMetadata.objects.get_or_create()
+            metadata = BayesMetadata.objects.select_for_update().get()
+            aggr_sum = BayesDictionary.objects.nocache() \
+                .aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
+            # Приращения из журнала уже учтены в BayesMetadata, но еще не перенесены в словарь
+            delta_sum = BayesDelta.objects.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
+            expected = ((aggr_sum['sum_spam'] or 0) + (delta_sum['sum_spam'] or 0),
+                        (aggr_sum['sum_ham'] or 0) + (delta_sum['sum_ham'] or 0))
+            actual = (metadata.spam_total, metadata.ham_total)
+
+            self.stdout.write('spam_total: %d, expected: %d' % (actual[0], expected[0]))
+            self.stdout.write('ham_total: %d, expected: %d' % (actual[1], expected[1]))
+
+            if actual == expected:
+                self.stdout.write(self.style.SUCCESS('Totals are consistent'))
+            elif options['fix']:
+                metadata.spam_total, metadata.ham_total = expected
+                metadata.save(update_fields=['spam_total', 'ham_total'])
+                self.stdout.write(self.style.WARNING('Totals fixed'))
+            else:
+                raise CommandError('Totals are inconsistent. Run with --fix to update them')
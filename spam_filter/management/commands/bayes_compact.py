@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from spam_filter.learning_models import BayesModel
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из словаря байеса редкие и неинформативные слова и показывает размер словаря до и после'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-count', type=int, default=settings.BAYES_COMPACT_MIN_COUNT,
+                            help='Минимальное количество появлений слова в спаме и хаме')
+        parser.add_argument('--min-deviation', type=float, default=settings.BAYES_COMPACT_MIN_DEVIATION,
+                            help='Минимальное отклонение вероятности спама слова от 0.5')
+        parser.add_argument('--max-words', type=int, default=settings.BAYES_COMPACT_MAX_WORDS,
+                            help='Максимальное количество слов в словаре')
+
+    def handle(self, *args, **options):
+        report = BayesModel.compact(min_count=options['min_count'], min_deviation=options['min_deviation'],
+                                    max_words=options['max_words'])
+
+        self.stdout.write('rows: %d -> %d' % (report['rows_before'], report['rows_after']))
+        self.stdout.write('table size: %d -> %d bytes' % (report['table_size_before'], report['table_size_after']))
+        self.stdout.write('scoring latency: %.6f -> %.6f s' % (report['scoring_latency_before'],
+                                                              report['scoring_latency_after']))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from spam_filter.bayes_snapshot import BayesHashedSnapshot, BayesSnapshot
+from spam_filter.learning_models import BayesModel
+from spam_filter.mail_source import FileMailContentSource
+from spam_filter.models import BayesDictionary, BayesMetadata
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает точность байеса по словарю BayesDictionary и по корзинам хэшей (BAYES_STORAGE = hashed). ' \
+           'Корзины строятся в памяти из того же словаря, БД не меняется'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spam', help='Файл со спамом')
+        parser.add_argument('ham', help='Файл с хамом')
+        parser.add_argument('--delimiter', default='**********\n', help='Разделитель писем в файлах')
+        parser.add_argument('--num-msg', type=int, default=100, help='Количество писем каждого типа для проверки')
+        parser.add_argument('--bits', type=int, nargs='+', default=[settings.BAYES_HASH_BITS],
+                            help='Количество бит хэша. Можно указать несколько')
+
+    def handle(self, *args, **options):
+        spam = FileMailContentSource(options['spam'], options['delimiter'])
+        ham = FileMailContentSource(options['ham'], options['delimiter'])
+        num_messages = len(spam.get_content(max_items=options['num_msg'])) + \
+            len(ham.get_content(max_items=options['num_msg']))
+
+        version = BayesMetadata.objects.get_version()
+        words = list(BayesDictionary.objects.nocache().values_list('word', 'spam_count', 'ham_count'))
+        snapshots = [('words', BayesSnapshot(version, words))]
+        snapshots.extend(('hashed, %d bits' % bits, BayesHashedSnapshot.from_words(version, bits, words))
+                         for bits in options['bits'])
+
+        self.stdout.write('Words: %d, messages: %d' % (len(words), num_messages))
+        self.stdout.write('%-20s %14s %10s %8s %10s' % ('storage', 'memory, bytes', 'buckets', 'errors', 'accuracy'))
+
+        for name, snapshot in snapshots:
+            errors = BayesModel.check_for_valid(spam, ham, num_msg_to_check=options['num_msg'], snapshot=snapshot)
+            self.stdout.write('%-20s %14d %10d %8d %10.4f' % (name, snapshot.memory_usage(), len(snapshot), len(errors),
+                                                               1 - len(errors) / max(num_messages, 1)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from spam_filter.bayes_file import BayesFile
+from spam_filter.models import BayesDelta, BayesMetadata
+
+
+class Command(BaseCommand):
+    help = 'Выгружает словарь байеса в бинарный файл, который можно отобразить в память (см. BAYES_MMAP_PATH)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Блокировка строки не дает обучению закончиться во время выгрузки, поэтому версия, общее количество слов
+            # и словарь в файле согласованы
+            BayesMetadata.objects.get_or_create()
+            metadata = BayesMetadata.objects.select_for_update().get()
+            # Вместе с приращениями журнала, которые еще не перенесены в словарь
+            words = BayesDelta.objects.get_merged_counts()
+            num_words = BayesFile.write(options['path'], metadata.version, metadata.spam_total, metadata.ham_total,
+                                        words)
+
+        self.stdout.write(self.style.SUCCESS('Exported %d words, version %d' % (num_words, metadata.version)))
@@ -0,0 +1,82 @@
+import csv
+import io
+from typing import Iterable, Tuple
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from spam_filter.bayes_file import BayesFile
+from spam_filter.bayes_snapshot import BayesSnapshot
+from spam_filter.models import BayesDelta, BayesDictionary, BayesMetadata
+
+
+class CSVRowsReader:
+    """
+    Файлоподобный объект для cursor.copy_expert: строки csv создаются по мере чтения, поэтому в памяти не
+    бывает больше одной порции COPY
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, int, int]]):
+        """
+        :param rows: Iterable[(слово, появлений в спаме, появлений в хаме)]
+        """
+        self._rows = iter(rows)
+        self._line = io.StringIO()
+        self._writer = csv.writer(self._line)
+        self._pending = ''
+
+    def read(self, size: int = -1) -> str:
+        """
+        :param size: количество символов. -1 - все оставшиеся строки
+        :return: очередная порция csv
+        """
+        chunks = [self._pending]
+        length = len(self._pending)
+
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+
+            if row is None:
+                break
+
+            self._line.seek(0)
+            self._line.truncate()
+            self._writer.writerow(row)
+            chunks.append(self._line.getvalue())
+            length += len(chunks[-1])
+
+        data = ''.join(chunks)
+
+        if size < 0:
+            self._pending = ''
+            return data
+
+        self._pending = data[size:]
+
+        return data[:size]
+
+
+class Command(BaseCommand):
+    help = 'Заменяет словарь байеса словарем из файла bayes_export. Строки загружаются в БД через COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу')
+
+    def handle(self, *args, **options):
+        bayes_file = BayesFile(options['path'])
+
+        with transaction.atomic():
+            BayesDictionary.objects.all().delete()
+            BayesDelta.objects.all().delete()
+
+            with connection.cursor() as cursor:
+                cursor.copy_expert('COPY %s (word, spam_count, ham_count) FROM STDIN WITH (FORMAT csv)'
+                                   % connection.ops.quote_name(BayesDictionary._meta.db_table),
+                                   CSVRowsReader(bayes_file.iter_words()))
+
+            # Версия словаря в БД увеличивается, а не берется из файла, чтобы снимки процессов перезагрузились
+            BayesMetadata.objects.register_training(bayes_file.spam_total, bayes_file.ham_total, init=True)
+
+        BayesSnapshot.invalidate()
+        self.stdout.write(self.style.SUCCESS('Imported %d words from version %d' % (len(bayes_file),
+                                                                                    bayes_file.version)))
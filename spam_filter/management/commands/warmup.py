@@ -0,0 +1,49 @@
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from spam_filter.bayes_file import BayesFile
+from spam_filter.bayes_snapshot import BayesHashedSnapshot, BayesSnapshot
+from spam_filter.content_parser import ContentParser
+from spam_filter.nlp_resources import NLPResources
+
+
+class Command(BaseCommand):
+    help = 'Загружает тяжелые ресурсы заранее: данные nltk, анализаторы, emoji, словарь байеса и нейросеть. ' \
+           'Показывает время загрузки каждого ресурса'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-nn', action='store_true', help='Не импортировать keras и не загружать нейросеть')
+
+    def _load(self, name: str, func: Callable) -> None:
+        start_time = time.perf_counter()
+        func()
+        self.stdout.write('%-20s %.3f s' % (name, time.perf_counter() - start_time))
+
+    def handle(self, *args, **options):
+        self._load('nlp resources', NLPResources.preload)
+        self._load('emoji matcher', ContentParser.get_emoji_matcher)
+
+        if settings.BAYES_STORAGE == 'hashed':
+            self._load('bayes hashed', BayesHashedSnapshot.get)
+            self.stdout.write('bayes hashed: %s' % BayesHashedSnapshot.stats())
+        else:
+            self._load('bayes file', BayesFile.get)
+            file_stats = BayesFile.stats()
+
+            if file_stats['loaded']:
+                self.stdout.write('bayes file: %s' % file_stats)
+
+            # Устаревший файл не используется, проверка идет по снимку
+            if not file_stats['loaded'] or file_stats['stale']:
+                self._load('bayes snapshot', BayesSnapshot.get)
+                self.stdout.write('bayes snapshot: %s' % BayesSnapshot.stats())
+
+        if not options['skip_nn']:
+            from spam_filter.learning_models import NN
+
+            self._load('neural network', NN.get_model)
+
+        self.stdout.write(self.style.SUCCESS('Warmup finished'))
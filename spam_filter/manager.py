@@ -1,22 +1,208 @@
-from django.db.models import QuerySet
+import hashlib
+from typing import List, Optional, Tuple
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import F, Manager, QuerySet
 from django_pg_bulk_update.manager import BulkUpdateManager
 from django_pg_returning import UpdateReturningMixin
 
 
-class NNQuerySet(QuerySet):
+class SingleRowQuerySet(QuerySet):
     """
-    Сделаем возможным получение весов нейросети при любых параметров
-    Ограничение на создание в соответствубщем UNIQUE CONSTRAINT в БД.
+    Запрос к таблице из одной строки: веса нейросети, метаданные и корзины хэшей словаря байеса.
+    get возвращает эту строку при любых параметрах. Вторую строку создать нельзя из-за UNIQUE CONSTRAINT в БД.
     """
 
     def get(self, *args, **kwargs):
         return super().get()
 
 
-class NNManager(UpdateReturningMixin, BulkUpdateManager):
+class SingleRowManager(UpdateReturningMixin, BulkUpdateManager):
     def get_queryset(self):
-        return NNQuerySet(using=self.db, model=self.model)
+        return SingleRowQuerySet(using=self.db, model=self.model)
+
+
+class NNStructureManager(SingleRowManager):
+    """
+    Веса нейросети. Версия увеличивается при каждом сохранении весов, чтобы процессы могли проверить ее,
+    не читая сами веса
+    """
+
+    def get_version(self) -> Optional[int]:
+        """
+        :return: версия весов или None, если нейросеть еще не обучена
+        """
+        return self.values_list('version', flat=True).first()
+
+    def get_state(self) -> Optional[Tuple[int, str]]:
+        """
+        :return: версия и контрольная сумма весов или None, если нейросеть еще не обучена
+        """
+        return self.values_list('version', 'checksum').first()
+
+    def get_weights(self) -> Optional[Tuple[int, bytes, str, str]]:
+        """
+        :return: версия, веса, контрольная сумма весов и описание архитектуры или None, если нейросеть еще не обучена
+        """
+        return self.values_list('version', 'weights', 'checksum', 'architecture').first()
+
+    def save_weights(self, weights: bytes, architecture: str) -> None:
+        """
+        Сохраняет веса, их контрольную сумму и архитектуру нейросети и увеличивает версию
+        :param weights: сериализованные веса
+        :param architecture: описание архитектуры нейросети, для которой сохранены веса
+        :return: None
+        """
+        checksum = hashlib.sha256(weights).hexdigest()
+        _, created = self.get_or_create(defaults={'weights': weights, 'checksum': checksum,
+                                                  'architecture': architecture})
+
+        if not created:
+            self.update(weights=weights, checksum=checksum, architecture=architecture, version=F('version') + 1)
 
 
 class BayesDictonaryManager(UpdateReturningMixin, BulkUpdateManager):
-    pass
+    def prune(self, ids: List[int]) -> Tuple[int, int, int]:
+        """
+        Удаляет слова словаря по id. Слова, у которых в журнале BayesDelta есть еще не перенесенные приращения,
+        не удаляются: иначе перенос журнала сразу вернул бы их в словарь. Строки блокируются в порядке сортировки
+        слов, как и при обучении, поэтому параллельное обучение не взаимоблокируется с удалением.
+        Появления возвращаются из самих удаленных строк, т.е. включают приращения обучения, которое успело
+        завершиться между выбором слов и удалением
+        :param ids: id строк словаря
+        :return: количество удаленных строк, сумма их появлений в спаме и сумма появлений в хаме
+        """
+        delta = apps.get_model('spam_filter', 'BayesDelta')
+        quote_name = connection.ops.quote_name
+        dictionary_table, delta_table = quote_name(self.model._meta.db_table), quote_name(delta._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute('WITH deleted AS ('
+                           'DELETE FROM {dictionary} WHERE id IN ('
+                           'SELECT id FROM {dictionary} WHERE id = ANY(%s) AND NOT EXISTS ('
+                           'SELECT 1 FROM {delta} WHERE {delta}.word = {dictionary}.word'
+                           ') ORDER BY word FOR UPDATE'
+                           ') RETURNING spam_count, ham_count'
+                           ') SELECT COUNT(*), COALESCE(SUM(spam_count), 0), COALESCE(SUM(ham_count), 0) FROM deleted'
+                           .format(dictionary=dictionary_table, delta=delta_table), [ids])
+            return cursor.fetchone()
+
+
+class BayesMetadataManager(SingleRowManager):
+    """
+    Метаданные словаря BayesDictionary
+    """
+
+    def get_version(self) -> int:
+        """
+        Версия словаря BayesDictionary. Увеличивается при каждом обучении
+        :return: номер версии
+        """
+        metadata, _ = self.get_or_create()
+        return metadata.version
+
+    def get_totals(self) -> Tuple[int, int]:
+        """
+        Сколько всего слов в спаме и хаме в словаре. Поддерживается обучением вместо SUM по всему словарю
+        :return: всего появлений слов в спаме, всего появлений слов в хаме
+        """
+        metadata, _ = self.get_or_create()
+        return metadata.spam_total, metadata.ham_total
+
+    def get_state(self) -> Tuple[int, int, int]:
+        """
+        Версия словаря и общее количество слов в спаме и хаме одним запросом
+        :return: версия, всего появлений слов в спаме, всего появлений слов в хаме
+        """
+        metadata, _ = self.get_or_create()
+        return metadata.version, metadata.spam_total, metadata.ham_total
+
+    def register_training(self, spam_count: int, ham_count: int, init: bool = False) -> None:
+        """
+        Увеличивает версию словаря и общее количество слов теми же приращениями, что были записаны в словарь.
+        Вызывается в транзакции обучения, чтобы новые значения стали видны вместе с данными
+        :param spam_count: сколько появлений слов в спаме добавлено в словарь
+        :param ham_count: сколько появлений слов в хаме добавлено в словарь
+        :param init: словарь создан заново, предыдущие значения сбрасываются
+        :return: None
+        """
+        self.get_or_create()
+
+        if init:
+            self.update(version=F('version') + 1, spam_total=spam_count, ham_total=ham_count)
+        else:
+            self.update(version=F('version') + 1, spam_total=F('spam_total') + spam_count,
+                        ham_total=F('ham_total') + ham_count)
+
+
+class BayesDeltaManager(Manager):
+    """
+    Журнал приращений словаря BayesDictionary в режиме BAYES_WRITE_MODE = 'log'. Обучение только добавляет строки,
+    поэтому параллельные обучения не блокируют друг друга на частых словах. Приращения переносятся в словарь
+    периодически методом compact
+    """
+
+    def _get_tables(self) -> Tuple[str, str]:
+        """
+        :return: имена таблиц словаря и журнала
+        """
+        dictionary = apps.get_model('spam_filter', 'BayesDictionary')
+        quote_name = connection.ops.quote_name
+
+        return quote_name(dictionary._meta.db_table), quote_name(self.model._meta.db_table)
+
+    def get_merged_counts(self, words: Optional[List[str]] = None) -> List[Tuple[str, int, int]]:
+        """
+        Появления слов в словаре вместе с еще не перенесенными приращениями. Словарь и журнал читаются одним
+        запросом, т.е. из одного снимка БД, поэтому перенос приращений во время чтения не теряет и не удваивает их
+        :param words: слова. None - весь словарь
+        :return: список (слово, появлений в спаме, появлений в хаме)
+        """
+        dictionary_table, delta_table = self._get_tables()
+        where = 'WHERE word = ANY(%s)' if words is not None else ''
+        params = [list(words)] * 2 if words is not None else []
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT word, SUM(spam_count)::bigint, SUM(ham_count)::bigint FROM ('
+                           'SELECT word, spam_count, ham_count FROM %s %s '
+                           'UNION ALL SELECT word, spam_count, ham_count FROM %s %s'
+                           ') AS counts GROUP BY word' % (dictionary_table, where, delta_table, where), params)
+            return cursor.fetchall()
+
+    def compact(self, batch_size: int = 10000) -> int:
+        """
+        Переносит приращения в словарь порциями по batch_size строк журнала. Каждая порция переносится одним
+        запросом: строки удаляются из журнала и добавляются к словарю в одном снимке БД. Слова обновляются
+        в порядке сортировки, чтобы параллельные переносы не взаимоблокировались. Если перенос уже идет в другом
+        процессе, метод ничего не делает
+        :param batch_size: строк журнала в одной транзакции
+        :return: количество перенесенных строк журнала
+        """
+        dictionary_table, delta_table = self._get_tables()
+        total = 0
+
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_xact_lock(hashtext(%s))', [delta_table])
+
+                if not cursor.fetchone()[0]:
+                    return total
+
+                cursor.execute('WITH moved AS ('
+                               'DELETE FROM {delta} WHERE id IN (SELECT id FROM {delta} ORDER BY id LIMIT %s) '
+                               'RETURNING word, spam_count, ham_count'
+                               '), merged AS ('
+                               'INSERT INTO {dictionary} (word, spam_count, ham_count) '
+                               'SELECT word, SUM(spam_count), SUM(ham_count) FROM moved GROUP BY word ORDER BY word '
+                               'ON CONFLICT (word) DO UPDATE SET '
+                               'spam_count = {dictionary}.spam_count + EXCLUDED.spam_count, '
+                               'ham_count = {dictionary}.ham_count + EXCLUDED.ham_count'
+                               ') SELECT COUNT(*) FROM moved'.format(delta=delta_table, dictionary=dictionary_table),
+                               [batch_size])
+                moved = cursor.fetchone()[0]
+
+            total += moved
+
+            if moved < batch_size:
+                return total
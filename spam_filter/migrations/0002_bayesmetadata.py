@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spam_filter', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BayesMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL("CREATE UNIQUE INDEX IF NOT EXISTS unique_bayesmetadata_index "
+                          "ON spam_filter_bayesmetadata ((id IS NOT NULL));",
+                          reverse_sql="DROP INDEX IF EXISTS unique_bayesmetadata_index;",
+                          hints={'model_name': 'spam_filter.BayesMetadata'})
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def init_totals(apps, schema_editor):
+    BayesDictionary = apps.get_model('spam_filter', 'BayesDictionary')
+    BayesMetadata = apps.get_model('spam_filter', 'BayesMetadata')
+
+    aggr_sum = BayesDictionary.objects.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
+    metadata = BayesMetadata.objects.first() or BayesMetadata()
+    metadata.spam_total = aggr_sum['sum_spam'] or 0
+    metadata.ham_total = aggr_sum['sum_ham'] or 0
+    metadata.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spam_filter', '0002_bayesmetadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bayesmetadata',
+            name='spam_total',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bayesmetadata',
+            name='ham_total',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(init_totals, migrations.RunPython.noop),
+    ]
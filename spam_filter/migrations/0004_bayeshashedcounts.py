@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spam_filter', '0003_bayesmetadata_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BayesHashedCounts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bits', models.PositiveSmallIntegerField()),
+                ('spam_counts', models.BinaryField()),
+                ('ham_counts', models.BinaryField()),
+            ],
+        ),
+        migrations.RunSQL("CREATE UNIQUE INDEX IF NOT EXISTS unique_bayeshashedcounts_index "
+                          "ON spam_filter_bayeshashedcounts ((id IS NOT NULL));",
+                          reverse_sql="DROP INDEX IF EXISTS unique_bayeshashedcounts_index;",
+                          hints={'model_name': 'spam_filter.BayesHashedCounts'})
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spam_filter', '0004_bayeshashedcounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BayesDelta',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('word', models.CharField(db_index=True, max_length=255)),
+                ('spam_count', models.PositiveIntegerField(default=0)),
+                ('ham_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
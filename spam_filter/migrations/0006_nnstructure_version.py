@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spam_filter', '0005_bayesdelta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nnstructure',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
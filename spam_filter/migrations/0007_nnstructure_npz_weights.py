@@ -0,0 +1,52 @@
+import hashlib
+import io
+import pickle
+
+import numpy as np
+from django.db import migrations, models
+
+# NN.architecture на момент миграции. Все веса, сохраненные до нее, относятся к этой архитектуре
+ARCHITECTURE = 'input:7,dense:128:relu,dropout:0.5,dense:64:relu,dropout:0.5,dense:1:sigmoid'
+
+
+def pickle_to_npz(apps, schema_editor):
+    NNStructure = apps.get_model('spam_filter', 'NNStructure')
+
+    for nn_struct in NNStructure.objects.all():
+        buffer = io.BytesIO()
+        np.savez(buffer, *[np.asarray(array, dtype=np.float32) for array in pickle.loads(bytes(nn_struct.weights))])
+        nn_struct.weights = buffer.getvalue()
+        nn_struct.checksum = hashlib.sha256(nn_struct.weights).hexdigest()
+        nn_struct.architecture = ARCHITECTURE
+        nn_struct.save()
+
+
+def npz_to_pickle(apps, schema_editor):
+    NNStructure = apps.get_model('spam_filter', 'NNStructure')
+
+    for nn_struct in NNStructure.objects.all():
+        with np.load(io.BytesIO(bytes(nn_struct.weights)), allow_pickle=False) as arrays:
+            nn_struct.weights = pickle.dumps([arrays['arr_%d' % i] for i in range(len(arrays.files))])
+
+        nn_struct.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spam_filter', '0006_nnstructure_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nnstructure',
+            name='checksum',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='nnstructure',
+            name='architecture',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(pickle_to_npz, npz_to_pickle),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 
-from spam_filter.manager import NNManager, BayesDictonaryManager
+from spam_filter.manager import SingleRowManager, NNStructureManager, BayesDictonaryManager, BayesDeltaManager, \
+    BayesMetadataManager
 
 
 class LearningMessage(models.Model):
@@ -17,7 +18,47 @@ class BayesDictionary(models.Model):
     objects = BayesDictonaryManager()
 
 
+class BayesDelta(models.Model):
+    """
+    Приращения появлений слов, которые еще не перенесены в BayesDictionary
+    """
+    id = models.BigAutoField(primary_key=True)
+    word = models.CharField(max_length=255, db_index=True)
+    spam_count = models.PositiveIntegerField(default=0)
+    ham_count = models.PositiveIntegerField(default=0)
+
+    objects = BayesDeltaManager()
+
+
+class BayesMetadata(models.Model):
+    version = models.PositiveIntegerField(default=0)
+    # Сумма spam_count и ham_count по всему BayesDictionary
+    spam_total = models.BigIntegerField(default=0)
+    ham_total = models.BigIntegerField(default=0)
+
+    objects = BayesMetadataManager()
+
+
+class BayesHashedCounts(models.Model):
+    """
+    Словарь байеса в режиме BAYES_STORAGE = 'hashed': слово попадает в одну из 2 ** bits корзин по хэшу, появления
+    в спаме и хаме хранятся массивами uint32 по корзинам
+    """
+    bits = models.PositiveSmallIntegerField()
+    spam_counts = models.BinaryField()
+    ham_counts = models.BinaryField()
+
+    objects = SingleRowManager()
+
+
 class NNStructure(models.Model):
+    # Массивы весов float32 в формате npz
     weights = models.BinaryField()
+    # Увеличивается при каждом сохранении весов
+    version = models.PositiveIntegerField(default=0)
+    # sha256 от weights
+    checksum = models.CharField(max_length=64, default='')
+    # Описание слоев нейросети, для которой сохранены веса
+    architecture = models.CharField(max_length=255, default='')
 
-    objects = NNManager()
+    objects = NNStructureManager()
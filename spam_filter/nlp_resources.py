@@ -0,0 +1,110 @@
+import logging
+import os
+import resource
+import threading
+import time
+
+import nltk
+from django.conf import settings
+from nltk.corpus import words
+from nltk.stem import WordNetLemmatizer, SnowballStemmer
+from pymorphy2 import MorphAnalyzer
+
+from spam_filter.utils import LRUCache
+
+logger = logging.getLogger('default')
+
+NLTK_DATA = [('punkt', 'tokenizers/punkt'), ('words', 'corpora/words'), ('wordnet', 'corpora/wordnet'),
+             ('averaged_perceptron_tagger', 'taggers/averaged_perceptron_tagger')]
+
+
+def ensure_nltk_data() -> None:
+    """
+    Проверяет, что данные nltk установлены, и скачивает недостающие. Сеть нужна только если данных нет
+    :return: None
+    """
+    for module, path in NLTK_DATA:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(module)
+
+
+class NLPResources:
+    """
+    Набор тяжелых анализаторов естественного языка. Загрузка словарей pymorphy2 и wordnet занимает сотни миллисекунд,
+    поэтому анализаторы создаются один раз на процесс и переиспользуются всеми вызовами ContentParser.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        start_time = time.perf_counter()
+        start_rss = self._get_max_rss()
+
+        ensure_nltk_data()
+
+        self.rus_lemm_analyzer = MorphAnalyzer()
+        self.en_lemm_analyzer = WordNetLemmatizer()
+        self.rus_stemmer = SnowballStemmer('russian')
+        self.en_stemmer = SnowballStemmer('english')
+
+        # WordNetLemmatizer загружает корпус wordnet только при первом вызове. Прогреваем его сразу
+        self.en_lemm_analyzer.lemmatize('words')
+
+        # Поиск линейный по words.words() со всеми вытекающими. В памяти занимает 8 мб, решил не заморачиваться с БД
+        self.english_words = set(words.words())
+
+        # (язык, слово, часть речи) -> (нормальная форма, слово известно, значимая часть слова)
+        self.word_cache = LRUCache(settings.NLP_WORD_CACHE_SIZE)
+
+        self.pid = os.getpid()
+        self.load_time = time.perf_counter() - start_time
+        self.memory_usage = self._get_max_rss() - start_rss
+
+    @staticmethod
+    def _get_max_rss() -> int:
+        """
+        Максимальный размер резидентной памяти процесса. В linux ru_maxrss возвращается в килобайтах
+        :return: размер памяти в байтах
+        """
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @classmethod
+    def get(cls) -> 'NLPResources':
+        """
+        Возвращает анализаторы текущего процесса, загружая их при первом обращении
+        :return: NLPResources
+        """
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+                    logger.info('NLP resources loaded in %.3f s, memory: %d bytes'
+                                % (cls._instance.load_time, cls._instance.memory_usage))
+
+        return cls._instance
+
+    @classmethod
+    def preload(cls) -> 'NLPResources':
+        """
+        Загружает анализаторы заранее. Вызывается при старте воркеров gunicorn и celery, чтобы первый запрос
+        не платил за загрузку словарей. При форке процесса загруженные страницы памяти разделяются.
+        :return: NLPResources
+        """
+        return cls.get()
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        Статистика загрузки анализаторов в текущем процессе
+        :return: словарь с флагом загрузки, временем загрузки в секундах, приростом памяти в байтах и
+        статистикой кэша слов
+        """
+        instance = cls._instance
+
+        if instance is None:
+            return {'loaded': False, 'load_time': None, 'memory_usage': None, 'pid': os.getpid(), 'word_cache': None}
+
+        return {'loaded': True, 'load_time': instance.load_time, 'memory_usage': instance.memory_usage,
+                'pid': instance.pid, 'word_cache': instance.word_cache.stats()}
@@ -0,0 +1,89 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class NumpyMLP:
+    """
+    Прямой проход полносвязной нейросети на numpy для проверки сообщений без tensorflow. Веса те же, что у модели
+    keras из NN._build_model, в том же порядке: ядро и смещение каждого слоя Dense. Dropout при предсказании
+    ничего не делает, поэтому пропускается.
+
+    Архитектура задается строкой NN.architecture: 'input:7,dense:128:relu,dropout:0.5,...'
+    """
+    activations = {
+        'relu': lambda x: np.maximum(x, 0, out=x),
+        # 0.5 * (1 + tanh(x / 2)) - та же сигмоида, но без переполнения exp на больших по модулю x
+        'sigmoid': lambda x: 0.5 * (1 + np.tanh(0.5 * x)),
+        'linear': lambda x: x,
+    }
+
+    def __init__(self, architecture: str, weights: Optional[List[np.ndarray]] = None):
+        """
+        :param architecture: описание слоев
+        :param weights: массивы весов в порядке слоев. None - нулевые веса
+        """
+        self.architecture = architecture
+        self.input_size, self.layers = self.parse_architecture(architecture)
+        shapes = []
+        size = self.input_size
+
+        for units, _ in self.layers:
+            shapes.extend([(size, units), (units,)])
+            size = units
+
+        if weights is None:
+            weights = [np.zeros(shape) for shape in shapes]
+
+        if [tuple(np.shape(array)) for array in weights] != shapes:
+            raise ValueError('Weights shapes %s do not match architecture "%s"'
+                             % ([np.shape(array) for array in weights], architecture))
+
+        self.weights = [np.ascontiguousarray(array, dtype=np.float32) for array in weights]
+
+    @classmethod
+    def parse_architecture(cls, architecture: str) -> Tuple[int, List[Tuple[int, str]]]:
+        """
+        Разбирает описание слоев
+        :param architecture: описание слоев
+        :return: размер входа и список (количество нейронов, функция активации) слоев Dense
+        """
+        input_size = None
+        layers = []
+
+        for layer in architecture.split(','):
+            kind, *params = layer.split(':')
+
+            if kind == 'input':
+                input_size = int(params[0])
+            elif kind == 'dense':
+                if params[1] not in cls.activations:
+                    raise ValueError('Unknown activation "%s"' % params[1])
+
+                layers.append((int(params[0]), params[1]))
+            elif kind != 'dropout':
+                raise ValueError('Unknown layer "%s"' % layer)
+
+        if input_size is None or not layers:
+            raise ValueError('Architecture "%s" has no input or dense layers' % architecture)
+
+        return input_size, layers
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """
+        Предсказание для пачки входов, как у keras Model.predict
+        :param x: массив входов (количество, размер входа)
+        :return: массив выходов (количество, размер выхода) float32
+        """
+        x = np.asarray(x, dtype=np.float32)
+
+        for (_, activation), kernel, bias in zip(self.layers, self.weights[::2], self.weights[1::2]):
+            x = self.activations[activation](x @ kernel + bias)
+
+        return x
+
+    def get_weights(self) -> List[np.ndarray]:
+        """
+        :return: массивы весов в порядке слоев, как у keras Model.get_weights
+        """
+        return list(self.weights)
@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import pickle
+from typing import Any, Optional
+
+from django.conf import settings
+from redis import RedisError
+from statsd.defaults.django import statsd
+
+from spam_filter.utils import LRUCache
+
+logger = logging.getLogger('default')
+
+
+class ParseCache:
+    """
+    Кэш результатов разбора сообщений по хэшу содержимого. Рассылки спама состоят из тысяч одинаковых сообщений,
+    поэтому повторный разбор дорогой и бесполезный.
+    Первый уровень - LRU в памяти процесса, второй - опционально redis из настроек CACHEOPS_REDIS, общий для всех
+    процессов и серверов. В ключ входит версия разбора, поэтому после изменения разбора старые значения не читаются.
+    Попадания и промахи отправляются в statsd: parse_cache.hit.local, parse_cache.hit.redis, parse_cache.miss
+    """
+
+    def __init__(self, version: int):
+        """
+        :param version: версия разбора
+        """
+        self.version = version
+        self.local_cache = LRUCache(settings.PARSE_CACHE_SIZE)
+
+    def get_key(self, body: str) -> str:
+        """
+        Ключ кэша для содержимого
+        :param body: содержимое
+        :return: ключ
+        """
+        return 'parse_cache:%s:%s' % (self.version, hashlib.sha1(body.encode('utf-8', 'surrogatepass')).hexdigest())
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Получает значение из памяти процесса, а если его там нет - из redis
+        :param key: ключ из get_key
+        :return: значение или None, если его нет в кэше
+        """
+        value = self.local_cache.get(key)
+
+        if value is not None:
+            statsd.incr('parse_cache.hit.local')
+            return value
+
+        if settings.PARSE_CACHE_REDIS_ENABLED:
+            value = self._redis_get(key)
+
+            if value is not None:
+                statsd.incr('parse_cache.hit.redis')
+                self.local_cache.set(key, value)
+                return value
+
+        statsd.incr('parse_cache.miss')
+
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Сохраняет значение в память процесса и redis
+        :param key: ключ из get_key
+        :param value: значение, которое можно сериализовать pickle
+        :return: None
+        """
+        self.local_cache.set(key, value)
+
+        if settings.PARSE_CACHE_REDIS_ENABLED:
+            self._redis_set(key, value)
+
+    @staticmethod
+    def _redis_get(key: str) -> Optional[Any]:
+        # Недоступный redis не должен ломать проверку сообщений. Сообщение просто будет разобрано заново
+        from cacheops.redis import redis_client
+
+        try:
+            value = redis_client.get(key)
+        except RedisError as ex:
+            logger.warning('Parse cache redis get failed: %s' % ex)
+            return None
+
+        return pickle.loads(value) if value is not None else None
+
+    @staticmethod
+    def _redis_set(key: str, value: Any) -> None:
+        from cacheops.redis import redis_client
+
+        try:
+            redis_client.set(key, pickle.dumps(value), ex=settings.PARSE_CACHE_TIMEOUT)
+        except RedisError as ex:
+            logger.warning('Parse cache redis set failed: %s' % ex)
+
+    def stats(self) -> dict:
+        """
+        Статистика кэша в памяти процесса
+        :return: словарь с размером кэша, попаданиями, промахами и долей попаданий
+        """
+        return self.local_cache.stats()
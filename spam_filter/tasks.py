@@ -1,3 +1,5 @@
+import logging
+
 from celery import shared_task
 from django.conf import settings
 from django.db import transaction
@@ -7,6 +9,8 @@ from statsd.defaults.django import statsd
 from spam_filter.learning_models import BayesModel, NN
 from spam_filter.models import LearningMessage
 
+logger = logging.getLogger('default')
+
 
 @shared_task(queue=settings.CELERY_QUEUE, ignore_result=True)
 @statsd.timer('tasks.process_auto_learning')
@@ -19,3 +23,22 @@ def process_auto_learning():
             BayesModel.train(learning_content=learning_content)
             NN.train(learning_content=learning_content)
             learning_content.update(processed=now())
+
+
+@shared_task(queue=settings.CELERY_QUEUE, ignore_result=True)
+@statsd.timer('tasks.compact_bayes_dictionary')
+def compact_bayes_dictionary():
+    if settings.BAYES_COMPACTION_ENABLED:
+        report = BayesModel.compact(min_count=settings.BAYES_COMPACT_MIN_COUNT,
+                                    min_deviation=settings.BAYES_COMPACT_MIN_DEVIATION,
+                                    max_words=settings.BAYES_COMPACT_MAX_WORDS)
+        logger.info('Bayes dictionary compacted: %s' % report)
+        statsd.gauge('bayes_dictionary.rows', report['rows_after'])
+
+
+@shared_task(queue=settings.CELERY_QUEUE, ignore_result=True)
+@statsd.timer('tasks.compact_bayes_deltas')
+def compact_bayes_deltas():
+    # Выполняется и в режиме direct, чтобы после переключения режима журнал не остался неперенесенным
+    moved = BayesModel.compact_deltas()
+    statsd.incr('bayes_deltas.compacted', moved)
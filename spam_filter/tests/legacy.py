@@ -0,0 +1,101 @@
+"""
+Эталонные реализации, замененные оптимизированными версиями. Используются в тестах на идентичность результатов
+и в бенчмарках для сравнения скорости.
+"""
+import math
+import re
+from collections import Counter
+from html.parser import HTMLParser as BaseHTMLParser
+from typing import Dict, List, Tuple
+
+import emoji
+
+
+def replace_special_char(body: str) -> str:
+    regexp_exchange = [
+        (r'_+', '_'),
+        (r"[A-z0-9.!#$%&'*+-/=?^_`{|}~@]+@[A-z0-9-\.:]+", ' email_spec '),
+        (r"((\d+|\s)\$)", ' dollar_spec '),
+        (r'(https?)?(:\/\/)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.'
+         r'[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)', ' url_spec '),
+        (r"((\d+|\s)₽)", ' ruble_spec '),
+        (r'\(|\)|\!|\.|\?|:|\\|/|\[|\]', ''),
+        (r'(((\+\d+)|(8))[\s-]?\d+[\s-]\d+[\s-]\d+[\s-]?\d+)|(((\+\d+)|(8))\d{10})', ' phone_spec '),
+        (r"\{(\{|%)\s?.+\s?(\}|%)\}", ' '),  # убираем jinja2 подстановки
+        (r'&[A-z0-9\#]{2,8};', ' '),  # убираем html - символы &nbsp; и прочие
+        (r'"|«|»|\,|\-|“|”|\*|\||\'|;|{|}', ' '),
+        (r'\d+', ' number_spec '),
+        (r'\t', ' '),
+        (r'(\r\n)|\n', ' '),
+        (r'[\s\-]{1,}', ' '),  # заменяем любые пробелы на один пробел. \s включает в себя в том числе \xa0
+        (r'([\d\-]+%)|%', 'percent_spec'),
+        (r'[^\s]{255,}', '')  # удаляем все длиннее 255 символов, потому что я не знаю таких длинных слов
+    ]
+
+    for regexp, exchange in regexp_exchange:
+        body = re.sub(regexp, exchange, body)
+
+    return body.strip()
+
+
+class HTMLParser(BaseHTMLParser):
+
+    def error(self, message):
+        pass
+
+    def __init__(self):
+        super().__init__()
+        self._parse_data = []
+
+    def handle_starttag(self, tag: str, _):
+        if tag in {'a', 'img'}:
+            self._parse_data.append('html_external_spec')
+
+    def handle_data(self, data: str) -> None:
+        tag_string = self.get_starttag_text() or ''
+
+        m = re.search(r'(<style)|(<head)|(<script)|(<meta)|(<img)|(<title)', tag_string, re.I)
+        m2 = re.match(r'.*[A-z\-]+\s*:.*;.*}', data, re.DOTALL)
+
+        if not m and (tag_string or (not tag_string and not m2)):
+            self._parse_data.append(data)
+
+    def get_clear_data(self, content: str) -> str:
+        self.feed(content)
+        return ' '.join(self._parse_data)
+
+
+def get_stripped_html(body: str) -> str:
+    return HTMLParser().get_clear_data(body)
+
+
+def get_num_html_colors(body: str) -> int:
+    return len(re.findall(r'color\s*:\s*(([A-Za-z]+)|(#[A-Fa-f0-9]+)|)', body))
+
+
+def get_emojies(body: str) -> List[str]:
+    return [char for char in body if char in emoji.UNICODE_EMOJI]
+
+
+def bayes_spam_probability(word_dict: Dict[str, Tuple[int, int]], sum_spam: int, sum_ham: int) -> float:
+    prob_word_spam = {word: (spam_freq / sum_spam) / ((spam_freq / sum_spam) + (ham_freq / sum_ham))
+                      for word, (spam_freq, ham_freq) in word_dict.items()}
+
+    n = 13
+    max_prob_words = Counter()
+
+    for word, probability in prob_word_spam.items():
+        max_prob_words[word] = math.fabs((0.5 - probability))
+
+    multiple_spam_prob = 1
+    multiple_ham_prob = 1
+
+    for word, _ in max_prob_words.most_common(n):
+        s = 3
+        word_occur = word_dict[word][0] + word_dict[word][1]
+        spam_prob = (s * 0.5 + word_occur * prob_word_spam[word]) / (s + word_occur)
+
+        multiple_spam_prob *= spam_prob
+        multiple_ham_prob *= 1 - spam_prob
+
+    return multiple_spam_prob / (multiple_spam_prob + multiple_ham_prob)
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from spam_filter.bayes_file import BayesFile
+
+
+class BayesFileTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, 'bayes.bin')
+
+    def test_get_counts(self):
+        # Слова с одинаковыми первыми 8 байтами попадают под один ключ
+        words = {'a': (1, 0), 'ab': (2, 1), 'abcdefgh': (3, 2), 'abcdefghij': (4, 3), 'abcdefghik': (5, 4),
+                 'ёжик': (6, 5), 'ёжики': (7, 6), 'z': (0, 8)}
+        BayesFile.write(self.path, 3, 28, 29, ((word, *counts) for word, counts in words.items()))
+        bayes_file = BayesFile(self.path)
+
+        self.assertEqual(len(words), len(bayes_file))
+        self.assertTupleEqual((3, 28, 29), (bayes_file.version, bayes_file.spam_total, bayes_file.ham_total))
+
+        query = list(words) + ['', 'abc', 'abcdefghi', 'abcdefghijk', 'ёж', 'zz']
+        found_words, spam_counts, ham_counts = bayes_file.get_counts(query)
+        self.assertSetEqual(set(words), set(found_words))
+
+        for word, spam_count, ham_count in zip(found_words, spam_counts, ham_counts):
+            self.assertTupleEqual(words[word], (spam_count, ham_count))
+
+    def test_invalid_file(self):
+        BayesFile.write(self.path, 1, 1, 0, [('spam', 1, 0)])
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+
+        with self.assertRaises(ValueError):
+            BayesFile(self.path)
+
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 100)
+
+        with self.assertRaises(ValueError):
+            BayesFile(self.path)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from spam_filter.bayes_file import BayesFile
+from spam_filter.content_parser import ContentParser
+from spam_filter.learning_models import BayesModel
+from spam_filter.models import BayesDictionary, BayesMetadata
+from spam_filter.nlp_resources import NLPResources
+
+
+class WarmupCommandTest(TestCase):
+
+    def test_warmup(self):
+        out = StringIO()
+        call_command('warmup', '--skip-nn', stdout=out)
+
+        self.assertTrue(NLPResources.stats()['loaded'])
+        self.assertIsNotNone(ContentParser._emoji_matcher)
+        self.assertIn('nlp resources', out.getvalue())
+        self.assertNotIn('neural network', out.getvalue())
+
+
+class BayesCheckTotalsCommandTest(TestCase):
+
+    def test_check_totals(self):
+        BayesDictionary.objects.create(word='spam', spam_count=3, ham_count=1)
+        BayesMetadata.objects.get_or_create()
+
+        with self.assertRaises(CommandError):
+            call_command('bayes_check_totals', stdout=StringIO())
+
+        call_command('bayes_check_totals', '--fix', stdout=StringIO())
+        self.assertTupleEqual((3, 1), BayesMetadata.objects.get_totals())
+        call_command('bayes_check_totals', stdout=StringIO())
+
+
+class BayesExportImportCommandTest(TestCase):
+
+    def test_export_import(self):
+        words = [('spam', 3, 1), ('скидка', 5, 0), ('hello', 0, 4), ('spam_spam_spam', 1, 1)]
+        BayesDictionary.objects.bulk_create([BayesDictionary(word=word, spam_count=spam_count, ham_count=ham_count)
+                                             for word, spam_count, ham_count in words])
+        BayesMetadata.objects.register_training(9, 6, init=True)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'bayes.bin')
+            call_command('bayes_export', path, stdout=StringIO())
+
+            bayes_file = BayesFile(path)
+            self.assertEqual(BayesMetadata.objects.get_version(), bayes_file.version)
+            self.assertTupleEqual((9, 6), (bayes_file.spam_total, bayes_file.ham_total))
+            self.assertListEqual(sorted(words), sorted(bayes_file.iter_words()))
+
+            probability = BayesModel.check_message_for_spam('скидка spam', return_probability=True)
+
+            with override_settings(BAYES_MMAP_PATH=path, BAYES_SNAPSHOT_CHECK_INTERVAL=0):
+                self.assertIsNotNone(BayesFile.get())
+                self.assertAlmostEqual(probability,
+                                       BayesModel.check_message_for_spam('скидка spam', return_probability=True))
+
+                # После обучения файл устарел и не используется
+                BayesMetadata.objects.register_training(0, 0)
+                self.assertIsNone(BayesFile.get())
+                self.assertTrue(BayesFile.stats()['stale'])
+
+            BayesDictionary.objects.all().delete()
+            version = BayesMetadata.objects.get_version()
+            call_command('bayes_import', path, stdout=StringIO())
+
+        self.assertListEqual(sorted(words), sorted(BayesDictionary.objects.values_list('word', 'spam_count',
+                                                                                       'ham_count')))
+        self.assertTupleEqual((9, 6), BayesMetadata.objects.get_totals())
+        self.assertEqual(version + 1, BayesMetadata.objects.get_version())
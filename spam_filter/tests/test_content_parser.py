@@ -1,6 +1,11 @@
+from unittest.mock import patch
+
 from django.test import TestCase
 
-from spam_filter.content_parser import ContentParser
+from spam_filter.content_parser import ContentParser, HTMLStripper, ParseBudget
+from spam_filter.nlp_resources import NLPResources
+from spam_filter.parse_cache import ParseCache
+from spam_filter.tests import legacy
 
 
 class ContentParserTest(TestCase):
@@ -10,11 +15,38 @@ class ContentParserTest(TestCase):
         content = ContentParser.get_stripped_html(body)
         self.assertEqual("test 123 html_external_spec test link", content)
 
+    def test_html_stripper_parity(self):
+        """
+        Текст и количество цветов должны совпадать с прежней реализацией. В том числе текст после <img> и внутри
+        <header> пропускается, а незакрытый блок стилей, CDATA, объявления и ссылки на символы учитываются при
+        подсчете цветов
+        """
+        bodies = ["<p>x</p><img src='a.png'>after img<header>header text</header><p>y</p>",
+                  "body { color: red; } text <p alt='<img>'>alt</p>", "<p>color: #fff</p><style>p {color: blue;",
+                  # Цвета, которых парсер не отдает обработчикам или отдает измененными
+                  "<p>color&#58; red, color&colon; blue</p>", "<![CDATA[p { color: red; }]]><p>cdata</p>",
+                  "<?xml color: red?><!DOCTYPE html color: blue><p>decl</p></p color: green>"]
+
+        for template in ('template_1.html', 'template_2.html'):
+            with open('spam_filter/tests/html_templates/%s' % template, 'r') as f:
+                bodies.append(f.read())
+
+        for body in bodies:
+            stripper = HTMLStripper()
+            self.assertEqual(legacy.get_stripped_html(body), stripper.get_clear_data(body))
+            self.assertEqual(legacy.get_num_html_colors(body), stripper.num_colors)
+
     def test_get_emojies(self):
         body = """Первое предложение! 🤐 Второе предложение! 😞 Третье предложение. Какой хороший день 😀"""
         emojies = ContentParser.get_emojies(body)
         self.assertListEqual(['🤐', '😞', '😀'], emojies)
 
+    def test_get_multi_codepoint_emojies(self):
+        # Семья через ZWJ, флаг и оттенок кожи считаются одним emoji
+        body = "Семья 👨\u200d👩\u200d👧\u200d👦, флаг 🇷🇺 и палец 👍🏽"
+        emojies = ContentParser.get_emojies(body)
+        self.assertListEqual(['👨\u200d👩\u200d👧\u200d👦', '🇷🇺', '👍🏽'], emojies)
+
     def test_replace_special_char(self):
         body = """телефон: 89001112233. email: test@example.com. супер предложение: 88 штук за 123 ₽ или 2$.
         экономия составит 50%.      немного отступа после предложения.  {% [jinja_2_content] %}
@@ -39,6 +71,28 @@ class ContentParserTest(TestCase):
                             "phone_spec url_spec"
         self.assertEqual(predicted_content, content)
 
+    def test_nlp_resources_loaded_once(self):
+        resources = NLPResources.get()
+        ContentParser.analyze_words("телефон cat dog")
+        ContentParser.parse("<p>телефон cat dog</p>")
+
+        self.assertIs(resources, NLPResources.get())
+        stats = NLPResources.stats()
+        self.assertTrue(stats['loaded'])
+        self.assertGreaterEqual(stats['load_time'], 0)
+
+    def test_word_cache(self):
+        body = "телефон январь cat dog January"
+        word_cache = NLPResources.get().word_cache
+        word_cache.clear()
+
+        unknown_words, content = ContentParser.analyze_words(body)
+        hits = word_cache.hits
+        self.assertEqual(5, len(word_cache))
+
+        self.assertEqual((unknown_words, content), ContentParser.analyze_words(body))
+        self.assertEqual(hits + 5, word_cache.hits)
+
     def test_get_uppercase_words(self):
         body = "авыфавфыа СЛОВА В ВЕРХНЕМ РЕГИСТРЕ. АКЦИя ПРЕДЛОЖЕНИЯ скидки"
         upper_words = ContentParser.get_uppercase_words(body)
@@ -52,6 +106,94 @@ class ContentParserTest(TestCase):
         num_colors = ContentParser.get_num_html_colors(body)
         self.assertEqual(num_colors, 21)
 
+    def test_parse_message(self):
+        with open('spam_filter/tests/html_templates/template_1.html', 'r') as f:
+            body = f.read()
+
+        parsed = ContentParser.parse_message(body)
+        self.assertEqual(ContentParser.parse(body), parsed.body)
+        self.assertSetEqual(set(parsed.body.split(' ')), parsed.unique_tokens)
+        self.assertEqual(parsed.body.split(' ').count('number_spec'), parsed.num_numbers)
+        self.assertEqual(21, parsed.num_colors)
+        self.assertEqual(len(parsed.body) * 2 / 1024, parsed.content_size)
+
+        parsed.bayes_probability = 0.5
+        self.assertTupleEqual((*parsed.message_features, 0.5), parsed.features)
+
+        self.assertIsNone(ContentParser.parse_message('<p> </p>'))
+
+    def test_parse_cache(self):
+        body = '<p>Скидка 50% на все товары до 31 декабря! Shop now 🔥</p>'
+        cache = ParseCache(ContentParser.version)
+
+        with patch.object(ContentParser, 'parse_cache', cache):
+            parsed = ContentParser.parse_message(body, use_cache=True)
+            self.assertEqual(1, cache.stats()['misses'])
+
+            # Письма рассылки отличаются только числами и после нормализации совпадают
+            cached = ContentParser.parse_message(body.replace('31', '30'), use_cache=True)
+            self.assertEqual(1, cache.stats()['hits'])
+
+        self.assertListEqual(parsed.tokens, cached.tokens)
+        self.assertTupleEqual(ContentParser.parse_message(body).message_features, cached.message_features)
+        self.assertNotEqual(ParseCache(ContentParser.version + 1).get_key(body), cache.get_key(body))
+
+    def test_parse_budget(self):
+        paragraph = '<p style="color: red">Скидка 50% только сегодня 🔥 SALE running dogs</p>'
+        body = paragraph * 100
+        parsed = ContentParser.parse_message(body)
+        self.assertFalse(parsed.degraded)
+
+        # Разобрана десятая часть письма, абсолютные признаки пересчитаны на полный размер
+        budgets = (ParseBudget(max_body_size=len(paragraph) * 10), ParseBudget(max_tokens=len(parsed.tokens) // 10))
+
+        for budget in budgets:
+            truncated = ContentParser.parse_message(body, budget=budget)
+            self.assertTrue(truncated.degraded)
+            self.assertLess(len(truncated.tokens), len(parsed.tokens))
+
+            for feature, expected in zip(truncated.message_features, parsed.message_features):
+                self.assertAlmostEqual(expected, feature, delta=expected * 0.1)
+
+        expired = ContentParser.parse_message(paragraph, budget=ParseBudget(deadline=0))
+        self.assertTrue(expired.degraded)
+        self.assertTrue(expired.tokens)
+
+        # Время истекло после первой порции слов: начало разобрано полностью, остаток упрощенно
+        budget = ParseBudget(deadline=60)
+
+        with patch.object(ContentParser, 'budget_chunk_size', 10), \
+                patch.object(budget, 'expired', side_effect=[False, True]):
+            partial = ContentParser.parse_message(body, budget=budget)
+
+        self.assertTrue(partial.degraded)
+        self.assertAlmostEqual(len(parsed.tokens), len(partial.tokens), delta=len(parsed.tokens) * 0.1)
+
+    def test_parse_budget_bytes(self):
+        # Ограничение размера в байтах utf-8: кириллица занимает 2 байта на символ
+        budget = ParseBudget(max_body_size=100)
+        self.assertTupleEqual(('я' * 50, 20.0), budget.truncate_body('я' * 1000))
+        self.assertTupleEqual(('a' * 99, 100 / 99), budget.truncate_body('a' * 99 + 'я'))
+        self.assertTupleEqual(('я' * 50, 1.0), budget.truncate_body('я' * 50))
+
+    def test_parse_batch(self):
+        with open('spam_filter/tests/html_templates/template_1.html', 'r') as f:
+            body = f.read()
+
+        bodies = [body, '<p> </p>', 'Hello, running dogs! Привет, мир', '']
+        batch = ContentParser.parse_batch(bodies)
+        self.assertEqual(len(bodies), len(batch))
+
+        for parsed, single in zip(batch, map(ContentParser.parse_message, bodies)):
+            if single is None:
+                self.assertIsNone(parsed)
+            else:
+                self.assertListEqual(single.tokens, parsed.tokens)
+                self.assertTupleEqual(single.message_features, parsed.message_features)
+
+        self.assertListEqual([ContentParser.analyze_words(body) for body in bodies],
+                             ContentParser.analyze_words_batch(bodies))
+
     def test_parse(self):
         """
         Проверим что нет никаких артефактов на реальном html-документе. Все необходимые для распознавания подстановки
@@ -1,8 +1,16 @@
-from django.db.models import Sum
-from django.test import TestCase, TransactionTestCase
+from collections import Counter
 
+import numpy as np
+from django.db.models import F, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from spam_filter.bayes_cache import BayesCountsCache
+from spam_filter.bayes_snapshot import BayesHashedSnapshot, BayesSnapshot
 from spam_filter.learning_models import BayesModel, NN
 from spam_filter.mail_source import FileMailContentSource
+from spam_filter.models import BayesDelta, BayesHashedCounts, BayesMetadata, NNStructure
+from spam_filter.numpy_mlp import NumpyMLP
+from spam_filter.tests import legacy
 
 
 class BayesModelTest(TestCase):
@@ -27,6 +35,61 @@ class BayesModelTest(TestCase):
         new_aggr = BayesModel.db_model.objects.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
         self.assertEqual(2 * aggr['sum_spam'], new_aggr['sum_spam'])
         self.assertEqual(2 * aggr['sum_ham'], new_aggr['sum_ham'])
+        self.assertTupleEqual((new_aggr['sum_spam'], new_aggr['sum_ham']), BayesMetadata.objects.get_totals())
+
+        # Новый словарь сбрасывает общее количество слов
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        self.assertTupleEqual((aggr['sum_spam'], aggr['sum_ham']), BayesMetadata.objects.get_totals())
+
+    def test_snapshot(self):
+        version = BayesMetadata.objects.get_version()
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        self.assertEqual(version + 1, BayesMetadata.objects.get_version())
+
+        content = self.spam.get_content()[0]
+        probability = BayesModel.check_message_for_spam(content, return_probability=True)
+        stats = BayesSnapshot.stats()
+        self.assertTrue(stats['loaded'])
+        self.assertEqual(version + 1, stats['version'])
+        self.assertEqual(BayesModel.db_model.objects.count(), stats['words'])
+
+        with override_settings(BAYES_SNAPSHOT_ENABLED=False):
+            self.assertAlmostEqual(probability, BayesModel.check_message_for_spam(content, return_probability=True))
+
+        with override_settings(BAYES_SNAPSHOT_MAX_WORDS=0):
+            BayesSnapshot.invalidate()
+            self.assertIsNone(BayesSnapshot.get())
+
+    @override_settings(BAYES_SNAPSHOT_ENABLED=False, BAYES_CACHE_ENABLED=True)
+    def test_counts_cache(self):
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        version = BayesMetadata.objects.get_version()
+        words = ['url_spec', 'number_spec', 'unknown_word_spec']
+        found_words = BayesModel._get_word_counts(words)[0]
+
+        cached = BayesCountsCache.get_many(version, words)
+        self.assertSetEqual(set(words), set(cached))
+        self.assertSetEqual(set(found_words), {word for word, counts in cached.items() if counts is not None})
+
+        # Новая версия словаря читается по новым ключам, старые значения не сбрасываются
+        BayesModel.train(spam=self.spam, ham=self.ham)
+        self.assertDictEqual({}, BayesCountsCache.get_many(version + 1, words))
+        self.assertDictEqual(cached, BayesCountsCache.get_many(version, words))
+        content = self.spam.get_content()[0]
+        probability = BayesModel.check_message_for_spam(content, return_probability=True)
+
+        with override_settings(BAYES_SNAPSHOT_ENABLED=True):
+            self.assertAlmostEqual(probability, BayesModel.check_message_for_spam(content, return_probability=True))
+
+    def test_check_messages_for_spam(self):
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        messages = [self.spam.get_content()[0], self.ham.get_content()[0], '']
+        probabilities = BayesModel.check_messages_for_spam(messages, return_probability=True)
+
+        for message, probability in zip(messages, probabilities):
+            self.assertAlmostEqual(BayesModel.check_message_for_spam(message, return_probability=True), probability)
+
+        self.assertListEqual([True, False, False], BayesModel.check_messages_for_spam(messages))
 
     def test_train_min_word_appearance(self):
         BayesModel.train(spam=self.spam, ham=self.ham, init=True, min_num_word_appearance=2)
@@ -36,12 +99,142 @@ class BayesModelTest(TestCase):
         exists = BayesModel.db_model.objects.exclude(word__contains='subscrib').exists()
         self.assertFalse(exists)
 
+    def test_compact(self):
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        rare = BayesModel.db_model.objects.annotate(total=F('spam_count') + F('ham_count')).filter(total__lt=2)
+        rare_aggr = rare.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
+        rare_words = set(rare.values_list('word', flat=True))
+        totals = BayesMetadata.objects.get_totals()
+        version = BayesMetadata.objects.get_version()
+
+        report = BayesModel.compact(min_count=2)
+        self.assertEqual(report['rows_before'] - len(rare_words), report['rows_after'])
+        self.assertFalse(BayesModel.db_model.objects.filter(word__in=rare_words).exists())
+        self.assertEqual(version + 1, BayesMetadata.objects.get_version())
+
+        # Удаленные появления сохранены в pruned_word, общее количество слов не изменилось
+        pruned = BayesModel.db_model.objects.get(word=BayesModel.pruned_word)
+        self.assertTupleEqual((rare_aggr['sum_spam'], rare_aggr['sum_ham']), (pruned.spam_count, pruned.ham_count))
+        aggr = BayesModel.db_model.objects.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
+        self.assertTupleEqual(totals, (aggr['sum_spam'], aggr['sum_ham']))
+        self.assertTupleEqual(totals, BayesMetadata.objects.get_totals())
+
+        self._check_for_spam(self.spam.get_content()[0], True)
+        self._check_for_spam(self.ham.get_content()[0], False)
+
+    def test_prune(self):
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        rows = BayesModel.db_model.objects.order_by('word').values_list('id', 'word', 'spam_count', 'ham_count')
+        rows = list(rows[:3])
+        # Слово с неперенесенными приращениями не удаляется, иначе перенос журнала вернет его в словарь
+        BayesDelta.objects.create(word=rows[0][1], spam_count=1, ham_count=0)
+
+        deleted = BayesModel.db_model.objects.prune([row[0] for row in rows])
+        self.assertTupleEqual((2, sum(row[2] for row in rows[1:]), sum(row[3] for row in rows[1:])), tuple(deleted))
+        self.assertListEqual([rows[0][1]], list(BayesModel.db_model.objects.filter(
+            word__in=[row[1] for row in rows]).values_list('word', flat=True)))
+
+    @override_settings(BAYES_STORAGE='hashed', BAYES_HASH_BITS=16)
+    def test_hashed_storage(self):
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        self.assertFalse(BayesModel.db_model.objects.exists())
+        self.assertEqual(16, BayesHashedCounts.objects.get().bits)
+        self._check_for_spam(self.spam.get_content()[0], True)
+        self._check_for_spam(self.ham.get_content()[0], False)
+        totals = BayesHashedSnapshot.get().spam_total, BayesHashedSnapshot.get().ham_total
+
+        BayesModel.train(spam=self.spam, ham=self.ham)
+        snapshot = BayesHashedSnapshot.get()
+        self.assertTupleEqual((2 * totals[0], 2 * totals[1]), (snapshot.spam_total, snapshot.ham_total))
+        self._check_for_spam(self.spam.get_content()[0], True)
+        self._check_for_spam(self.ham.get_content()[0], False)
+
+    @override_settings(BAYES_WRITE_MODE='log')
+    def test_log_write_mode(self):
+        BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        self.assertFalse(BayesDelta.objects.exists())
+        words = dict(BayesModel.db_model.objects.values_list('word', 'spam_count'))
+        content = self.spam.get_content()[0]
+
+        # Дообучение пишет только в журнал, проверка видит словарь вместе с журналом
+        BayesModel.train(spam=self.spam, ham=self.ham)
+        self.assertEqual(len(words), BayesDelta.objects.count())
+        self.assertDictEqual(words, dict(BayesModel.db_model.objects.values_list('word', 'spam_count')))
+        probability = BayesModel.check_message_for_spam(content, return_probability=True)
+
+        with override_settings(BAYES_SNAPSHOT_ENABLED=False):
+            self.assertAlmostEqual(probability, BayesModel.check_message_for_spam(content, return_probability=True))
+
+        self.assertEqual(len(words), BayesModel.compact_deltas())
+        self.assertFalse(BayesDelta.objects.exists())
+        self.assertDictEqual({word: 2 * count for word, count in words.items()},
+                             dict(BayesModel.db_model.objects.values_list('word', 'spam_count')))
+        aggr = BayesModel.db_model.objects.aggregate(sum_spam=Sum('spam_count'), sum_ham=Sum('ham_count'))
+        self.assertTupleEqual((aggr['sum_spam'], aggr['sum_ham']), BayesMetadata.objects.get_totals())
+
+        BayesSnapshot.invalidate()
+        self.assertAlmostEqual(probability, BayesModel.check_message_for_spam(content, return_probability=True))
+
+
+class BayesHashedSnapshotTest(SimpleTestCase):
+
+    def test_get_counts(self):
+        words = [('spam', 3, 0), ('free', 2, 1), ('hello', 0, 4), ('empty', 0, 0)]
+        snapshot = BayesHashedSnapshot.from_words(0, 16, words)
+        self.assertEqual(3, len(snapshot))
+        self.assertTupleEqual((5, 5), (snapshot.spam_total, snapshot.ham_total))
+
+        found_words, spam_counts, ham_counts = snapshot.get_counts(['free', 'spam', 'empty'])
+        self.assertListEqual(['free', 'spam'], found_words)
+        self.assertListEqual([2, 3], spam_counts.tolist())
+        self.assertListEqual([1, 0], ham_counts.tolist())
+
+        # Одна корзина: появления всех слов складываются
+        snapshot = BayesHashedSnapshot.from_words(0, 0, words)
+        found_words, spam_counts, ham_counts = snapshot.get_counts(['unknown'])
+        self.assertListEqual(['unknown'], found_words)
+        self.assertListEqual([5, 5], [spam_counts[0], ham_counts[0]])
+
+
+class BayesScoringTest(SimpleTestCase):
+
+    def test_legacy_parity(self):
+        rng = np.random.RandomState(0)
+
+        for _ in range(500):
+            num_words = rng.randint(0, 300)
+            spam_counts = rng.randint(0, 50, num_words)
+            # Слово из словаря встречалось хотя бы раз
+            ham_counts = rng.randint(0, 50, num_words) + (spam_counts == 0)
+            sum_spam, sum_ham = int(spam_counts.sum()) + 101, int(ham_counts.sum()) + 97
+            word_dict = {'word%d' % i: (int(spam_counts[i]), int(ham_counts[i])) for i in range(num_words)}
+
+            self.assertAlmostEqual(legacy.bayes_spam_probability(word_dict, sum_spam, sum_ham),
+                                   BayesModel._get_spam_probability(spam_counts, ham_counts, sum_spam, sum_ham))
+
+    def test_strong_message(self):
+        spam_counts = np.full(100, 10 ** 6)
+        probability = BayesModel._get_spam_probability(spam_counts, np.zeros(100), 10 ** 6, 10 ** 6)
+        self.assertGreater(probability, 0.9)
+        self.assertLessEqual(probability, 1)
+        self.assertEqual(0.5, BayesModel._get_spam_probability(np.array([]), np.array([]), 1, 1))
+
+
+class BayesReduceTest(SimpleTestCase):
+
+    def test_reduce_counters(self):
+        counters = [Counter({'spam': 1, 'free': 2}), Counter(), Counter({'free': 1}), Counter({'money': 3, 'spam': 1})]
+        self.assertDictEqual({'spam': 2, 'free': 3, 'money': 3}, BayesModel._reduce_counters(counters))
+        self.assertDictEqual({}, BayesModel._reduce_counters([]))
+
 
 class NNModelTest(TransactionTestCase):
     def setUp(self):
         self.spam = FileMailContentSource('spam_filter/tests/html_templates/template_1.html', '**********\n')
         self.ham = FileMailContentSource('spam_filter/tests/html_templates/template_2.html', '**********\n')
         BayesModel.train(spam=self.spam, ham=self.ham, init=True)
+        # Модель процесса могла остаться от предыдущего теста, веса которого уже удалены из БД
+        NN.reset_model()
 
     def _check_for_spam(self, content, predicted_res):
         check_res = NN.check_message_for_spam(content)
@@ -60,3 +253,61 @@ class NNModelTest(TransactionTestCase):
         NN.train(learning_content=learning_content)
         self._check_for_spam(self.spam.get_content()[0], True)
         self._check_for_spam(self.ham.get_content()[0], False)
+
+    def test_model_holder(self):
+        learning_content = [(self.spam.get_content()[0], True), (self.ham.get_content()[0], False)]
+        NN.train(learning_content=learning_content, init=True)
+        version = NNStructure.objects.get_version()
+
+        model = NN.get_model()
+        self.assertIs(model, NN.get_model())
+        self.assertEqual(version, NN._model_version)
+
+        # Веса перезагружаются в ту же модель, когда меняется их версия
+        NN.train(learning_content=learning_content)
+        self.assertEqual(version + 1, NNStructure.objects.get_version())
+        self.assertIs(model, NN.get_model())
+        self.assertEqual(version + 1, NN._model_version)
+
+        # Пересозданная строка начинает версии заново. Веса перезагружаются по контрольной сумме
+        NNStructure.objects.all().delete()
+        NN.train(learning_content=learning_content, init=True)
+        version, checksum = NNStructure.objects.get_state()
+        NN.get_model()
+        self.assertTupleEqual((version, checksum), (NN._model_version, NN._model_checksum))
+
+    def test_check_messages_for_spam(self):
+        learning_content = [(self.spam.get_content()[0], True) for _ in range(250)]
+        learning_content.extend([(self.ham.get_content()[0], False) for _ in range(250)])
+        NN.train(learning_content=learning_content, init=True)
+
+        messages = [self.spam.get_content()[0], self.ham.get_content()[0], '']
+        probabilities = NN.check_messages_for_spam(messages, return_probability=True)
+        self.assertEqual(0.0, probabilities[2])
+
+        for message, probability in zip(messages, probabilities):
+            self.assertAlmostEqual(NN.check_message_for_spam(message, return_probability=True), probability, places=5)
+
+        self.assertListEqual([True, False, False], NN.check_messages_for_spam(messages))
+
+        # Пачки PARSE_BATCH_SIZE разбираются по очереди или параллельно, порядок результатов сохраняется
+        with override_settings(PARSE_BATCH_SIZE=2):
+            self.assertListEqual([True, False, False] * 2, NN.check_messages_for_spam(messages * 2))
+            self.assertListEqual([True, False, False] * 2, NN.check_messages_for_spam(messages * 2, parallel=True))
+
+    def test_numpy_backend(self):
+        learning_content = [(self.spam.get_content()[0], True) for _ in range(250)]
+        learning_content.extend([(self.ham.get_content()[0], False) for _ in range(250)])
+        NN.train(learning_content=learning_content, init=True)
+        keras_model = NN.get_model()
+
+        with override_settings(NN_INFERENCE_BACKEND='numpy'):
+            model = NN.get_model()
+            self.assertIsInstance(model, NumpyMLP)
+
+            # Те же веса из NNStructure дают те же предсказания, что и модель keras
+            features = np.random.RandomState(0).uniform(0, 1, size=(64, NN.num_metrics))
+            np.testing.assert_allclose(keras_model.predict(features), model.predict(features), atol=1e-5)
+
+            self._check_for_spam(self.spam.get_content()[0], True)
+            self._check_for_spam(self.ham.get_content()[0], False)
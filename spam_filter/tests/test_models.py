@@ -1,7 +1,9 @@
+import numpy as np
 from django.db import IntegrityError
 from django.test.testcases import TestCase
 
 from django_ml_spam_filter.utils import exec_in_parallel
+from spam_filter.learning_models import NN
 from spam_filter.models import NNStructure
 
 
@@ -18,3 +20,33 @@ class SingleRowTableTest(TestCase):
         exec_in_parallel(_create, args, processes_count=proc_num, need_db_refresh=True)
 
         self.assertEqual(1, NNStructure.objects.nocache().count())
+
+
+class NNStructureTest(TestCase):
+
+    def test_weights(self):
+        self.assertIsNone(NNStructure.objects.get_version())
+        self.assertIsNone(NN.load_weights())
+
+        weights = [np.arange(14, dtype=np.float64).reshape(7, 2), np.ones(2)]
+        NNStructure.objects.save_weights(NN.dump_weights(weights), NN.architecture)
+        NNStructure.objects.save_weights(NN.dump_weights(weights), NN.architecture)
+        version, loaded = NN.load_weights()
+
+        self.assertEqual(1, version)
+        self.assertEqual(version, NNStructure.objects.get_version())
+        self.assertEqual(len(weights), len(loaded))
+
+        for array, loaded_array in zip(weights, loaded):
+            self.assertEqual(np.float32, loaded_array.dtype)
+            np.testing.assert_array_equal(array, loaded_array)
+
+        NNStructure.objects.update(checksum='0' * 64)
+
+        with self.assertRaises(ValueError):
+            NN.load_weights()
+
+        NNStructure.objects.save_weights(NN.dump_weights(weights), 'input:7,dense:1:sigmoid')
+
+        with self.assertRaises(ValueError):
+            NN.load_weights()
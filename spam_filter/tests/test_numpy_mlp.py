@@ -0,0 +1,32 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from spam_filter.learning_models import NN
+from spam_filter.numpy_mlp import NumpyMLP
+
+
+class NumpyMLPTest(SimpleTestCase):
+    def test_keras_parity(self):
+        model = NN._build_model()
+        mlp = NumpyMLP(NN.architecture, model.get_weights())
+        x = np.random.RandomState(0).uniform(-1, 2, size=(256, NN.num_metrics)).astype(np.float32)
+
+        # Dropout при предсказании отключен и в keras, и в NumpyMLP
+        np.testing.assert_allclose(model.predict(x), mlp.predict(x), atol=1e-5)
+
+    def test_zero_weights(self):
+        mlp = NumpyMLP(NN.architecture)
+        np.testing.assert_array_equal(np.full((3, 1), 0.5, dtype=np.float32), mlp.predict(np.ones((3, 7))))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            NumpyMLP('input:7,dense:1:softmax')
+
+        with self.assertRaises(ValueError):
+            NumpyMLP('input:7,conv:3')
+
+        with self.assertRaises(ValueError):
+            NumpyMLP('dense:1:sigmoid')
+
+        with self.assertRaises(ValueError):
+            NumpyMLP('input:7,dense:1:sigmoid', [np.zeros((6, 1)), np.zeros(1)])
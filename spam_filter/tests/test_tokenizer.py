@@ -0,0 +1,33 @@
+import random
+
+from django.test import SimpleTestCase
+
+from spam_filter.tests import legacy
+from spam_filter.tokenizer import SpecialCharTokenizer
+
+
+class SpecialCharTokenizerTest(SimpleTestCase):
+    templates = ['spam_filter/tests/html_templates/template_1.html',
+                 'spam_filter/tests/html_templates/template_2.html']
+
+    def setUp(self):
+        self.tokenizer = SpecialCharTokenizer()
+
+    def test_equivalence_on_templates(self):
+        for template in self.templates:
+            with open(template, 'r') as f:
+                body = f.read()
+
+            self.assertEqual(legacy.replace_special_char(body), self.tokenizer.tokenize(body))
+
+    def test_equivalence_on_random_content(self):
+        """
+        Замены зависят от порядка, поэтому проверим на случайных сочетаниях символов-триггеров всех выражений
+        """
+        alphabet = list('ab_@.$₽()!?:\\/[]+8 9-{}%&;#"«»,“”*|\'\t\n\r\xa0Аб') + \
+            ['http://', 'www.', '.com', '{{', '{%', '%}', '}}', '&nbsp;', '8 900 111 22 33', '1.5₽', 'x' * 260]
+        rnd = random.Random(0)
+
+        for _ in range(5000):
+            body = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 30)))
+            self.assertEqual(legacy.replace_special_char(body), self.tokenizer.tokenize(body), repr(body))
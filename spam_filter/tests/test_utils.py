@@ -0,0 +1,68 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from django_ml_spam_filter.utils import iter_in_parallel
+from spam_filter.utils import LRUCache, MultiStringMatcher
+
+
+class LRUCacheTest(SimpleTestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+
+        # 'b' использовался давнее всех и должен быть вытеснен
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+        stats = cache.stats()
+        self.assertEqual(2, stats['size'])
+        self.assertEqual(3, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_threads(self):
+        # Потоки читают и вытесняют одни и те же ключи. Чтение вытесненного ключа - промах, а не KeyError
+        cache = LRUCache(4)
+
+        def _worker(offset):
+            for i in range(5000):
+                cache.set((i + offset) % 8, i)
+                cache.get((i + offset + 1) % 8)
+
+        threads = [threading.Thread(target=_worker, args=(offset,)) for offset in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        stats = cache.stats()
+        self.assertEqual(4, stats['size'])
+        self.assertEqual(4 * 5000, stats['hits'] + stats['misses'])
+
+
+class MultiStringMatcherTest(SimpleTestCase):
+
+    def test_longest_match(self):
+        matcher = MultiStringMatcher(['ab', 'abc', 'b', 'xy'])
+        # 'x' без 'y' не входит в набор, из 'ab' и 'abc' выбирается самая длинная строка
+        self.assertListEqual(['abc', 'b', 'ab', 'xy'], matcher.findall('abcbx abxy'))
+
+
+def _square(value):
+    return value * value
+
+
+class IterInParallelTest(SimpleTestCase):
+
+    def test_results(self):
+        # Порядок результатов не гарантируется
+        results = iter_in_parallel(_square, [((value,), {}) for value in range(20)], processes_count=3)
+        self.assertListEqual([value * value for value in range(20)], sorted(results))
+        self.assertListEqual([], list(iter_in_parallel(_square, [], processes_count=2)))
@@ -0,0 +1,135 @@
+import re
+from typing import Pattern
+
+
+class SpecialCharTokenizer:
+    """
+    Нормализует содержимое сообщения: заменяет емейлы, ссылки, телефоны, числа и денежные знаки на специальные слова
+    (email_spec, url_spec, phone_spec, number_spec...) и убирает пунктуацию.
+
+    Регулярные выражения компилируются один раз. Замены зависят от порядка (например, число внутри ссылки должно
+    стать url_spec, а не number_spec), поэтому проходы, которые влияют друг на друга, выполняются последовательно.
+    Остальные объединены: удаление и замена отдельных символов делается через str.translate за один проход,
+    пробельные символы схлопываются одним выражением.
+
+    Тяжелые выражения (емейлы, ссылки, телефоны, валюта) на каждой позиции жадно проходят слово до конца и
+    откатываются назад, т.е. работают за квадрат от длины слова. Совпадение каждого из них состоит только из символов
+    определенного класса и обязательно содержит символ-триггер (@ для емейла, точка для ссылки...). Поэтому такие
+    выражения применяются только к участкам из символов класса, в которых есть триггер.
+    """
+    underscores_re = re.compile(r'_{2,}')
+
+    email_re = re.compile(r"[A-z0-9.!#$%&'*+-/=?^_`{|}~@]+@[A-z0-9-\.:]+")
+    email_trigger_re = re.compile('@')
+    email_boundary_re = re.compile(r"[^A-z0-9.!#$%&'*+-/=?^_`{|}~@:]")
+
+    dollar_re = re.compile(r"((\d+|\s)\$)")
+    dollar_trigger_re = re.compile(r'\$')
+    dollar_boundary_re = re.compile(r'[^\d\s$]')
+
+    url_re = re.compile(r'(https?)?(:\/\/)?(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.'
+                        r'[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)')
+    url_trigger_re = re.compile(r'\.')
+    url_boundary_re = re.compile(r'[^-a-zA-Z0-9@:%._+~#=()?&/]')
+
+    ruble_re = re.compile(r"((\d+|\s)₽)")
+    ruble_trigger_re = re.compile('₽')
+    ruble_boundary_re = re.compile(r'[^\d\s₽]')
+
+    phone_re = re.compile(r'(((\+\d+)|(8))[\s-]?\d+[\s-]\d+[\s-]\d+[\s-]?\d+)|(((\+\d+)|(8))\d{10})')
+    phone_trigger_re = re.compile(r'[+8]')
+    phone_boundary_re = re.compile(r'[^\d\s+-]')
+
+    # jinja2 подстановки и html-символы &nbsp; и прочие
+    template_re = re.compile(r"\{(\{|%)\s?.+\s?(\}|%)\}|&[A-z0-9\#]{2,8};")
+    number_re = re.compile(r'\d+')
+    # \s включает в себя в том числе \t, \r, \n и \xa0
+    spaces_re = re.compile(r'\s+')
+
+    punctuation_table = str.maketrans('', '', '()!.?:\\/[]')
+    separators_table = str.maketrans(dict.fromkeys('"«»,-“”*|\';{}', ' '))
+
+    # Удаляем все длиннее 255 символов, потому что я не знаю таких длинных слов
+    max_word_length = 255
+
+    @staticmethod
+    def _sub_in_runs(body: str, trigger_re: Pattern, boundary_re: Pattern, pattern: Pattern, repl: str) -> str:
+        """
+        Применяет pattern только к участкам body, которые не содержат символов boundary_re и содержат trigger_re.
+        Результат совпадает с pattern.sub(repl, body), если любое совпадение pattern не содержит символов
+        boundary_re. К участку добавляется следующий за ним символ, чтобы \\b в конце участка работал как
+        в полном тексте
+        :param body: контент
+        :param trigger_re: выражение, без которого совпадение невозможно
+        :param boundary_re: выражение для символов, которые не могут входить в совпадение
+        :param pattern: выражение для замены
+        :param repl: замена
+        :return: контент после замены
+        """
+        trigger = trigger_re.search(body)
+
+        if not trigger:
+            return body
+
+        length = len(body)
+        reversed_body = body[::-1]
+        pieces = []
+        last = 0
+
+        while trigger:
+            # Граница перед триггером ищется в развернутой строке, чтобы не идти по символам назад
+            boundary = boundary_re.search(reversed_body, length - trigger.start())
+            start = length - boundary.start() if boundary else 0
+            boundary = boundary_re.search(body, trigger.end())
+            end = boundary.end() if boundary else length
+
+            pieces.append(body[last:start])
+            pieces.append(pattern.sub(repl, body[start:end]))
+            last = end
+            trigger = trigger_re.search(body, end)
+
+        pieces.append(body[last:])
+
+        return ''.join(pieces)
+
+    @classmethod
+    def _remove_long_words(cls, body: str) -> str:
+        """
+        Удаляет слова длиннее max_word_length. Слова в body уже разделены одиночными пробелами
+        :param body: контент
+        :return: контент без длинных слов
+        """
+        words = body.split(' ')
+
+        if max(map(len, words)) < cls.max_word_length:
+            return body
+
+        return ' '.join('' if len(word) >= cls.max_word_length else word for word in words)
+
+    def tokenize(self, body: str) -> str:
+        """
+        Нормализует содержимое
+        :param body: контент
+        :return: очищенный контент, слова разделены одним пробелом
+        """
+        if '__' in body:
+            body = self.underscores_re.sub('_', body)
+
+        body = self._sub_in_runs(body, self.email_trigger_re, self.email_boundary_re, self.email_re, ' email_spec ')
+        body = self._sub_in_runs(body, self.dollar_trigger_re, self.dollar_boundary_re, self.dollar_re,
+                                 ' dollar_spec ')
+        body = self._sub_in_runs(body, self.url_trigger_re, self.url_boundary_re, self.url_re, ' url_spec ')
+        body = self._sub_in_runs(body, self.ruble_trigger_re, self.ruble_boundary_re, self.ruble_re, ' ruble_spec ')
+        body = body.translate(self.punctuation_table)
+        body = self._sub_in_runs(body, self.phone_trigger_re, self.phone_boundary_re, self.phone_re, ' phone_spec ')
+
+        if '{' in body or '&' in body:
+            body = self.template_re.sub(' ', body)
+
+        body = body.translate(self.separators_table)
+        body = self.number_re.sub(' number_spec ', body)
+        # К этому моменту в тексте не осталось ни цифр, ни дефисов, поэтому процент - это только знак %
+        body = self.spaces_re.sub(' ', body).replace('%', 'percent_spec')
+        body = self._remove_long_words(body)
+
+        return body.strip()
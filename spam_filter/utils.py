@@ -1,5 +1,9 @@
 import hashlib
 import hmac
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Hashable, Iterable, List
 
 from django.conf import settings
 
@@ -13,3 +17,160 @@ def get_content_from_file(filename: str, delimiter: str, max_items: int = 0):
         result = f.read().split(delimiter)
 
         return result if not max_items else result[:max_items]
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш. При переполнении вытесняются записи, к которым дольше всего не обращались.
+    Считает попадания и промахи. Кэш общий для потоков процесса, поэтому операции выполняются под блокировкой:
+    иначе запись могла быть вытеснена между чтением и move_to_end
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: Максимальное количество записей
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Возвращает значение по ключу и отмечает его как недавно использованное
+        :param key: ключ
+        :param default: значение, если ключа нет в кэше
+        :return: значение из кэша или default
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Сохраняет значение, вытесняя самую старую запись при переполнении
+        :param key: ключ
+        :param value: значение
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: размер кэша, количество попаданий, промахов и доля попаданий
+        """
+        total = self.hits + self.misses
+
+        return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0}
+
+
+def build_trie_regex(strings: Iterable[str]) -> str:
+    """
+    Строит регулярное выражение, совпадающее с любой из строк. Строки объединяются в префиксное дерево, поэтому
+    на каждой позиции проверяется только одна ветка, а не все варианты подряд. Из нескольких подходящих строк
+    выбирается самая длинная
+    :param strings: строки для поиска
+    :return: регулярное выражение без групп захвата
+    """
+    trie = {}
+
+    for string in strings:
+        node = trie
+
+        for char in string:
+            node = node.setdefault(char, {})
+
+        # Пустой ключ - признак конца строки
+        node[''] = {}
+
+    def _to_regex(node: dict) -> str:
+        terminal = '' in node
+        branches = [re.escape(char) + _to_regex(child) for char, child in sorted(node.items()) if char]
+
+        if not branches:
+            return ''
+
+        regex = branches[0] if len(branches) == 1 else '(?:%s)' % '|'.join(branches)
+
+        return '(?:%s)?' % regex if terminal else regex
+
+    return _to_regex(trie)
+
+
+class MultiStringMatcher:
+    """
+    Поиск вхождений любой строки из большого набора, например всех emoji. Одно выражение на префиксном дереве
+    из тысяч строк медленное: на каждой позиции re перебирает все ветки верхнего уровня, а символы вне BMP
+    в классе символов проверяются линейно. Поэтому кандидаты сначала ищутся грубым классом по первым символам,
+    а продолжение проверяется небольшим выражением, построенным только для строк с этим первым символом.
+    Из нескольких подходящих строк выбирается самая длинная
+    """
+
+    def __init__(self, strings: Iterable[str]):
+        suffixes = defaultdict(set)
+
+        for string in strings:
+            if string:
+                suffixes[string[0]].add(string[1:])
+
+        # None - строки из одного символа без продолжений
+        self.tails = {char: None if tails == {''} else re.compile(build_trie_regex(tails))
+                      for char, tails in suffixes.items()}
+
+        bmp_chars = ''.join(re.escape(char) for char in sorted(suffixes) if ord(char) <= 0xFFFF)
+        wide_chars = [char for char in suffixes if ord(char) > 0xFFFF]
+        # Символы вне BMP заменяются одним диапазоном, лишние кандидаты отсеиваются по словарю tails
+        wide_range = '%s-%s' % (min(wide_chars), max(wide_chars)) if wide_chars else ''
+        self.start_re = re.compile('[%s%s]' % (bmp_chars, wide_range))
+
+    def findall(self, body: str) -> List[str]:
+        """
+        Находит непересекающиеся вхождения строк слева направо
+        :param body: текст
+        :return: список найденных строк
+        """
+        result = []
+        search = self.start_re.search
+        candidate = search(body)
+
+        while candidate:
+            start = candidate.start()
+            end = start + 1
+
+            char = body[start]
+
+            if char in self.tails:
+                tail = self.tails[char]
+                # Если сам символ тоже входит в набор, выражение продолжения совпадает с пустой строкой
+                match = tail.match(body, end) if tail is not None else None
+
+                if tail is None:
+                    result.append(char)
+                elif match:
+                    end = match.end()
+                    result.append(body[start:end])
+
+            candidate = search(body, end)
+
+        return result
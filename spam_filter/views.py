@@ -1,7 +1,9 @@
 import logging
 from rest_framework.views import APIView
+from statsd.defaults.django import statsd
 
 from django_ml_spam_filter.responses import APIResponse
+from spam_filter.content_parser import ContentParser, ParseBudget
 from spam_filter.learning_models import NN
 from spam_filter.models import LearningMessage
 from spam_filter.serializers import CheckContentSerializer, LearnContentSerializer
@@ -14,13 +16,21 @@ class CheckHandler(APIView):
     signed_field = 'content'
 
     def post(self, request):
+        # Время на разбор отсчитывается от начала обработки запроса
+        budget = ParseBudget.from_settings()
         serializer = CheckContentSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        spam = NN.check_message_for_spam(serializer.validated_data['content'])
+        parsed = ContentParser.parse_message(serializer.validated_data['content'], use_cache=True, budget=budget)
+        spam = NN.check_message_for_spam(parsed) if parsed else False
+        degraded = bool(parsed and parsed.degraded)
+
+        if degraded:
+            statsd.incr('check.degraded')
+
         LearningMessage.objects.create(message=serializer.validated_data['content'], spam=spam)
 
-        return APIResponse({'spam': spam})
+        return APIResponse({'spam': spam, 'degraded': degraded})
 
 
 class LearnHandler(APIView):